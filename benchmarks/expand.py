@@ -0,0 +1,112 @@
+# -*- coding: utf-8; -*-
+"""Measure how long it takes to expand a corpus of names into terms
+
+Run it from the root of the repository:
+
+    $ PYTHONPATH=. python benchmarks/expand.py
+
+The corpus is made of made-up words with accents, drawn from a vocabulary
+of `VOCABULARY_SIZE` words following Zipf's law, so a few words repeat a lot
+and most of them show up only once or twice, just like in real catalogues.
+Word lengths follow the ones of person and place names, from 2 to about 14
+letters, about 7 on average.
+
+The `expand()` of each word is memoized, so it's timed twice: with cold
+caches, which is what indexing a catalogue for the first time costs, and
+with warm ones, which is what indexing it again costs.
+"""
+from __future__ import print_function, unicode_literals
+from bisect import bisect
+from itertools import chain
+from timeit import timeit
+from unidecode import unidecode
+
+import random
+import suggestive
+
+
+VOCABULARY_SIZE = 50000
+
+SYLLABLES = [
+    'li', 'an', 'ma', 'ri', 'co', 'lo', 'ne', 'ta', 'sa', 'ka', 'ro', 'el',
+    'ja', 'mi', 'na', 'to', 'de', 'ba', 'go', 'ur', 'fá', 'bío', 'zoë',
+    'rè', 'søn', 'łu', 'ça', 'ğrı', 'ïs', 'ão', 'jör', 'řá', 'ñu', 'ël',
+    'hán', 'ü', 'ñez', 'str', 'sch', 'th', 'ck', 'w', 'y', 'x',
+]
+
+# How many syllables the words have, and how often, which makes them about
+# 7 letters long on average
+SYLLABLE_COUNTS = [1] * 5 + [2] * 30 + [3] * 40 + [4] * 20 + [5] * 5
+
+
+def vocabulary(size, rand):
+    words = set()
+    while len(words) < size:
+        word = ''.join(rand.choice(SYLLABLES)
+                       for _ in range(rand.choice(SYLLABLE_COUNTS)))
+        if len(word) > 1:
+            words.add(word.capitalize())
+    words = sorted(words)
+    rand.shuffle(words)
+    return words
+
+
+def legacy_expand(phrase, min_chars=1):
+    """The implementation of `suggestive.expand()` up to version 0.2.2"""
+    base = list(chain.from_iterable(
+        [word[0:index] for index, sub in enumerate(word, start=min_chars)]
+        for word in unidecode(phrase.lower()).split()))
+    result = set()
+    return [x for x in base if x not in result and not result.add(x)]
+
+
+def corpus(size, seed=42):
+    rand = random.Random(seed)
+    words = vocabulary(VOCABULARY_SIZE, rand)
+    ranks = []
+    total = 0.0
+    for rank in range(1, len(words) + 1):
+        total += 1.0 / rank
+        ranks.append(total)
+
+    def word():
+        return words[bisect(ranks, rand.random() * total)]
+    return [' '.join(word() for _ in range(rand.randint(2, 4)))
+            for _ in range(size)]
+
+
+def clear_caches():
+    suggestive._normalized_words.clear()
+    suggestive._word_prefixes.clear()
+
+
+def main(size=100000, repeat=3):
+    names = corpus(size)
+    for name in names[:100]:
+        assert legacy_expand(name) == suggestive.expand(name), name
+    distinct = len(set(w for n in names for w in n.split()))
+
+    def run_legacy():
+        return [legacy_expand(n) for n in names]
+
+    def run_cold():
+        clear_caches()
+        return [suggestive.expand(n) for n in names]
+
+    def run_warm():
+        return [suggestive.expand(n) for n in names]
+
+    legacy = min(timeit(run_legacy, number=1) for _ in range(repeat))
+    cold = min(timeit(run_cold, number=1) for _ in range(repeat))
+    run_warm()
+    warm = min(timeit(run_warm, number=1) for _ in range(repeat))
+    print('{} names, {} distinct words'.format(size, distinct))
+    print('legacy expand():      {:.3f}s'.format(legacy))
+    print('expand(), cold cache: {:.3f}s ({:.1f}x)'.format(
+        cold, legacy / cold))
+    print('expand(), warm cache: {:.3f}s ({:.1f}x)'.format(
+        warm, legacy / warm))
+
+
+if __name__ == '__main__':
+    main()
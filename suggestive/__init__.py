@@ -1,18 +1,101 @@
 # -*- coding: utf-8; -*-
 from __future__ import unicode_literals
-from collections import defaultdict
-from itertools import chain
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, deque, OrderedDict
+from functools import partial
+from itertools import islice
 from unidecode import unidecode
 
+import os
 import re
 import six
+import sys
+import copy
 import json
+import mmap
+import time
+import zlib
+import struct
+import threading
+import warnings
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = None
 
 
 __version__ = '0.2.2'
 
 
-def expand(phrase, min_chars=1):
+# How many words `normalize_word()` and `iexpand()` remember before starting
+# over. Catalogues repeat the same names over and over again, so caching the
+# normalized words and their prefixes saves most of the indexing time.
+NORMALIZATION_CACHE_SIZE = 100000
+
+_normalized_words = {}
+_word_prefixes = {}
+
+
+def normalize_word(word):
+    """Lower case and transliterate a word to ascii, just like this:
+
+        >>> normalize_word('Fábio')
+        'fabio'
+
+    Names repeat a lot, so the results are memoized. Transliterating might
+    produce more than one word, e.g., for chinese characters.
+    """
+    try:
+        return _normalized_words[word]
+    except KeyError:
+        if len(_normalized_words) >= NORMALIZATION_CACHE_SIZE:
+            _normalized_words.clear()
+        result = _normalized_words[word] = unidecode(word).lower().strip()
+        return result
+
+
+def normalize(phrase):
+    """Normalize all the words of `phrase`, read `normalize_word()`"""
+    return ' '.join(normalize_word(word) for word in phrase.split())
+
+
+def iexpand(phrase, min_chars=1, max_prefix_len=None):
+    """Generator version of `expand()`, it yields each prefix only once"""
+    seen = set()
+    for word in phrase.split():
+        for prefix in _prefixes(word, min_chars, max_prefix_len):
+            if prefix not in seen:
+                seen.add(prefix)
+                yield prefix
+
+
+def _prefixes(word, min_chars, max_prefix_len):
+    key = word, min_chars, max_prefix_len
+    try:
+        return _word_prefixes[key]
+    except KeyError:
+        pass
+    result = []
+    for normalized in normalize_word(word).split():
+        stop = len(normalized)
+        if max_prefix_len is not None and max_prefix_len < stop:
+            stop = max_prefix_len
+        result.extend(normalized[:index] for index in
+                      six.moves.range(min(min_chars, stop), stop + 1))
+    if len(_word_prefixes) >= NORMALIZATION_CACHE_SIZE:
+        _word_prefixes.clear()
+    _word_prefixes[key] = result
+    return result
+
+
+def expand(phrase, min_chars=1, max_prefix_len=None):
     """Turns strings like this:
 
         >>> data = "Lincoln"
@@ -21,12 +104,439 @@ def expand(phrase, min_chars=1):
 
         >>> expand(data)
         ['l', 'li', 'linc', 'linco', 'lincol', 'lincoln']
+
+    Prefixes longer than `max_prefix_len` are left out:
+
+        >>> expand(data, max_prefix_len=3)
+        ['l', 'li', 'lin']
+    """
+    return list(iexpand(phrase, min_chars, max_prefix_len))
+
+
+def expand_fields(doc, field, max_prefix_len=None):
+    """Expand the values of one or more fields of `doc` as a single phrase
+
+        >>> doc = {'first_name': 'Lincoln', 'last_name': 'Li'}
+        >>> expand_fields(doc, ['first_name', 'last_name'], 3)
+        ['l', 'li', 'lin']
+    """
+    fields = isinstance(field, list) and field or [field]
+    return expand(' '.join(doc[f] for f in fields),
+                  max_prefix_len=max_prefix_len)
+
+
+def fields_words(doc, field):
+    """List the normalized words of one or more fields of `doc`, once each
+
+        >>> fields_words({'a': 'Fábio Fabio', 'b': 'Fabs'}, ['a', 'b'])
+        ['fabio', 'fabs']
+    """
+    fields = isinstance(field, list) and field or [field]
+    return list(OrderedDict.fromkeys(
+        normalize(' '.join(doc[f] for f in fields)).split()))
+
+
+def lex_bucket(term):
+    """Name the vocabulary set of a word, read `RedisBackend` `lex_terms`
+
+    Words are kept by their first letter, words of a field apart from the
+    words of the other fields:
+
+        >>> lex_bucket('lincoln')
+        'l'
+        >>> lex_bucket('name:lincoln')
+        'name:l'
+    """
+    scope, colon, word = term.rpartition(':')
+    return scope + colon + word[:1]
+
+
+def phrase_terms(term, max_prefix_len=None):
+    """List the terms to intersect to answer a query with many words
+
+    Queries with a single word need no intersection, so they get an empty
+    list. The terms are sorted, so the same words in any order share the
+    same intersection:
+
+        >>> phrase_terms('smith john', 3)
+        ['joh', 'smi']
+        >>> phrase_terms('john')
+        []
+    """
+    words = term.split()
+    if len(words) < 2:
+        return []
+    return sorted(set(w[:max_prefix_len] for w in words))
+
+
+def scoped_term(fields, term):
+    """Name the term that holds the documents with `term` in any of `fields`
+
+    Backends with `field_postings` keep the terms of each field on their own
+    too, so queries can be limited to some of the fields. Field names must
+    not have commas, colons or spaces:
+
+        >>> scoped_term(['name'], 'li')
+        'name:li'
+        >>> scoped_term(['surname', 'name'], 'li')
+        'name,surname:li'
+    """
+    return '{}:{}'.format(','.join(sorted(fields)), term)
+
+
+def expand_scoped(doc, field, max_prefix_len=None):
+    """Expand the values of one or more fields of `doc` field by field
+
+        >>> expand_scoped({'name': 'Li', 'city': 'Rio'}, ['name', 'city'])
+        ['name:l', 'name:li', 'city:r', 'city:ri', 'city:rio']
+    """
+    fields = isinstance(field, list) and field or [field]
+    return [scoped_term([f], term) for f in fields
+            for term in expand(doc[f], max_prefix_len=max_prefix_len)]
+
+
+def ngram_term(field, gram):
+    """Name the term of the documents with `gram` inside a word of `field`
+
+        >>> ngram_term('name', 'col')
+        'name~col'
+    """
+    return '{}~{}'.format(field, gram)
+
+
+def word_ngrams(word, n):
+    """List the pieces of `word` with up to `n` letters, once each
+
+        >>> word_ngrams('lili', 2)
+        ['l', 'i', 'li', 'il']
+    """
+    return list(OrderedDict.fromkeys(
+        word[start:start + size] for size in six.moves.range(1, n + 1)
+        for start in six.moves.range(len(word) - size + 1)))
+
+
+def expand_ngrams(doc, ngrams):
+    """List the n-gram terms of `doc`, once each, read `ngram_term()`
+
+    The `ngrams` map the fields of `doc` to the most letters their n-grams
+    have:
+
+        >>> expand_ngrams({'name': 'Li', 'city': 'Rio'}, {'name': 2})
+        ['name~l', 'name~i', 'name~li']
+    """
+    return list(OrderedDict.fromkeys(
+        ngram_term(field, gram) for field, n in sorted(ngrams.items())
+        for word in normalize(doc[field]).split()
+        for gram in word_ngrams(word, n)))
+
+
+def query_ngrams(term, n):
+    """List the n-grams a query for the words of `term` intersects
+
+    Words with up to `n` letters are n-grams themselves, longer ones are
+    split in all their n-grams of `n` letters:
+
+        >>> query_ngrams('coln', 3)
+        ['col', 'oln']
+        >>> query_ngrams('co', 3)
+        ['co']
+    """
+    grams = set()
+    for word in term.split():
+        grams.update(word[i:i + n]
+                     for i in six.moves.range(max(len(word) - n, 0) + 1))
+    return sorted(grams)
+
+
+def index_cost(data, field, ngrams=None, max_prefix_len=None):
+    """Count the terms and the postings the documents of `data` take
+
+    The prefixes of `field` are counted apart from the n-grams of each field
+    of `ngrams`, so running it over a sample of the documents tells how
+    much more memory the n-grams would take:
+
+        >>> cost = index_cost([{'name': 'Lincoln'}], 'name', {'name': 3})
+        >>> cost['prefixes'], cost['ngrams']['name']
+        ({'terms': 7, 'postings': 7}, {'terms': 16, 'postings': 16})
+
+    Each term is a key in redis, and each posting a document in the sorted
+    set of a term, which takes a few dozen bytes plus the size of its id.
+    """
+    ngrams = ngrams or {}
+    terms = defaultdict(set)
+    postings = defaultdict(int)
+    for doc in data:
+        found = {None: expand_fields(doc, field, max_prefix_len)}
+        for f, n in ngrams.items():
+            found[f] = expand_ngrams(doc, {f: n})
+        for name, expanded in found.items():
+            terms[name].update(expanded)
+            postings[name] += len(expanded)
+
+    def cost(name):
+        return {'terms': len(terms[name]), 'postings': postings[name]}
+    return {'prefixes': cost(None),
+            'ngrams': dict((f, cost(f)) for f in ngrams)}
+
+
+def check_fields(backend, fields):
+    if fields and not backend.field_postings:
+        raise RuntimeError(
+            "Queries limited to `fields' need `field_postings'")
+
+
+def fuzzy_edits(term, max_edits):
+    """How many typos a fuzzy query for `term` tolerates
+
+    One every three letters, up to `max_edits`, so short prefixes don't
+    match just about anything:
+
+        >>> fuzzy_edits('li', 2)
+        0
+        >>> fuzzy_edits('lincl', 2)
+        1
+        >>> fuzzy_edits('linocln', 2)
+        2
+    """
+    return min(max_edits, len(term) // 3)
+
+
+def deletes(term, edits):
+    """Find all the strings left by deleting up to `edits` letters of `term`
+
+    Two terms within `edits` typos of each other always have one of them in
+    common, that's how fuzzy queries find their candidates:
+
+        >>> sorted(deletes('lin', 1))
+        ['in', 'li', 'lin', 'ln']
+    """
+    result = set([term])
+    found = [term]
+    for _ in six.moves.range(edits):
+        found = set(word[:i] + word[i + 1:] for word in found
+                    for i in six.moves.range(len(word)))
+        result.update(found)
+    return result
+
+
+def edit_distance(a, b):
+    """Count the typos that turn `a` into `b`
+
+    Each letter inserted, deleted or replaced is a typo, and so is each pair
+    of letters swapped:
+
+        >>> edit_distance('linocln', 'lincoln')
+        1
+        >>> edit_distance('lincl', 'linco')
+        1
+    """
+    previous, current = None, list(six.moves.range(len(b) + 1))
+    for i in six.moves.range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] * (len(b) + 1)
+        for j in six.moves.range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1,
+                             previous[j - 1] + cost)
+            if (i > 1 and j > 1 and a[i - 1] == b[j - 2] and
+                    a[i - 2] == b[j - 1]):
+                current[j] = min(current[j], before[j - 2] + 1)
+    return current[-1]
+
+
+def closest_terms(term, found, max_edits, size):
+    """Rank the terms `found` by their typos to `term`, keep the top `size`
+
+    Terms are kept when they're within the typos both of them tolerate, read
+    `fuzzy_edits()`. The closest come first, then the longest, which match
+    fewer documents:
+
+        >>> closest_terms('lincl', ['linc', 'linco', 'lin', 'rinco'], 2, 5)
+        [(1, 'linco'), (1, 'linc')]
+    """
+    edits = fuzzy_edits(term, max_edits)
+    ranked = []
+    for candidate in set(found):
+        distance = edit_distance(term, candidate)
+        if distance <= min(edits, fuzzy_edits(candidate, max_edits)):
+            ranked.append((distance, -len(candidate), candidate))
+    ranked.sort()
+    return [(distance, candidate)
+            for distance, _, candidate in ranked[:size]]
+
+
+def check_fuzzy(backend, fuzzy):
+    if fuzzy and not getattr(backend, 'max_edits', None):
+        raise RuntimeError("Fuzzy queries need `max_edits'")
+
+
+def check_infix(backend, infix, fields, words=False, fuzzy=False):
+    if not infix:
+        return
+    if words or fuzzy:
+        raise RuntimeError("Infix queries can't find `words' or be `fuzzy'")
+    if not [f for f in getattr(backend, 'ngrams', None) or ()
+            if not fields or f in fields]:
+        raise RuntimeError("Infix queries need the `ngrams' of the fields")
+
+
+def chunks(iterable, size):
+    """Split any iterable in lists with at most `size` items
+
+        >>> list(chunks(range(5), 2))
+        [[0, 1], [2, 3], [4]]
     """
-    base = list(chain.from_iterable(
-        [word[0:index] for index, sub in enumerate(word, start=min_chars)]
-        for word in unidecode(phrase.lower()).split()))
-    result = set()
-    return [x for x in base if x not in result and not result.add(x)]
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def shard_of(doc_id, shards):
+    """Pick one of `shards` for a document, the same one in any process
+
+        >>> shard_of('a1b2', 16)
+        8
+    """
+    key = six.text_type(doc_id).encode('utf-8')
+    return (zlib.crc32(key) & 0xffffffff) % shards
+
+
+HASH_TAG = re.compile(r'{([^}]+)}')
+
+
+def hash_tag(key):
+    """The part of `key` redis cluster hashes to find its slot, if any
+
+        >>> hash_tag('suggestive:{3}:d:li')
+        '3'
+    """
+    found = HASH_TAG.search(key)
+    return found and found.group(1)
+
+
+def index_in_chunks(index_chunk, data_source, size, progress=None, start=0):
+    """Call `index_chunk` with the documents of `data_source`, in chunks
+
+    Only `size` documents are held in memory at a time, so `data_source` can
+    be a generator of any size. After each chunk is indexed, `progress` is
+    called with the position in `data_source` indexing got to. Pass that
+    position as `start` to resume indexing the same `data_source` after a
+    failure, the documents before it are skipped. Returns how many documents
+    were indexed.
+    """
+    count = start
+    for chunk in chunks(islice(data_source, start, None), size):
+        index_chunk(chunk)
+        count += len(chunk)
+        if progress is not None:
+            progress(count)
+    return count - start
+
+
+def parallel_map(function, iterable, workers, backlog=2):
+    """Just like `map()`, but calls `function` in `workers` processes
+
+    Results are yielded in order. Only `workers * backlog` items are sent to
+    the processes ahead of the results read, so `iterable` doesn't need to
+    fit in memory.
+    """
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        for item in iterable:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= workers * backlog:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def prepare_chunk(backend, field, score, store, chunk):
+    # Runs in the worker processes of `RedisBackend.index()`
+    replacements, touched = backend._chunk_replacements(
+        chunk, field, score, store)
+    return len(chunk), replacements, touched
+
+
+class TruncatedQueryWarning(UserWarning):
+    """A query asked for documents beyond the postings kept for its term"""
+
+
+def term_capacity(max_postings_per_term, term):
+    """How many documents can be kept for `term`, `None` means all of them
+
+    The `max_postings_per_term` param of the backends is either a number or
+    a function that receives the term and returns a number. This way you can
+    keep less documents for short prefixes, which are the ones most
+    documents share:
+
+        >>> term_capacity(lambda term: 100 * len(term), 'li')
+        200
+    """
+    if callable(max_postings_per_term):
+        return max_postings_per_term(term)
+    return max_postings_per_term
+
+
+def warn_truncated(term, capacity):
+    warnings.warn(
+        'Only the top {} documents are kept for the term "{}", the results '
+        'might be incomplete'.format(capacity, term),
+        TruncatedQueryWarning, stacklevel=3)
+
+
+def project(doc, store, score='score'):
+    """Keep only the keys listed in `store`, plus the `id` and `score` ones
+
+    It's used by the `index()` method of the backends to save only the keys
+    needed to render the suggestions:
+
+        >>> doc = {'id': 0, 'name': 'Lincoln', 'bio': '...', 'score': 1}
+        >>> project(doc, ['name'])
+        {'id': 0, 'name': 'Lincoln', 'score': 1}
+    """
+    if store is None:
+        return doc
+    keys = set(store)
+    keys.update(('id', score))
+    return dict((k, v) for k, v in doc.items() if k in keys)
+
+
+WORD_PATTERN = re.compile(r'[\w-]+', re.U)
+
+
+def tokenize(doc):
+    """List the words found in the string values of `doc`
+
+    Each word shows up once, in the order they're found:
+
+        >>> tokenize({'blah': 'Rocky Balboa', 'bleh': 'Rocky, rock-n-roll'})
+        ['Rocky', 'Balboa', 'rock-n-roll']
+    """
+    seen = set()
+    result = []
+    for value in doc.values():
+        if isinstance(value, six.string_types):
+            for word in WORD_PATTERN.findall(value):
+                if word not in seen:
+                    seen.add(word)
+                    result.append(word)
+    return result
+
+
+def words_by_prefix(words):
+    """Map each prefix of the lower cased `words` to the words themselves
+
+        >>> words_by_prefix(['Li', 'lin'])
+        {'l': ['Li', 'lin'], 'li': ['Li', 'lin'], 'lin': ['lin']}
+    """
+    result = defaultdict(list)
+    for word in words:
+        lower = word.lower()
+        for index in six.moves.range(1, len(lower) + 1):
+            result[lower[:index]].append(word)
+    return dict(result)
 
 
 def find_words_in_doc(doc, term):
@@ -38,12 +548,125 @@ def find_words_in_doc(doc, term):
         >>> find_words_in_doc(doc, 'ro')
         ['Rocky', 'rock']
     """
-    sub = []
-    values = [v for v in doc.values() if isinstance(v, six.string_types)]
-    for value in values:
-        words = re.findall('[\w-]+', value, re.I | re.U)
-        sub.extend(w for w in words if w.lower().startswith(term))
-    return list(sub)
+    return [w for w in tokenize(doc) if w.lower().startswith(term)]
+
+
+class Postings(object):
+    """Document ids of a term, always sorted by their score
+
+    Each document is added with a `key` that must be comparable with the keys
+    of all the other documents of the term, usually a `(score, serial)` tuple.
+    Both adding and finding a document are just a binary search away, so the
+    order stays right no matter when the document gets indexed:
+
+        >>> postings = Postings()
+        >>> postings.add((2, 0), 'b')
+        >>> postings.add((1, 1), 'a')
+        >>> list(postings)
+        ['a', 'b']
+        >>> list(postings.iterate(reverse=True, stop=1))
+        ['b']
+    """
+    def __init__(self):
+        self._keys = []
+        self._ids = []
+
+        # Tells if any id was ever dropped by `trim()`
+        self.truncated = False
+
+    @classmethod
+    def from_sorted(cls, keys, ids, truncated=False):
+        """Build the postings of `ids` whose `keys` are already sorted"""
+        postings = cls()
+        postings._keys = list(keys)
+        postings._ids = list(ids)
+        postings.truncated = truncated
+        return postings
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __contains__(self, key):
+        index = bisect_left(self._keys, key)
+        return index < len(self._keys) and self._keys[index] == key
+
+    def add(self, key, doc_id):
+        index = bisect_right(self._keys, key)
+        self._keys.insert(index, key)
+        self._ids.insert(index, doc_id)
+
+    def remove(self, key):
+        index = bisect_left(self._keys, key)
+        if key in self:
+            del self._keys[index]
+            del self._ids[index]
+
+    def trim(self, size):
+        """Drop the ids with the lowest scores, keeping only `size` of them"""
+        excess = len(self._ids) - size
+        if excess > 0:
+            del self._keys[:excess]
+            del self._ids[:excess]
+            self.truncated = True
+
+    def iterate(self, reverse=False, start=0, stop=None):
+        """Yield the ids between the positions `start` and `stop`
+
+        Positions are counted from the lowest score, or from the highest one
+        when `reverse` is true. Only the requested ids are visited.
+        """
+        size = len(self._ids)
+        stop = size if stop is None else min(stop, size)
+        for position in six.moves.range(start, stop):
+            yield self._ids[size - position - 1 if reverse else position]
+
+
+class FuzzyIndex(object):
+    """Finds the terms within a few typos of a query
+
+    Each term is kept under all its `deletes()`, as many as its length
+    tolerates, so finding the candidates of a query takes a lookup for each
+    one of its own deletes:
+
+        >>> index = FuzzyIndex(max_edits=1)
+        >>> index.add('linco')
+        >>> index.find('lincl', size=10)
+        [(1, 'linco')]
+    """
+    def __init__(self, max_edits):
+        self.max_edits = max_edits
+        self.terms = set()
+        self._deletes = defaultdict(set)
+
+    def _deletes_of(self, term):
+        return deletes(term, fuzzy_edits(term, self.max_edits))
+
+    def add(self, term):
+        if term in self.terms:
+            return
+        self.terms.add(term)
+        for variant in self._deletes_of(term):
+            self._deletes[variant].add(term)
+
+    def discard(self, term):
+        if term not in self.terms:
+            return
+        self.terms.discard(term)
+        for variant in self._deletes_of(term):
+            found = self._deletes[variant]
+            found.discard(term)
+            if not found:
+                del self._deletes[variant]
+
+    def find(self, term, size):
+        """The `size` terms closest to `term`, read `closest_terms()`"""
+        found = set()
+        for variant in self._deletes_of(term):
+            found.update(self._deletes.get(variant, ()))
+        return closest_terms(term, found, self.max_edits, size)
 
 
 class DummyBackend(object):
@@ -68,16 +691,113 @@ class DummyBackend(object):
         [{'id': 0, 'name': 'Lincoln'}]
 
     Boom!
+
+    Passing `max_postings_per_term` keeps only the documents with the
+    highest scores in each term. Read `term_capacity()` for the accepted
+    values. A `TruncatedQueryWarning` is issued when a query needs the
+    documents that were left out, which is always the case when a truncated
+    term is read in ascending order, the default, since those are the ones
+    with the lowest scores.
+
+    Passing `max_prefix_len` saves the memory of long prefixes, which are
+    shared by few documents anyway. Longer queries are answered with the
+    documents of their first `max_prefix_len` characters, so they might get
+    documents that only share that much with the query.
+
+    Queries with more than one word get the documents found in the terms of
+    all the words, and the words of the documents that start with the last
+    one. The intersections are kept until the next document is indexed or
+    removed, so typing a phrase word by word doesn't intersect the same
+    terms over and over again.
+
+    With `field_postings`, the terms of each indexed field are also kept on
+    their own, read `scoped_term()`, and queries can be limited to the
+    documents found in some of the `fields`. Queries for many fields get the
+    union of their terms, kept just like the intersections.
+
+    With `max_edits`, queries can be `fuzzy`, and tolerate up to that many
+    typos, read `fuzzy_edits()`. The prefixes of the documents are kept in a
+    `FuzzyIndex`, and each query reads the documents of the `fuzzy_terms`
+    terms closest to it, the closest terms first, then the highest scores.
+    That bounds the work of each query, no matter how many terms are close.
+    Phrases are answered without typos.
+
+    The `ngrams` param maps fields to the most letters of their n-grams,
+    read `word_ngrams()`. The n-grams of these fields are kept as terms of
+    their own, read `ngram_term()`, and `infix` queries find the documents
+    with the words of the query anywhere inside the words of these fields,
+    or of the ones in `fields`. Queries as long as the n-grams, or shorter,
+    read a single term, longer ones get the intersection of their n-grams,
+    kept just like the ones of the phrases. They might find documents that
+    have all the n-grams but not the query itself. N-grams take a lot of
+    memory, read `index_cost()`.
+
+    Everything is gone with the instance, unless it's saved with `save()`
+    and read back with `load()`, which skips expanding the documents all
+    over again:
+
+        >>> backend.save('names.snapshot')
+        >>> backend = DummyBackend.load('names.snapshot', log='names.log')
+
+    Passing a `log` path appends every change made to the backend to that
+    file, and replays the changes already found in there. Saving a snapshot
+    empties the log, so loading the last snapshot with its log gets back
+    all the changes. Snapshots and logs encode the documents with the
+    `codec`.
     """
-    def __init__(self):
+
+    MAGIC = b'SGDS'
+    VERSION = 1
+
+    def __init__(self, max_postings_per_term=None, max_prefix_len=None,
+                 chunk_size=1000, field_postings=False, log=None,
+                 codec=None, max_edits=None, fuzzy_terms=10, ngrams=None):
+        self.max_postings_per_term = max_postings_per_term
+        self.max_prefix_len = max_prefix_len
+        self.chunk_size = chunk_size
+        self.field_postings = field_postings
+        self.codec = codec or JsonCodec()
+        self.max_edits = max_edits
+        self.fuzzy_terms = fuzzy_terms
+        self.ngrams = ngrams
         self._documents = {}
-        self._terms = defaultdict(list)
+
+        # Each term maps to the `Postings` of the documents sorted by score
+        # and each document id maps to the terms it was added to. That's the
+        # same trick the redis backend does with the `KeyManager.for_cache()`
+        # keys, it makes removing a document cost only as much as the document
+        # itself.
+        self._terms = defaultdict(Postings)
+        self._cache = {}
+
+        # The words of each document, found at index time, so queries for
+        # words are just a lookup per document. Read `words_by_prefix()`.
+        self._words = {}
+
+        # The position of each document inside of the postings. The serial
+        # number breaks ties between documents with the same score in the
+        # order they were indexed.
+        self._keys = {}
+        self._serial = 0
+
+        # The intersections of the terms of the phrases and the unions of the
+        # terms of the fields queried since the last change, read
+        # `phrase_terms()` and `scoped_term()`.
+        self._phrases = {}
+
+        # The terms that fuzzy queries can find, all but the scoped ones
+        self._fuzzy = max_edits and FuzzyIndex(max_edits) or None
+
+        self._log = None
+        if log is not None:
+            self._open_log(log)
 
     def documents(self):
         """Return all indexed documents"""
         return self._documents
 
-    def index(self, data, field, score='score'):
+    def index(self, data, field, score='score', store=None, progress=None,
+              start=0):
         """Index a list of documents
 
         Before receiving suggestions, you need to feed a database with all the
@@ -100,17 +820,84 @@ class DummyBackend(object):
         way, the following example is still valid:
 
             >>> index([{'id': 0, 'name': 'Lincoln'}], field='name', score='id')
+
+        The param `store` lists the keys that should be kept in the stored
+        documents, use it to save only what's needed to render the
+        suggestions. Read the `project()` docs for more info.
+
+        The `data` is read in chunks of `chunk_size` documents, the params
+        `progress` and `start` report and resume the progress made. Read the
+        `index_in_chunks()` docs for more info.
         """
-        count = 0
-        for doc in sorted(data, key=lambda x: x[score]):
+        return index_in_chunks(
+            lambda chunk: self._index_chunk(chunk, field, score, store),
+            data, self.chunk_size, progress, start)
+
+    def _index_chunk(self, chunk, field, score, store):
+        self._apply_chunk(chunk, field, score, store)
+        self._write_log('index', chunk, field, score, store)
+
+    def _apply_chunk(self, chunk, field, score, store):
+        for doc in chunk:
             doc_id = doc['id']
-            self.remove(doc_id)
-            self._documents[doc_id] = doc
-            for f in isinstance(field, list) and field or [field]:
-                for term in expand(doc[f]):
-                    self._terms[term].append(doc_id)
-            count += 1
-        return count
+            self._remove(doc_id)
+            stored = self._documents[doc_id] = project(doc, store, score)
+            self._words[doc_id] = words_by_prefix(tokenize(stored))
+            key = self._keys[doc_id] = (doc[score], self._serial)
+            terms = self._cache[doc_id] = set()
+            for term in self._expand(doc, field):
+                self._add(term, key, doc_id)
+                terms.add(term)
+            if self._fuzzy is not None:
+                for term in expand_fields(doc, field, self.max_prefix_len):
+                    self._fuzzy.add(term)
+            self._serial += 1
+
+    def _expand(self, doc, field):
+        terms = expand_fields(doc, field, self.max_prefix_len)
+        if self.field_postings:
+            terms += expand_scoped(doc, field, self.max_prefix_len)
+        if self.ngrams:
+            terms += expand_ngrams(doc, self.ngrams)
+        return terms
+
+    def terms(self, doc_ids):
+        """Return all the terms the documents in `doc_ids` were added to"""
+        result = set()
+        for doc_id in doc_ids:
+            result.update(self._cache.get(doc_id, ()))
+        return result
+
+    def update_score(self, doc_id, score, score_field='score'):
+        """Change the score of a document without indexing it again
+
+        The stored document gets the new score in its `score_field` and
+        moves to its new position in all its terms. Returns the new score,
+        or raises `KeyError` if the document isn't indexed.
+        """
+        doc = self._documents[doc_id]
+        self._documents[doc_id] = dict(doc, **{score_field: score})
+        self._phrases.clear()
+
+        old = self._keys[doc_id]
+        key = self._keys[doc_id] = (score, old[1])
+        for term in self._cache[doc_id]:
+            self._terms[term].remove(old)
+            self._add(term, key, doc_id)
+        self._write_log('score', doc_id, score, score_field)
+        return score
+
+    def incr_score(self, doc_id, delta, score_field='score'):
+        """Add `delta` to the score of a document, read `update_score()`"""
+        score = self._documents[doc_id][score_field] + delta
+        return self.update_score(doc_id, score, score_field)
+
+    def _add(self, term, key, doc_id):
+        postings = self._terms[term]
+        postings.add(key, doc_id)
+        capacity = term_capacity(self.max_postings_per_term, term)
+        if capacity is not None:
+            postings.trim(capacity)
 
     def remove(self, doc_id):
         """Remove a document from the storage and all its terms too
@@ -118,125 +905,2219 @@ class DummyBackend(object):
         This method is smart enough to don't cleanup terms used for more than
         one document.
         """
+        self._remove(doc_id)
+        self._write_log('remove', doc_id)
+
+    def _remove(self, doc_id):
+        self._phrases.clear()
+
         # Cleaning up terms
-        for term, docs in self._terms.items():
-            if doc_id in docs:
-                docs.remove(doc_id)
-                if not docs:
-                    del self._terms[term]
+        key = self._keys.pop(doc_id, None)
+        for term in self._cache.pop(doc_id, ()):
+            docs = self._terms[term]
+            docs.remove(key)
+            if not docs:
+                del self._terms[term]
+                if self._fuzzy is not None:
+                    self._fuzzy.discard(term)
 
         # Cleaning up the actual document
         if doc_id in self._documents:
             del self._documents[doc_id]
+            del self._words[doc_id]
+
+    def _intersect(self, found):
+        # The documents found in all the postings, sorted by score. The
+        # smallest postings are walked and each of their documents is binary
+        # searched in the other ones.
+        if not all(found):
+            return None
+        found = sorted(found, key=len)
+        result = Postings()
+        for doc_id in found[0]:
+            key = self._keys[doc_id]
+            if all(key in postings for postings in found[1:]):
+                result.add(key, doc_id)
+        return result
 
-    def query(self, term, reverse=False, words=False, limit=-1, offset=0):
-        result = []
+    def _union(self, found):
+        # The documents found in any of the postings, sorted by score
+        result = Postings()
+        for postings in found:
+            if postings is None:
+                continue
+            result.truncated = result.truncated or postings.truncated
+            for doc_id in postings:
+                key = self._keys[doc_id]
+                if key not in result:
+                    result.add(key, doc_id)
+        return result or None
+
+    def _postings(self, term, fields):
+        # The postings of a single word, in all the fields or in `fields`
+        if not fields:
+            return self._terms.get(term)
+        if len(fields) == 1:
+            return self._terms.get(scoped_term(fields, term))
+        key = scoped_term(fields, term)
+        if key not in self._phrases:
+            self._phrases[key] = self._union(
+                [self._terms.get(scoped_term([f], term)) for f in fields])
+        return self._phrases[key]
+
+    def _infix_postings(self, term, fields):
+        # The intersection of the n-grams of `term` in each field, or the
+        # union of the ones of all the fields
+        keys = []
+        for field, n in sorted(self.ngrams.items()):
+            if not fields or field in fields:
+                keys.append(tuple(
+                    ngram_term(field, gram) for gram in query_ngrams(term, n)))
+        for key in keys:
+            if key not in self._phrases:
+                self._phrases[key] = self._intersect(
+                    [self._terms.get(t) for t in key])
+        if len(keys) == 1:
+            return self._phrases[keys[0]]
+        key = sum(keys, ())
+        if key not in self._phrases:
+            self._phrases[key] = self._union([self._phrases[k] for k in keys])
+        return self._phrases[key]
+
+    def query(self, term, reverse=False, words=False, limit=-1, offset=0,
+              fields=None, fuzzy=False, infix=False):
+        check_infix(self, infix, fields, words, fuzzy)
+        if not infix:
+            check_fields(self, fields)
+        check_fuzzy(self, fuzzy)
         term = term.lower()
-        documents = self.documents()
+        terms = phrase_terms(term, self.max_prefix_len)
+        stop = limit >= 0 and (offset + limit) or None
+        if infix:
+            postings = term.strip() and self._infix_postings(
+                term, fields) or None
+        elif terms:
+            key = tuple(fields and [scoped_term(fields, t) for t in terms] or
+                        terms)
+            if key not in self._phrases:
+                self._phrases[key] = self._intersect(
+                    [self._postings(t, fields) for t in terms])
+            postings = self._phrases[key]
+            term = term.split()[-1]
+        elif fuzzy:
+            return self._fuzzy_query(
+                term[:self.max_prefix_len], reverse, words, offset, stop,
+                fields)
+        else:
+            postings = self._postings(term[:self.max_prefix_len], fields)
+        if postings is None:
+            return []
+
+        # Documents can be sliced straight from the postings. Words can't,
+        # since a document might have many (or no new) words, so we walk
+        # the postings until we have enough of them. The ids left out of a
+        # truncated term are the lowest ones, the first an ascending read
+        # would return.
+        if not words:
+            if postings.truncated and (
+                    not reverse or stop is None or stop > len(postings)):
+                warn_truncated(term, len(postings))
+            return [self._documents[doc_id]
+                    for doc_id in postings.iterate(reverse, offset, stop)]
+
+        if postings.truncated and not reverse:
+            warn_truncated(term, len(postings))
+        result = []
+        seen = set()
+        for doc_id in postings.iterate(reverse):
+            for word in self._words[doc_id].get(term, ()):
+                if word not in seen:
+                    seen.add(word)
+                    result.append(word)
+            if stop is not None and len(result) >= stop:
+                break
+        else:
+            if postings.truncated and reverse:
+                warn_truncated(term, len(postings))
+        return result[offset:stop]
+
+    def _fuzzy_query(self, term, reverse, words, start, stop, fields):
+        groups = OrderedDict()
+        for distance, found in self._fuzzy.find(term, self.fuzzy_terms):
+            groups.setdefault(distance, []).append(found)
+        matches = self._fuzzy_matches(groups.values(), reverse, fields)
+        if not words:
+            return [self._documents[doc_id]
+                    for doc_id, _ in islice(matches, start, stop)]
+
+        result = []
+        seen = set()
+        for doc_id, terms in matches:
+            for found in terms:
+                for word in self._words[doc_id].get(found, ()):
+                    if word not in seen:
+                        seen.add(word)
+                        result.append(word)
+            if stop is not None and len(result) >= stop:
+                break
+        return result[start:stop]
+
+    def _fuzzy_matches(self, groups, reverse, fields):
+        # Yields the documents of each group of terms as far from the query
+        # as each other, sorted by score, along with the terms of the group.
+        # Documents found by a closer group are left out.
+        seen = set()
+        for terms in groups:
+            postings = self._union([self._postings(t, fields) for t in terms])
+            for doc_id in postings.iterate(reverse) if postings else ():
+                if doc_id not in seen:
+                    seen.add(doc_id)
+                    yield doc_id, terms
+
+    def query_many(self, terms, reverse=False, words=False, limit=-1,
+                   offset=0, fields=None, fuzzy=False, infix=False):
+        """Answer a query for each one of `terms`, in a list"""
+        return [self.query(term, reverse, words, limit, offset, fields, fuzzy,
+                           infix) for term in terms]
+
+    def save(self, path):
+        """Save a snapshot of the backend to `path`, read `load()`
+
+        The snapshot is written next to `path` and then renamed, so a crash
+        never leaves half of a snapshot behind. The log, if any, is emptied
+        afterwards, since the snapshot has all its changes.
+        """
+        numbers = dict((doc_id, n) for n, doc_id in enumerate(self._keys))
+        terms = sorted(set(self._terms).union(*self._cache.values()))
+        positions = dict((term, n) for n, term in enumerate(terms))
+
+        sections = OrderedDict((name, array(UINT32, [0])) for name in [
+            'term_offsets', 'postings_offsets', 'cache_offsets'])
+        sections['terms'] = bytearray()
+        sections['postings'] = array(UINT32)
+        sections['truncated'] = array(UINT32)
+        sections['cache'] = array(UINT32)
+        for n, term in enumerate(terms):
+            postings = self._terms.get(term, ())
+            sections['terms'].extend(term.encode('utf-8'))
+            sections['term_offsets'].append(len(sections['terms']))
+            sections['postings'].extend(numbers[i] for i in postings)
+            sections['postings_offsets'].append(len(sections['postings']))
+            if getattr(postings, 'truncated', False):
+                sections['truncated'].append(n)
+        for doc_id in self._keys:
+            sections['cache'].extend(
+                positions[term] for term in self._cache[doc_id])
+            sections['cache_offsets'].append(len(sections['cache']))
+        sections['fuzzy'] = array(UINT32, sorted(
+            positions[term] for term in getattr(self._fuzzy, 'terms', ())))
+        sections['documents'] = bytearray(self._encode([
+            [doc_id, key[0], key[1], self._documents[doc_id]]
+            for doc_id, key in self._keys.items()]))
+
+        max_postings_per_term = self.max_postings_per_term
+        header = {
+            'version': self.VERSION,
+            'serial': self._serial,
+            'max_postings_per_term': None if callable(
+                max_postings_per_term) else max_postings_per_term,
+            'max_prefix_len': self.max_prefix_len,
+            'field_postings': self.field_postings,
+            'max_edits': self.max_edits,
+            'fuzzy_terms': self.fuzzy_terms,
+            'ngrams': self.ngrams,
+        }
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as target:
+            target.write(pack_sections(
+                self.MAGIC, header, list(sections.items())))
+        os.rename(temporary, path)
+        if self._log is not None:
+            self._log.truncate(0)
+
+    @classmethod
+    def load(cls, path, log=None, **kwargs):
+        """Read a snapshot written by `save()`
+
+        The settings of the backend are read from the snapshot, but the
+        `kwargs` take precedence. A `max_postings_per_term` function isn't
+        saved, so pass it again. The `log`, if any, is replayed on top of
+        the snapshot and receives the changes made from now on.
+        """
+        with open(path, 'rb') as source:
+            buf = source.read()
+        header = read_header(
+            buf, cls.MAGIC, cls.VERSION, 'suggestive snapshot')
+        settings = dict(
+            (name, header[name]) for name in
+            ['max_postings_per_term', 'max_prefix_len', 'field_postings',
+             'max_edits', 'fuzzy_terms', 'ngrams'])
+        settings.update(kwargs)
+        backend = cls(**settings)
+
+        views = dict((name, memoryview(buf)[start:start + length])
+                     for name, (start, length) in header['sections'].items())
+        ints = dict((name, uint32_view(buf, start, length // 4))
+                    for name, (start, length) in header['sections'].items()
+                    if name != 'terms' and name != 'documents')
+        records = backend.codec.loads(bytes(views['documents']))
+        ids = [record[0] for record in records]
+        keys = [(record[1], record[2]) for record in records]
+        for doc_id, key, record in zip(ids, keys, records):
+            backend._documents[doc_id] = record[3]
+            backend._words[doc_id] = words_by_prefix(tokenize(record[3]))
+            backend._keys[doc_id] = key
+        backend._serial = header['serial']
+
+        terms = read_terms(views['terms'], ints['term_offsets'])
+        truncated = set(ints['truncated'])
+        postings, offsets = ints['postings'], ints['postings_offsets']
+        for n, term in enumerate(terms):
+            found = postings[offsets[n]:offsets[n + 1]]
+            if len(found) or n in truncated:
+                backend._terms[term] = Postings.from_sorted(
+                    [keys[i] for i in found], [ids[i] for i in found],
+                    n in truncated)
+        cache, offsets = ints['cache'], ints['cache_offsets']
+        for n, doc_id in enumerate(ids):
+            backend._cache[doc_id] = set(
+                terms[t] for t in cache[offsets[n]:offsets[n + 1]])
+        if backend._fuzzy is not None:
+            for n in ints['fuzzy']:
+                backend._fuzzy.add(terms[n])
+
+        if log is not None:
+            backend._open_log(log)
+        return backend
+
+    def _open_log(self, path):
+        # Replay the changes saved in the log and keep appending to it. A
+        # change that was only partly written when the process died is
+        # dropped, it was never applied anyway.
+        size = 0
+        if os.path.exists(path):
+            with open(path, 'rb') as source:
+                for operation, size in self._read_log(source):
+                    self._replay(operation)
+        self._log = open(path, 'ab')
+        self._log.truncate(size)
+
+    def _read_log(self, source):
+        # Each change is a little endian size followed by the encoded
+        # change, yielded with the position where it ends
+        position = 0
+        while True:
+            prefix = source.read(4)
+            if len(prefix) < 4:
+                return
+            size, = struct.unpack('<I', prefix)
+            payload = source.read(size)
+            if len(payload) < size:
+                return
+            position += 4 + size
+            yield self.codec.loads(payload), position
+
+    def _replay(self, operation):
+        name, args = operation[0], operation[1:]
+        if name == 'index':
+            self._apply_chunk(*args)
+        elif name == 'remove':
+            self._remove(*args)
+        elif name == 'score':
+            self.update_score(*args)
+
+    def _write_log(self, *operation):
+        if self._log is None:
+            return
+        payload = self._encode(list(operation))
+        self._log.write(struct.pack('<I', len(payload)) + payload)
+        self._log.flush()
+
+    def _encode(self, value):
+        encoded = self.codec.dumps(value)
+        if isinstance(encoded, six.text_type):
+            encoded = encoded.encode('utf-8')
+        return encoded
+
+
+class JsonCodec(object):
+    """Stores documents as json, the only codec the lua scripts can read"""
+
+    decodable_in_lua = True
+
+    def dumps(self, doc):
+        return json.dumps(doc)
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class MsgpackCodec(object):
+    """Stores documents with msgpack, smaller and faster to decode than json
+
+    It requires the `msgpack` package to be installed.
+    """
+
+    decodable_in_lua = False
+
+    def __init__(self):
+        if msgpack is None:
+            raise RuntimeError("The `msgpack' package is not installed")
+
+    def dumps(self, doc):
+        return msgpack.packb(doc, use_bin_type=True)
+
+    def loads(self, data):
+        return msgpack.unpackb(data, raw=False)
 
-        for doc_id in self._terms[term]:
-            if words:
-                result.extend(
-                    w for w in find_words_in_doc(documents[doc_id], term)
-                    if w not in result)
-            else:
-                result.append(documents[doc_id])
-        if reverse:
-            result.reverse()
-        return result[offset:limit >= 0 and (offset + limit) or None]
+
+class CompressedCodec(object):
+    """Compresses the output of another codec with zlib
+
+    Worth it for documents with long texts, small documents might even get
+    bigger after compressed.
+    """
+
+    decodable_in_lua = False
+
+    def __init__(self, codec=None, level=6):
+        self.codec = codec or JsonCodec()
+        self.level = level
+
+    def dumps(self, doc):
+        data = self.codec.dumps(doc)
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+        return zlib.compress(data, self.level)
+
+    def loads(self, data):
+        return self.codec.loads(zlib.decompress(data))
 
 
 class KeyManager(object):
+    """Names all the keys of an index, under the same `namespace`
+
+    Each version of a versioned index gets its own namespace, read the
+    `RedisBackend` docs for more info:
+
+        >>> KeyManager('people').versioned(3).for_term('li')
+        'people:v3:d:li'
+
+    So does each shard of a sharded index, with a hash tag that keeps all
+    its keys in the same redis cluster slot:
+
+        >>> KeyManager('people').sharded(7).for_term('li')
+        'people:{7}:d:li'
+    """
+    def __init__(self, namespace='suggestive'):
+        self.namespace = namespace
 
     def for_docs(self):
-        return 'suggestive:d'
+        return '{}:d'.format(self.namespace)
 
     def for_term(self, term):
-        return 'suggestive:d:{}'.format(term)
+        return '{}:d:{}'.format(self.namespace, term)
+
+    def for_words(self):
+        return '{}:w'.format(self.namespace)
+
+    def for_phrase(self, terms):
+        return '{}:p:{}'.format(self.namespace, ' '.join(terms))
+
+    def for_vocabulary(self, bucket):
+        return '{}:lex:{}'.format(self.namespace, bucket)
+
+    def for_matches(self, term):
+        return '{}:x:{}'.format(self.namespace, term)
+
+    def for_top(self, term, stop, reverse):
+        return '{}:xt:{}:{}:{}'.format(
+            self.namespace, reverse and 'asc' or 'desc', stop, term)
+
+    def for_fuzzy(self, variant):
+        return '{}:f:{}'.format(self.namespace, variant)
 
     def for_cache(self, doc_id):
-        return 'suggestive:dt:{}'.format(doc_id)
+        return '{}:dt:{}'.format(self.namespace, doc_id)
+
+    def for_ids(self):
+        return '{}:ids'.format(self.namespace)
+
+    def for_ids_counter(self):
+        return '{}:ids:next'.format(self.namespace)
+
+    def for_active_version(self):
+        return '{}:version'.format(self.namespace)
+
+    def for_versions_counter(self):
+        return '{}:version:next'.format(self.namespace)
+
+    def for_versions(self):
+        # Pattern that matches the keys of all the versions, and not the
+        # `version` pointer and counter next to them
+        return '{}:v[0-9]*'.format(self.namespace)
+
+    def versioned(self, version):
+        return KeyManager('{}:v{}'.format(self.namespace, version))
+
+    def sharded(self, shard):
+        return KeyManager('{}:{{{}}}'.format(self.namespace, shard))
+
+    def version_of(self, key):
+        """The version of a key matched by `for_versions()`"""
+        return key[len(self.namespace) + 2:].split(':', 1)[0]
+
+
+# Removes a document and all its terms in one go. It uses the term cache of
+# the document to find the term keys, built with the term key prefix. When
+# the ids hash is passed, the document is stored under its interned id,
+# which is forgotten too.
+#
+#   KEYS: documents hash, term cache of the document, words hash, [ids hash]
+#   ARGV: document id, term key prefix
+REMOVE_SCRIPT = """
+local id = ARGV[1]
+if KEYS[4] then
+    id = redis.call('HGET', KEYS[4], ARGV[1])
+    redis.call('HDEL', KEYS[4], ARGV[1])
+end
+local terms = redis.call('SMEMBERS', KEYS[2])
+redis.call('DEL', KEYS[2])
+if not id then
+    return 0
+end
+for _, term in ipairs(terms) do
+    redis.call('ZREM', ARGV[2] .. term, id)
+end
+redis.call('HDEL', KEYS[1], id)
+redis.call('HDEL', KEYS[3], id)
+return #terms
+"""
+
+# Replaces a document, its words, its term cache and its scores in all the
+# terms. Terms the document doesn't have anymore are cleaned up, the other
+# ones just get their score updated. When the ids hash and its counter are
+# passed, the document is stored under an interned id, a new one if it has
+# none yet.
+#
+#   KEYS: documents hash, term cache of the document, words hash,
+#         [ids hash, counter]
+#   ARGV: document id, term key prefix, document body, words, score, terms...
+REPLACE_SCRIPT = """
+local id = ARGV[1]
+if KEYS[4] then
+    id = redis.call('HGET', KEYS[4], ARGV[1])
+    if not id then
+        id = redis.call('INCR', KEYS[5])
+        redis.call('HSET', KEYS[4], ARGV[1], id)
+    end
+end
+local terms = {}
+for i = 6, #ARGV do
+    terms[ARGV[i]] = true
+end
+for _, term in ipairs(redis.call('SMEMBERS', KEYS[2])) do
+    if not terms[term] then
+        redis.call('ZREM', ARGV[2] .. term, id)
+    end
+end
+redis.call('DEL', KEYS[2])
+redis.call('HSET', KEYS[1], id, ARGV[3])
+redis.call('HSET', KEYS[3], id, ARGV[4])
+for i = 6, #ARGV do
+    redis.call('SADD', KEYS[2], ARGV[i])
+    redis.call('ZADD', ARGV[2] .. ARGV[i], ARGV[5], id)
+end
+return #ARGV - 5
+"""
+
+# Replaces the body of a document and its score in all its terms, as long as
+# the body is still the one the new one was made from. Returns the terms of
+# the document, or false if the body changed or the document is gone.
+#
+#   KEYS: documents hash, term cache of the document, words hash, [ids hash]
+#   ARGV: document id, term key prefix, old body, new body, score
+SCORE_SCRIPT = """
+local id = ARGV[1]
+if KEYS[4] then
+    id = redis.call('HGET', KEYS[4], ARGV[1])
+    if not id then
+        return false
+    end
+end
+if redis.call('HGET', KEYS[1], id) ~= ARGV[3] then
+    return false
+end
+redis.call('HSET', KEYS[1], id, ARGV[4])
+local terms = redis.call('SMEMBERS', KEYS[2])
+for _, term in ipairs(terms) do
+    redis.call('ZADD', ARGV[2] .. term, ARGV[5], id)
+end
+return terms
+"""
+
+# Stores the intersection of the terms of a phrase in a temporary key, unless
+# it's still around from a previous query. Each document keeps its score.
+# Passing 'ZUNIONSTORE' stores the union of the terms instead, that's how
+# phrases read the terms of many fields at once.
+#
+#   KEYS: phrase key, term keys...
+#   ARGV: seconds until the phrase key expires, ['ZUNIONSTORE']
+PHRASE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    local args = {ARGV[2] or 'ZINTERSTORE', KEYS[1], #KEYS - 1}
+    for i = 2, #KEYS do
+        args[#args + 1] = KEYS[i]
+    end
+    args[#args + 1] = 'AGGREGATE'
+    args[#args + 1] = 'MAX'
+    redis.call(unpack(args))
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return redis.call('ZCARD', KEYS[1])
+"""
+
+# Stores the union of the sorted sets of all the words that start with a
+# prefix in a temporary key, unless it's still around from a previous query.
+# Phrases intersect these unions, single words read `LEX_TOP_SCRIPT` instead.
+# The words are found in their vocabulary set, which keeps them sorted, and
+# their sets are merged a few hundred at a time. Each document keeps its
+# highest score.
+#
+#   KEYS: matches key, vocabulary set
+#   ARGV: prefix, term key prefix, seconds until the matches key expires
+LEX_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('ZCARD', KEYS[1])
+end
+local words = redis.call(
+    'ZRANGEBYLEX', KEYS[2], '[' .. ARGV[1], '[' .. ARGV[1] .. '\\255')
+for first = 1, #words, 500 do
+    local args = {'ZUNIONSTORE', KEYS[1], 0}
+    if first > 1 then
+        args[#args + 1] = KEYS[1]
+    end
+    for i = first, math.min(first + 499, #words) do
+        args[#args + 1] = ARGV[2] .. words[i]
+    end
+    args[3] = #args - 3
+    args[#args + 1] = 'AGGREGATE'
+    args[#args + 1] = 'MAX'
+    redis.call(unpack(args))
+end
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return redis.call('ZCARD', KEYS[1])
+"""
+
+# Stores the documents from `0` to `stop` of all the words that start with
+# a prefix, in one or more vocabulary sets, in a temporary key that every
+# query builds again, so documents indexed or removed show up or go away
+# right away. Only that many documents are read from the set of each word,
+# from the end the query starts at, since none of the others can make it.
+# A `stop` of -1 reads them all. The top key is only read by the query that
+# built it, in the same round trip, so it expires a second later.
+#
+#   KEYS: top key, vocabulary sets
+#   ARGV: stop, '1' to sort by ascending score, term key prefix, a prefix
+#         for each vocabulary set
+LEX_TOP_SCRIPT = """
+local stop = tonumber(ARGV[1])
+local command = ARGV[2] == '1' and 'ZRANGE' or 'ZREVRANGE'
+redis.call('DEL', KEYS[1])
+for k = 2, #KEYS do
+    local prefix = ARGV[k + 2]
+    local words = redis.call(
+        'ZRANGEBYLEX', KEYS[k], '[' .. prefix, '[' .. prefix .. '\\255')
+    for _, word in ipairs(words) do
+        local found = redis.call(command, ARGV[3] .. word, 0, stop,
+                                 'WITHSCORES')
+        for first = 1, #found, 1000 do
+            local args = {'ZADD', KEYS[1]}
+            for i = first, math.min(first + 999, #found), 2 do
+                args[#args + 1] = found[i + 1]
+                args[#args + 1] = found[i]
+            end
+            redis.call(unpack(args))
+        end
+    end
+end
+if stop >= 0 then
+    if ARGV[2] == '1' then
+        redis.call('ZREMRANGEBYRANK', KEYS[1], stop + 1, -1)
+    else
+        redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -stop - 2)
+    end
+end
+redis.call('EXPIRE', KEYS[1], 1)
+return redis.call('ZCARD', KEYS[1])
+"""
+
+# Stores the documents from `0` to `stop` of a few sorted sets in a temporary
+# key that every query builds again, just like the `LEX_TOP_SCRIPT`. That's
+# how single words read the terms of many fields at once.
+#
+#   KEYS: top key, term keys...
+#   ARGV: stop, '1' to sort by ascending score
+TOP_SCRIPT = """
+local stop = tonumber(ARGV[1])
+local command = ARGV[2] == '1' and 'ZRANGE' or 'ZREVRANGE'
+redis.call('DEL', KEYS[1])
+for k = 2, #KEYS do
+    local found = redis.call(command, KEYS[k], 0, stop, 'WITHSCORES')
+    for first = 1, #found, 1000 do
+        local args = {'ZADD', KEYS[1]}
+        for i = first, math.min(first + 999, #found), 2 do
+            args[#args + 1] = found[i + 1]
+            args[#args + 1] = found[i]
+        end
+        redis.call(unpack(args))
+    end
+end
+if stop >= 0 then
+    if ARGV[2] == '1' then
+        redis.call('ZREMRANGEBYRANK', KEYS[1], stop + 1, -1)
+    else
+        redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -stop - 2)
+    end
+end
+redis.call('EXPIRE', KEYS[1], 1)
+return redis.call('ZCARD', KEYS[1])
+"""
+
+# Reads a range of a term and returns the documents found in it, or only the
+# words of the documents that start with the term when a term is passed in
+# ARGV[4]. The words of each document are stored as a json list of
+# `[lower cased word, word]` pairs, see `RedisBackend.encode_words()`.
+#
+# Documents indexed before the words hash existed have their json bodies
+# walked instead when ARGV[5] is '1', in the same order the values were
+# written, just like `find_words_in_doc()` does.
+#
+#   KEYS: term or phrase key, documents hash, words hash
+#   ARGV: start, stop, '1' to sort by ascending score, words term or '',
+#         '1' to walk json bodies
+QUERY_SCRIPT = """
+local command = ARGV[3] == '1' and 'ZRANGE' or 'ZREVRANGE'
+local ids = redis.call(command, KEYS[1], ARGV[1], ARGV[2])
+local term = ARGV[4]
+local result, seen = {}, {}
+local function add(word, lower)
+    if string.sub(lower, 1, #term) == term and not seen[word] then
+        seen[word] = true
+        result[#result + 1] = word
+    end
+end
+local function walk(body)
+    local values = {}
+    for key, value in pairs(cjson.decode(body)) do
+        if type(value) == 'string' then
+            local position = string.find(
+                body, cjson.encode(key) .. ':', 1, true) or 0
+            values[#values + 1] = {position, value}
+        end
+    end
+    table.sort(values, function(a, b) return a[1] < b[1] end)
+    for _, value in ipairs(values) do
+        for word in string.gmatch(value[2], '[%w_%-\\128-\\255]+') do
+            add(word, string.lower(word))
+        end
+    end
+end
+for _, id in ipairs(ids) do
+    if term == '' then
+        local body = redis.call('HGET', KEYS[2], id)
+        if body then
+            result[#result + 1] = body
+        end
+    else
+        local words = redis.call('HGET', KEYS[3], id)
+        if words then
+            for _, pair in ipairs(cjson.decode(words)) do
+                add(pair[2], pair[1])
+            end
+        elseif ARGV[5] == '1' then
+            local body = redis.call('HGET', KEYS[2], id)
+            if body then
+                walk(body)
+            end
+        end
+    end
+end
+return result
+"""
 
 
 class RedisBackend(object):
-    def __init__(self, conn=None):
+    """Production backend, read the `Suggestive` docs for more info
+
+    When `scripted_queries` is true, each query is answered by the
+    `QUERY_SCRIPT` in a single round trip to redis instead of two. With
+    `words=True`, only the matched words travel back over the wire. Mind that
+    lua only knows how to lowercase ascii letters.
+
+    The `max_postings_per_term` param works just like in the `DummyBackend`.
+    The sorted sets of the terms are trimmed with `ZREMRANGEBYRANK` after
+    each chunk is indexed. Redis doesn't tell if a term was ever trimmed, so
+    the `TruncatedQueryWarning` is issued whenever a query reaches the end of
+    a full term. Queries with `reverse=True` start from that end, so they
+    issue it unless they read the whole term and find it isn't full. Queries
+    for words with `scripted_queries` can't tell how many documents were
+    read, so they issue no warnings.
+
+    The `codec` param tells how documents are encoded in the documents hash.
+    It defaults to the `JsonCodec`, take a look at the `MsgpackCodec` and the
+    `CompressedCodec` to save memory. Binary codecs need a connection that
+    doesn't decode the responses.
+
+    The words of each document are kept in the `KeyManager.for_words()` hash,
+    lower cased and ready to be matched, so queries for words never decode
+    the documents themselves, whatever the codec.
+
+    With `intern_ids`, each document id gets a small integer the first time
+    it is indexed, kept in the `KeyManager.for_ids()` hash. The term sorted
+    sets and the documents hash store these integers instead of the actual
+    ids, which saves a lot of memory when ids are long strings, like UUIDs,
+    and lets redis use its compact encodings for small sets. Queries don't
+    need to translate them back since the documents carry their own ids.
+    Don't switch it on or off without rebuilding the whole index.
+
+    The `max_prefix_len` param works just like in the `DummyBackend`.
+
+    Queries with more than one word are answered with the intersection of the
+    terms of each word, stored by the `PHRASE_SCRIPT` in a temporary key that
+    expires after `phrase_ttl` seconds. Until then, the same phrase is read
+    straight from it, with offsets and limits, so it's answered with the
+    documents that matched it when the key was stored, in the order of the
+    scores they had back then. Documents indexed in the meantime don't show
+    up, documents indexed again without the words of the phrase still do,
+    with their new bodies, and documents with new scores keep their old
+    rank. Documents removed in the meantime are skipped, so a page might
+    come back short. Lower `phrase_ttl` to see the changes sooner, at the
+    cost of storing the intersections more often. The intersections issue
+    no `TruncatedQueryWarning`.
+
+    The `field_postings` param works just like in the `DummyBackend`. A
+    single word in many fields is answered by the `TOP_SCRIPT`, which
+    merges the top documents of the word in each field, as many as the
+    query asks for, in a temporary key built again by every query, just
+    like with `lex_terms`. The phrases in many fields intersect the unions
+    of the terms of each word, stored by the `PHRASE_SCRIPT` as well, so
+    they expire just like the intersections, and skip the documents
+    removed since they were stored the same way.
+
+    All the keys are named after the `namespace`. With `versioned`, the
+    index lives in a new namespace each time it's built with `rebuild()`,
+    and the `KeyManager.for_active_version()` key tells which one queries
+    should read. Each process reads it again after `version_ttl` seconds,
+    so rebuilds should be further apart than that. Read `rebuild()` and
+    `cleanup()` for more info.
+
+    Passing `workers` expands the terms and encodes the documents of each
+    chunk in that many processes while this one writes the chunks that are
+    ready to redis, in the order they were read. The codec must be
+    picklable, all the ones that come with suggestive are.
+
+    Passing `shards` splits the index in that many smaller ones, and each
+    document goes to one of them, read `shard_of()`. Each shard has its own
+    documents, terms and caches, all under the same hash tag, so the lua
+    scripts still work on a redis cluster, where the shards are spread over
+    the nodes. Queries read the top documents of each shard, with their
+    scores, and merge them. Then the documents of all the shards are read in
+    a single pipeline, which a cluster connection sends to each node in
+    parallel. Sharded queries can't be `scripted_queries`, since the script
+    doesn't return the scores. Pick more shards than nodes, the shards of
+    all the indexes share the slots of their numbers. Don't change the
+    number of shards without rebuilding the whole index.
+
+    With `lex_terms`, documents are added to the sorted sets of their whole
+    words instead of all their prefixes, and the words are kept in the
+    `KeyManager.for_vocabulary()` sets, sorted, one per first letter, read
+    `lex_bucket()`. A query for a prefix finds its words with
+    `ZRANGEBYLEX`, and the `LEX_TOP_SCRIPT` merges the top documents of
+    their sets, as many as the query asks for, in a temporary key built
+    again by every query, which expires a second later. Phrases need all
+    the documents of each prefix, the `LEX_SCRIPT` merges them in a
+    temporary key kept for `phrase_ttl` seconds, just like the
+    intersections. The index takes a key per word instead of one per
+    prefix, and the term caches of the documents list only their words, at
+    the cost of merging the sets of short prefixes at query time. Words
+    that no document has anymore stay in the vocabulary, they match
+    nothing. Don't switch it on or off without rebuilding the whole index.
+
+    The `max_edits` and `fuzzy_terms` params work just like in the
+    `DummyBackend`. Each prefix is added to the `KeyManager.for_fuzzy()`
+    sorted sets of its `deletes()`, shared by all the shards, which takes a
+    lot more memory with each edit tolerated. A fuzzy query reads the sets
+    of its own deletes, picks the closest terms and reads their top
+    documents, from all the shards, in three round trips. Prefixes no
+    document has anymore stay in the sets, they match nothing. Fuzzy
+    queries need the prefixes, so they can't run with `lex_terms`, and
+    issue no `TruncatedQueryWarning`. Offsets and limits count documents,
+    even with `words=True`, just like in the other queries.
+
+    The `ngrams` param works just like in the `DummyBackend`. The n-grams
+    of each document are added to their own sorted sets, and `infix`
+    queries store the intersections of their n-grams, and the union of the
+    ones of many fields, with the `PHRASE_SCRIPT`, just like phrases. So
+    they're answered from the stored keys for `phrase_ttl` seconds, with
+    the same staleness as the phrases: documents indexed in the meantime
+    don't show up, and documents with new scores keep their old rank. Only
+    the queries that read a single n-gram of a single field see the
+    changes right away.
+    """
+    def __init__(self, conn=None, chunk_size=1000, scripted_queries=False,
+                 max_postings_per_term=None, codec=None, intern_ids=False,
+                 max_prefix_len=None, phrase_ttl=60, workers=None,
+                 namespace='suggestive', versioned=False, version_ttl=5,
+                 field_postings=False, shards=None, lex_terms=False,
+                 max_edits=None, fuzzy_terms=10, ngrams=None):
+        if workers and ProcessPoolExecutor is None:
+            raise RuntimeError(
+                "Indexing with `workers' needs the `futures' package")
+        if shards and scripted_queries:
+            raise RuntimeError("Sharded indexes can't run `scripted_queries'")
+        if max_edits and lex_terms:
+            raise RuntimeError("Fuzzy queries can't run with `lex_terms'")
         self.conn = conn
-        self.keys = KeyManager()
-
-    def documents(self):
-        items = self.conn.hgetall(self.keys.for_docs()).items()
-        return {doc_id: json.loads(doc) for doc_id, doc in items}
-
-    def index(self, data_source, field, score='score'):
-        count = 0
-        pipe = self.conn.pipeline(transaction=False)
-        for doc in data_source:
-            doc_id = doc['id']
-            self.remove(doc_id)
-            self.conn.hset(self.keys.for_docs(), doc_id, json.dumps(doc))
-            for f in isinstance(field, list) and field or [field]:
-
-                # All possible terms for the fields we're analyzing right now.
-                terms = expand(doc[f])
-                if not terms:
-                    continue
-
-                # Caching which documents were related to which terms. It will
-                # speed up the removal process of a document from its terms a
-                # lot.
-                pipe.sadd(self.keys.for_cache(doc_id), *terms)
-
-                # Time to add the documents to the terms expanded from the
-                # indexable fields.
-                for term in terms:
-                    pipe.zadd(
-                        self.keys.for_term(term), doc[score], doc_id)
-            count += 1
-        pipe.execute()
+        self.codec = codec or JsonCodec()
+        self.keys = KeyManager(namespace)
+        self.versioned = versioned
+        self.version_ttl = version_ttl
+        self._active = None
+        self.chunk_size = chunk_size
+        self.scripted_queries = scripted_queries
+        self.max_postings_per_term = max_postings_per_term
+        self.intern_ids = intern_ids
+        self.max_prefix_len = max_prefix_len
+        self.phrase_ttl = phrase_ttl
+        self.workers = workers
+        self.field_postings = field_postings
+        self.shards = shards
+        self.lex_terms = lex_terms
+        self.max_edits = max_edits
+        self.fuzzy_terms = fuzzy_terms
+        self.ngrams = ngrams
+        self._scripts = {}
+
+    @property
+    def keys(self):
+        """The `KeyManager` of the index, or of its active version"""
+        if not self.versioned:
+            return self._keys
+        if self._active is None or self._active[0] <= time.time():
+            self.refresh()
+        return self._active[1]
+
+    @keys.setter
+    def keys(self, keys):
+        self._keys = keys
+
+    def refresh(self):
+        """Read which version of the index is active right now"""
+        self._use_version(self.conn.get(self._keys.for_active_version()))
+
+    def _use_version(self, version):
+        if isinstance(version, bytes):
+            version = version.decode('utf-8')
+        self._active = (time.time() + self.version_ttl,
+                        self._keys.versioned(version or 0))
+
+    def rebuild(self, data_source, field, score='score', store=None,
+                progress=None):
+        """Index `data_source` from scratch in a new version of the index
+
+        Queries keep reading the active version until the new one is
+        complete, then the active version is switched with a single `SET`.
+        The version that was active is kept, for the processes that didn't
+        notice the switch yet, and the ones before it are deleted. Returns
+        how many documents were indexed.
+        """
+        if not self.versioned:
+            raise RuntimeError("Only versioned backends can be rebuilt")
+        version = self.conn.incr(self._keys.for_versions_counter())
+        count = self._builder(version).index(
+            data_source, field, score=score, store=store, progress=progress)
+
+        previous = self.conn.getset(self._keys.for_active_version(), version)
+        self._use_version(version)
+        self.cleanup(keep=[version, previous])
         return count
 
-    def remove(self, doc_id):
+    def _builder(self, version):
+        # A copy of the backend that writes the keys of `version` only
+        builder = copy.copy(self)
+        builder.versioned = False
+        builder.keys = self._keys.versioned(version)
+        return builder
+
+    def cleanup(self, keep=None, batch_size=1000):
+        """Delete the keys of all the versions of the index but `keep`
+
+        Only the active version is kept by default. Versions newer than the
+        active one are never deleted, since another process might be
+        running `rebuild()` on them, so the ones left behind by a rebuild
+        that failed are only deleted after the next one is complete. Keys
+        are found with `SCAN` and deleted with `UNLINK`, which frees the
+        memory in the background, so it needs redis 4.0. Each `UNLINK` gets
+        the keys of a single shard. Returns how many keys were deleted.
+        """
+        active = self.conn.get(self._keys.for_active_version())
+        keep = self._kept_versions([active] if keep is None else keep, active)
+
+        deleted = 0
+        batches = defaultdict(list)
+        pattern = self._keys.for_versions()
+        for key in self.conn.scan_iter(match=pattern, count=batch_size):
+            batch = self._batch_unlink(batches, key, keep, batch_size)
+            if batch:
+                deleted += self.conn.execute_command('UNLINK', *batch)
+        for batch in batches.values():
+            if batch:
+                deleted += self.conn.execute_command('UNLINK', *batch)
+        return deleted
+
+    def _kept_versions(self, keep, active):
+        # The versions in `keep`, and the number of the active version, the
+        # newer ones are kept too
+        keep = set(v.decode('utf-8') if isinstance(v, bytes) else str(v)
+                   for v in keep if v is not None)
+        return keep, int(active or 0)
+
+    def _batch_unlink(self, batches, key, keep, batch_size):
+        # Adds `key` to the batch of its shard in `batches`, unless its
+        # version is kept. Returns the batch when it's full, and empties it.
+        name = key.decode('utf-8') if isinstance(key, bytes) else key
+        version = self._keys.version_of(name)
+        kept, active = keep
+        if version in kept or version.isdigit() and int(version) > active:
+            return None
+        batch = batches[hash_tag(name)]
+        batch.append(key)
+        if len(batch) < batch_size:
+            return None
+        full = batch[:]
+        del batch[:]
+        return full
+
+    def script(self, source):
+        """Register the lua script `source` in redis only once
+
+        The returned object runs the script with `EVALSHA` and takes care of
+        loading it again if redis doesn't know it anymore.
+        """
+        if source not in self._scripts:
+            self._scripts[source] = self.conn.register_script(source)
+        return self._scripts[source]
+
+    def _execute(self, commands):
+        # Runs `commands` in a single pipeline and returns their results.
+        # Each command is a `(name, args, kwargs)` triple, named after the
+        # method of the pipeline that queues it, or `'script'` for a lua
+        # script, which gets its source as the only arg and its keys and
+        # args in `kwargs`. Commands are built by helpers shared with the
+        # `AsyncRedisBackend`, which only runs them differently.
         pipe = self.conn.pipeline(transaction=False)
-        cache = self.keys.for_cache(doc_id)
+        for name, args, kwargs in commands:
+            if name == 'script':
+                self.script(args[0])(client=pipe, **kwargs)
+            else:
+                getattr(pipe, name)(*args, **kwargs)
+        return pipe.execute()
+
+    def documents(self):
+        result = {}
+        for keys in self._all_keys():
+            docs = self.conn.hgetall(keys.for_docs())
+            ids = self.intern_ids and self.conn.hgetall(keys.for_ids())
+            result.update(self._decode_documents(docs, ids))
+        return result
 
-        # First, we remove the document id from the terms it is related to;
-        for term in self.conn.smembers(cache):
-            pipe.zrem(self.keys.for_term(term), doc_id)
-        pipe.execute()
+    def _decode_documents(self, docs, ids):
+        docs = {doc_id: self.codec.loads(doc) for doc_id, doc in docs.items()}
+        if not self.intern_ids:
+            return docs
+        return {doc_id: docs[interned] for doc_id, interned in ids.items()
+                if interned in docs}
+
+    def _shard_of(self, doc_id):
+        return shard_of(doc_id, self.shards) if self.shards else None
+
+    def _shard_keys(self, shard, keys=None):
+        # The `KeyManager` of a shard, or of the whole index if it's not
+        # sharded, when `shard` is `None`. The `keys` of versioned indexes
+        # are read once by each method that talks to redis and passed down,
+        # so all its commands get the same version, even if it's switched
+        # in the middle, read `RedisBackend.keys`.
+        keys = keys or self.keys
+        return keys if shard is None else keys.sharded(shard)
+
+    def _all_keys(self, keys=None):
+        keys = keys or self.keys
+        if not self.shards:
+            return [keys]
+        return [keys.sharded(s) for s in six.moves.range(self.shards)]
+
+    def _keys_of(self, doc_id, keys=None):
+        return self._shard_keys(self._shard_of(doc_id), keys)
+
+    def _doc_keys(self, doc_id, keys=None):
+        # Keys the `REPLACE_SCRIPT` and the `REMOVE_SCRIPT` work with
+        keys = self._keys_of(doc_id, keys)
+        result = [keys.for_docs(), keys.for_cache(doc_id), keys.for_words()]
+        if self.intern_ids:
+            result += [keys.for_ids(), keys.for_ids_counter()]
+        return result
 
-        # The second step is to remove the cache key, we don't need it anymore;
-        self.conn.delete(cache)
+    def index(self, data_source, field, score='score', store=None,
+              progress=None, start=0):
+        """Index documents in chunks of `chunk_size` documents
 
-        # Last but not least, we need to get rid of the actual document now;
-        self.conn.hdel(self.keys.for_docs(), doc_id)
+        Each document is replaced atomically by the `REPLACE_SCRIPT`, so
+        concurrent indexers are safe, and each chunk costs a single round
+        trip to redis. Read the `DummyBackend.index()` docs for more info
+        about the parameters.
+        """
+        if self.workers:
+            return self._parallel_index(
+                data_source, field, score, store, progress, start)
+        return index_in_chunks(
+            lambda chunk: self._index_chunk(chunk, field, score, store),
+            data_source, self.chunk_size, progress, start)
+
+    def _parallel_index(self, data_source, field, score, store, progress,
+                        start):
+        # The workers get a copy of the backend without the connection, the
+        # chunks are written to redis in order as soon as they're ready.
+        worker = RedisBackend(
+            codec=self.codec, intern_ids=self.intern_ids,
+            max_prefix_len=self.max_prefix_len,
+            field_postings=self.field_postings, shards=self.shards,
+            lex_terms=self.lex_terms, ngrams=self.ngrams)
+        worker.keys = keys = self.keys
+        prepare = partial(prepare_chunk, worker, field, score, store)
+        batches = chunks(islice(data_source, start, None), self.chunk_size)
+
+        count = start
+        for size, replacements, touched in parallel_map(
+                prepare, batches, self.workers):
+            self._write_chunk(replacements, self._trims(touched, keys),
+                              self._vocabulary(touched, keys))
+            count += size
+            if progress is not None:
+                progress(count)
+        return count - start
+
+    def _index_chunk(self, chunk, field, score, store):
+        self._write_chunk(*self._chunk_commands(chunk, field, score, store))
+
+    def _write_chunk(self, replacements, trims, vocabulary):
+        self._execute(self._write_commands(replacements, trims, vocabulary))
+
+    def _write_commands(self, replacements, trims, vocabulary):
+        return ([('script', (REPLACE_SCRIPT,), dict(keys=keys, args=args))
+                 for keys, args in replacements] +
+                [('zremrangebyrank', args, {}) for args in trims] +
+                [('execute_command', ('ZADD', key, 0, word), {})
+                 for key, word in vocabulary])
+
+    def _chunk_commands(self, chunk, field, score, store):
+        # The keys and args of the `REPLACE_SCRIPT` call of each document of
+        # the chunk, the args of the `ZREMRANGEBYRANK` call of each term
+        # that needs to be trimmed and the words to add to the vocabulary.
+        keys = self.keys
+        replacements, touched = self._chunk_replacements(
+            chunk, field, score, store, keys)
+        return (replacements, self._trims(touched, keys),
+                self._vocabulary(touched, keys))
+
+    def _chunk_replacements(self, chunk, field, score, store, keys=None):
+        # The `REPLACE_SCRIPT` calls of the chunk and all the terms they
+        # touch, paired with their shards. It's the CPU bound part of
+        # indexing, which runs in the worker processes when there are any.
+        #
+        # The same document might show up more than once in a chunk. Only its
+        # last version will make it to the index, just like it would happen
+        # if we indexed them one by one.
+        docs = OrderedDict((doc['id'], doc) for doc in chunk)
+        keys = keys or self.keys
+
+        replacements = []
+        touched = set()
+        for doc_id, doc in docs.items():
+            # All possible terms for the fields we're analyzing right now.
+            terms = self._expand(doc, field)
+            shard = self._shard_of(doc_id)
+            touched.update((shard, term) for term in terms)
+
+            stored = project(doc, store, score)
+            replacements.append((
+                self._doc_keys(doc_id, keys),
+                [doc_id, self._shard_keys(shard, keys).for_term(''),
+                 self.codec.dumps(stored),
+                 self.encode_words(tokenize(stored)),
+                 doc[score]] + terms))
+        return replacements, touched
+
+    def _expand(self, doc, field):
+        if self.lex_terms:
+            fields = isinstance(field, list) and field or [field]
+            terms = fields_words(doc, field)
+            if self.field_postings:
+                terms += [scoped_term([f], word) for f in fields
+                          for word in fields_words(doc, f)]
+        else:
+            terms = expand_fields(doc, field, self.max_prefix_len)
+            if self.field_postings:
+                terms += expand_scoped(doc, field, self.max_prefix_len)
+        if self.ngrams:
+            terms += expand_ngrams(doc, self.ngrams)
+        return terms
+
+    def _vocabulary(self, touched, keys=None):
+        # The vocabulary sets of the words touched, with `lex_terms`, or the
+        # fuzzy sets of the prefixes touched, with `max_edits`. Scoped terms
+        # are told apart by their colon, read `scoped_term()`, and n-grams
+        # by their tilde, read `ngram_term()`.
+        if self.ngrams:
+            touched = [(shard, term) for shard, term in touched
+                       if '~' not in term]
+        if self.lex_terms:
+            return [(self._shard_keys(shard, keys).for_vocabulary(
+                lex_bucket(word)), word) for shard, word in touched]
+        if not self.max_edits:
+            return []
+        keys = keys or self.keys
+        terms = set(term for _, term in touched
+                    if not (self.field_postings and ':' in term))
+        return [(keys.for_fuzzy(variant), term) for term in terms
+                for variant in deletes(
+                    term, fuzzy_edits(term, self.max_edits))]
+
+    def _trims(self, touched, keys=None):
+        # The args of the `ZREMRANGEBYRANK` calls that keep only the top
+        # documents of each one of the `(shard, term)` pairs `touched`. The
+        # cache of the documents that were left out still mention the term,
+        # which is harmless, removing them from the term is a noop.
+        trims = []
+        if self.max_postings_per_term is not None:
+            for shard, term in touched:
+                capacity = term_capacity(self.max_postings_per_term, term)
+                trims.append((self._shard_keys(shard, keys).for_term(term),
+                              0, -capacity - 1))
+        return trims
+
+    def terms(self, doc_ids):
+        """Return all the terms the documents in `doc_ids` were added to"""
+        return self._decode_terms(self._execute(self._terms_commands(doc_ids)))
+
+    def _terms_commands(self, doc_ids):
+        keys = self.keys
+        return [('smembers', (self._keys_of(doc_id, keys).for_cache(doc_id),),
+                 {}) for doc_id in doc_ids]
+
+    def _decode_terms(self, caches):
+        return set(t.decode('utf-8') if isinstance(t, bytes) else t
+                   for terms in caches for t in terms)
+
+    def remove(self, doc_id):
+        """Remove a document and all its terms with the `REMOVE_SCRIPT`"""
+        self.script(REMOVE_SCRIPT)(client=self.conn, **self._remove_params(
+            doc_id))
+
+    def _remove_params(self, doc_id, keys=None):
+        keys = keys or self.keys
+        return dict(keys=self._doc_keys(doc_id, keys)[:4],
+                    args=[doc_id, self._keys_of(doc_id, keys).for_term('')])
+
+    def query(self, term, reverse=False, words=False, limit=-1, offset=0,
+              fields=None, fuzzy=False, infix=False):
+        keys = self.keys
+        term = term.lower()
+        stop = self._query_stop(words, limit, offset, fields, fuzzy, infix)
+        if fuzzy and not phrase_terms(term, self.max_prefix_len):
+            return self._fuzzy_query(
+                term[:self.max_prefix_len], reverse, words, offset, stop,
+                fields, keys)
+        stores, key, scoped = self._query_plan(term, fields, keys, infix)
+        if stores or self.shards:
+            # The intersection is stored, unless it's still around from a
+            # previous query, and read in a single round trip. So are the
+            # ranges of all the shards.
+            return self.query_many(
+                [term], reverse, words, limit, offset, fields,
+                infix=infix)[0]
+        if self.scripted_queries:
+            return self._scripted_answer(
+                self.script(QUERY_SCRIPT)(
+                    client=self.conn, **self._query_script_params(
+                        key, term, reverse, words, offset, stop, keys)),
+                scoped, reverse, words, offset, stop)
 
-    def query(self, term, reverse=False, words=False, limit=-1, offset=0):
         doc_ids = (self.conn.zrevrange if not reverse else self.conn.zrange)(
-            self.keys.for_term(term.lower()),
-            offset,
-            limit >= 0 and (offset + limit) or -1)
+            key, offset, stop)
+        self._check_truncation(scoped, offset, stop, doc_ids, reverse)
+        return self._read_many([doc_ids], [term], words, keys)[0]
+
+    def _query_stop(self, words, limit, offset, fields, fuzzy, infix):
+        # Checks the params of a query, and returns the inclusive position
+        # where its ranges stop, -1 when there's no limit
+        check_infix(self, infix, fields, words, fuzzy)
+        if not infix:
+            check_fields(self, fields)
+        check_fuzzy(self, fuzzy)
+        return limit >= 0 and (offset + limit) or -1
+
+    def _query_plan(self, term, fields, keys=None, infix=False, stop=-1,
+                    reverse=False):
+        # The scripts that store the sorted set answering the query for
+        # `term` with their params, in the order they must run, the key of
+        # that sorted set, and the term read when nothing is stored. The
+        # keys are the ones of the whole index, or of a shard. Single words
+        # with `lex_terms` or in many fields store only the documents up to
+        # `stop`, counted from the end `reverse` tells.
+        keys = keys or self.keys
+        if infix:
+            return self._infix_plan(term, fields, keys)
+        terms = phrase_terms(term, self.max_prefix_len)
+        if self.lex_terms and not terms:
+            return self._lex_top_plan(
+                term[:self.max_prefix_len], fields, keys, stop, reverse)
+        if fields and len(fields) > 1 and not terms:
+            return self._top_plan(
+                term[:self.max_prefix_len], fields, keys, stop, reverse)
+        words = terms or [term[:self.max_prefix_len]]
+        stores = []
+        found = []
+        for word in words:
+            sources = [self._term_source(keys, t, stores) for t in
+                       (fields and [scoped_term([f], word) for f in fields] or
+                        [word])]
+            if len(sources) > 1:
+                union = keys.for_term(scoped_term(fields, word))
+                stores.append((PHRASE_SCRIPT, dict(
+                    keys=[union] + sources,
+                    args=[self.phrase_ttl, 'ZUNIONSTORE'])))
+                sources = [union]
+            found.extend(sources)
+        if fields:
+            words = [scoped_term(fields, t) for t in words]
+        if not terms:
+            return stores, found[0], (None if stores else words[0])
+
+        key = keys.for_phrase(words)
+        stores.append((PHRASE_SCRIPT, dict(
+            keys=[key] + found, args=[self.phrase_ttl])))
+        return stores, key, None
+
+    def _infix_plan(self, term, fields, keys):
+        # Same as `_query_plan()`, for the n-grams of `term` in each field
+        stores = []
+        sources = []
+        names = []
+        for field, n in sorted(self.ngrams.items()):
+            if fields and field not in fields:
+                continue
+            grams = [ngram_term(field, gram)
+                     for gram in query_ngrams(term, n)] or [field + '~']
+            names.append(field)
+            if len(grams) == 1:
+                sources.append(keys.for_term(grams[0]))
+                continue
+            sources.append(keys.for_phrase(grams))
+            stores.append((PHRASE_SCRIPT, dict(
+                keys=sources[-1:] + [keys.for_term(g) for g in grams],
+                args=[self.phrase_ttl])))
+        if len(sources) == 1:
+            return stores, sources[0], None if stores else grams[0]
+
+        key = keys.for_phrase([ngram_term(','.join(names), term)])
+        stores.append((PHRASE_SCRIPT, dict(
+            keys=[key] + sources, args=[self.phrase_ttl, 'ZUNIONSTORE'])))
+        return stores, key, None
+
+    def _top_plan(self, word, fields, keys, stop, reverse):
+        # Same as `_query_plan()`, for a single word in many fields. The top
+        # documents of the word in each field are merged at once.
+        key = keys.for_top(scoped_term(fields, word), stop, reverse)
+        return [(TOP_SCRIPT, dict(
+            keys=[key] + [keys.for_term(scoped_term([f], word))
+                          for f in fields],
+            args=[stop, reverse and '1' or '0']))], key, None
+
+    def _lex_top_plan(self, word, fields, keys, stop, reverse):
+        # Same as `_query_plan()`, for a single word with `lex_terms`. The
+        # top documents of the words of all the fields are merged at once.
+        prefixes = (fields and [scoped_term([f], word) for f in fields] or
+                    [word])
+        key = keys.for_top(
+            fields and scoped_term(fields, word) or word, stop, reverse)
+        return [(LEX_TOP_SCRIPT, dict(
+            keys=[key] + [keys.for_vocabulary(lex_bucket(p))
+                          for p in prefixes],
+            args=[stop, reverse and '1' or '0',
+                  keys.for_term('')] + prefixes))], key, None
+
+    def _term_source(self, keys, term, stores):
+        # The key of the sorted set of `term`. With `lex_terms`, it's stored
+        # by the `LEX_SCRIPT`, which is added to `stores`.
+        if not self.lex_terms:
+            return keys.for_term(term)
+        key = keys.for_matches(term)
+        stores.append((LEX_SCRIPT, dict(
+            keys=[key, keys.for_vocabulary(lex_bucket(term))],
+            args=[term, keys.for_term(''), self.phrase_ttl])))
+        return key
+
+    def query_many(self, terms, reverse=False, words=False, limit=-1,
+                   offset=0, fields=None, fuzzy=False, infix=False):
+        """Answer a query for each one of `terms`, in a list
+
+        The ranges of all the terms are read in a single pipeline, and the
+        documents they have, each one only once, with a single `HMGET`. With
+        `scripted_queries`, the whole batch takes a single round trip. Fuzzy
+        queries are answered one by one.
+        """
+        stop = self._query_stop(words, limit, offset, fields, fuzzy, infix)
+        if fuzzy:
+            return [self.query(term, reverse, words, limit, offset, fields,
+                               fuzzy) for term in terms]
+        keys = self.keys
+        terms = [term.lower() for term in terms]
+        commands, reads = self._range_commands(
+            terms, reverse, words, offset, stop, fields, infix, keys)
+        found = self._ranges_found(
+            reads, self._execute(commands), reverse, words, offset, stop)
+        if self.scripted_queries:
+            return [self._scripted_result(words, r) for r in found]
+        return self._read_many(
+            found, [term for _, term, _ in reads], words, keys)
+
+    def _range_commands(self, terms, reverse, words, start, stop, fields,
+                        infix, keys):
+        # The commands that answer the queries for `terms` in a single
+        # pipeline, storing what needs to be stored before reading their
+        # ranges, and what to read from their results: the positions of the
+        # ranges of each term, one per shard, the term the words must start
+        # with, and the term read when nothing was stored, read
+        # `_query_plan()`. Sharded indexes read the top `stop` documents of
+        # each shard, with their scores.
+        commands = []
+        reads = []
+        for term in terms:
+            words_term = term
+            if phrase_terms(term, self.max_prefix_len):
+                words_term = term.split()[-1]
+            positions = []
+            for shard_keys in self._all_keys(keys):
+                stores, key, scoped = self._query_plan(
+                    term, fields, shard_keys, infix, stop, reverse)
+                commands.extend(('script', (script,), params)
+                                for script, params in stores)
+                if self.shards:
+                    commands.extend(self._top_commands([key], reverse, stop))
+                elif self.scripted_queries:
+                    commands.append(('script', (QUERY_SCRIPT,),
+                                     self._query_script_params(
+                                         key, words_term, reverse, words,
+                                         start, stop, keys)))
+                else:
+                    commands.append((reverse and 'zrange' or 'zrevrange',
+                                     (key, start, stop), {}))
+                positions.append(len(commands) - 1)
+            reads.append((positions, words_term, scoped))
+        return commands, reads
+
+    def _top_commands(self, keys, reverse, stop):
+        # Read the top `stop` documents of each one of `keys`, with scores
+        return [(reverse and 'zrange' or 'zrevrange', (key, 0, stop),
+                 {'withscores': True}) for key in keys]
+
+    def _ranges_found(self, reads, results, reverse, words, start, stop):
+        # The ids found by each query in the `results` of the commands of
+        # `_range_commands()`, or their answers with `scripted_queries`.
+        # The ids of sharded indexes are `(shard, id)` pairs, read
+        # `_hmget()`.
+        found = []
+        for positions, _, scoped in reads:
+            ranges = [results[position] for position in positions]
+            if self.shards:
+                found.append(self._merge_shards(
+                    ranges, scoped, reverse, start, stop))
+                continue
+            if scoped is not None and not (words and self.scripted_queries):
+                self._check_truncation(
+                    scoped, start, stop, ranges[0], reverse)
+            found.append(ranges[0])
+        return found
+
+    def _merge_shards(self, ranges, scoped, reverse, start, stop):
+        # The `(shard, id)` pairs between `start` and `stop` of the ranges
+        # read from each shard, sorted by score. Documents with the same
+        # score keep the order of their shards.
+        found = []
+        for shard, pairs in enumerate(ranges):
+            if scoped is not None:
+                self._check_truncation(scoped, 0, stop, pairs, reverse)
+            found.extend((score, shard, doc_id) for doc_id, score in pairs)
+        found.sort(key=lambda item: item[0], reverse=not reverse)
+        return [(shard, doc_id) for _, shard, doc_id in
+                found[start:stop + 1 if stop >= 0 else None]]
+
+    def _fuzzy_query(self, term, reverse, words, start, stop, fields, keys):
+        sources = self._fuzzy_sources(term, self._execute(
+            self._fuzzy_commands(term, keys)), fields, keys)
+        found, terms = self._merge_fuzzy(sources, self._execute(
+            self._top_commands([s[-1] for s in sources], reverse, stop)),
+            reverse, start, stop)
+        return self._flatten(
+            self._read_many(found, terms, words, keys), words)
+
+    def _fuzzy_commands(self, term, keys):
+        # Read the fuzzy sets that have the candidates of `term`
+        return [('zrange', (key, 0, -1), {})
+                for key in self._fuzzy_variants(term, keys)]
+
+    def _fuzzy_variants(self, term, keys):
+        # The fuzzy sets that have the candidates of `term`
+        return [keys.for_fuzzy(variant) for variant in
+                deletes(term, fuzzy_edits(term, self.max_edits))]
+
+    def _fuzzy_sources(self, term, variants, fields, keys):
+        # The sorted sets of the terms closest to `term`, found in the fuzzy
+        # sets `variants`, in all the shards and `fields`. Each one comes
+        # with the distance and the name of its term, and its shard.
+        found = [t.decode('utf-8') if isinstance(t, bytes) else t
+                 for terms in variants for t in terms]
+        candidates = closest_terms(
+            term, found, self.max_edits, self.fuzzy_terms)
+        sources = []
+        for shard, shard_keys in enumerate(self._all_keys(keys)):
+            for distance, candidate in candidates:
+                for name in (fields and [scoped_term([f], candidate)
+                                         for f in fields] or [candidate]):
+                    sources.append((distance, candidate,
+                                    shard if self.shards else None,
+                                    shard_keys.for_term(name)))
+        return sources
+
+    def _merge_fuzzy(self, sources, ranges, reverse, start, stop):
+        # The ids between `start` and `stop` found in each group of sources
+        # as far from the query as each other, the closest group first and
+        # each one sorted by score, and the terms of each group. Documents
+        # found by a closer group are left out. Sharded ids are `(shard,
+        # id)` pairs, read `_hmget()`.
+        groups = OrderedDict()
+        for (distance, term, shard, _), pairs in zip(sources, ranges):
+            terms, scores = groups.setdefault(distance, ([], {}))
+            if term not in terms:
+                terms.append(term)
+            for doc_id, score in pairs:
+                scores[doc_id if shard is None else (shard, doc_id)] = score
+
+        found = []
+        seen = set()
+        position = 0
+        stop = stop + 1 if stop >= 0 else None
+        for terms, scores in groups.values():
+            ids = sorted((i for i in scores if i not in seen),
+                         key=scores.get, reverse=not reverse)
+            seen.update(ids)
+            found.append(ids[max(start - position, 0):None if stop is None
+                             else max(stop - position, 0)])
+            position += len(ids)
+        return found, [tuple(terms) for terms, _ in groups.values()]
+
+    def _flatten(self, results, words):
+        # Joins the results of the groups of a fuzzy query, the same word
+        # might be found by more than one of them
+        found = [item for result in results for item in result]
+        return list(OrderedDict.fromkeys(found)) if words else found
+
+    def _read_many(self, found, terms, words, keys):
+        # Reads the documents, or the words, of the ids `found` by each
+        # query with a single `HMGET`. Documents indexed before the words
+        # hash existed have their words found in the documents themselves.
+        unique = list(OrderedDict.fromkeys(i for ids in found for i in ids))
+        values = unique and self._hmget(
+            words and KeyManager.for_words or KeyManager.for_docs,
+            unique, keys) or []
+        if not words:
+            return self._decode_many(found, unique, values)
+        missing = [i for i, v in zip(unique, values) if v is None]
+        docs = missing and self._hmget(KeyManager.for_docs, missing, keys)
+        return self._match_many(
+            found, terms, unique, values, dict(zip(missing, docs or [])))
+
+    def _hmget(self, hash_of, ids, keys):
+        # Reads `ids` from the hash `hash_of` names with the `KeyManager`.
+        # Sharded indexes have one hash per shard and their ids paired with
+        # their shards, the hashes of all the shards are read in a single
+        # pipeline.
+        if not self.shards:
+            return self.conn.hmget(hash_of(keys), ids)
+        by_shard, commands = self._hmget_commands(hash_of, ids, keys)
+        return self._unshard(by_shard, self._execute(commands), ids)
+
+    def _hmget_commands(self, hash_of, ids, keys):
+        by_shard = OrderedDict()
+        for shard, doc_id in ids:
+            by_shard.setdefault(shard, []).append(doc_id)
+        return by_shard, [('hmget', (hash_of(keys.sharded(shard)),
+                                     shard_ids), {})
+                          for shard, shard_ids in by_shard.items()]
+
+    def _unshard(self, by_shard, results, ids):
+        values = {}
+        for (shard, shard_ids), found in zip(by_shard.items(), results):
+            values.update(zip([(shard, i) for i in shard_ids], found))
+        return [values[pair] for pair in ids]
+
+    def _decode_many(self, found, unique, values):
+        # Stored intersections and unions might still have the ids of
+        # documents removed after they were stored, those are skipped.
+        docs = dict((i, self.codec.loads(v))
+                    for i, v in zip(unique, values) if v is not None)
+        return [[docs[i] for i in ids if i in docs] for ids in found]
+
+    def _match_many(self, found, terms, unique, values, docs):
+        encoded = dict(zip(unique, values))
+        return [self._match_words(ids, [encoded[i] for i in ids], docs, term)
+                for ids, term in zip(found, terms)]
+
+    def encode_words(self, words):
+        """Encode `words` the way the words hash keeps them
+
+        A json list of `[lower cased word, word]` pairs, so the prefixes can
+        be matched without lower casing anything at query time.
+        """
+        return json.dumps([[w.lower(), w] for w in words])
 
+    def _match_words(self, doc_ids, found, docs, term):
         result = []
-        docs = doc_ids and self.conn.hmget(self.keys.for_docs(), doc_ids) or []
-        for d in docs:
-            doc = json.loads(d)
-            if words:
-                result.extend(
-                    w for w in find_words_in_doc(doc, term)
-                    if w not in result)
+        seen = set()
+        for doc_id, encoded in zip(doc_ids, found or []):
+            if encoded is not None:
+                pairs = json.loads(encoded)
+                matches = (w for lower, w in pairs if lower.startswith(term))
+            elif docs[doc_id] is not None:
+                matches = find_words_in_doc(
+                    self.codec.loads(docs[doc_id]), term)
             else:
-                result.append(doc)
-
+                continue
+            for word in matches:
+                if word not in seen:
+                    seen.add(word)
+                    result.append(word)
         return result
 
+    def _scripted_answer(self, result, scoped, reverse, words, start,
+                         stop):
+        # The answer of a single query by the `QUERY_SCRIPT`
+        if not words:
+            self._check_truncation(scoped, start, stop, result, reverse)
+        return self._scripted_result(words, result)
+
+    def _query_script_params(self, key, term, reverse, words, start, stop,
+                             keys):
+        return dict(
+            keys=[key, keys.for_docs(), keys.for_words()],
+            args=[start, stop, reverse and '1' or '0', words and term or '',
+                  self.codec.decodable_in_lua and '1' or '0'])
+
+    def _scripted_result(self, words, result):
+        if words:
+            return [w.decode('utf-8') if isinstance(w, bytes) else w
+                    for w in result]
+        return [self.codec.loads(d) for d in result]
+
+    def _check_truncation(self, term, start, stop, found, reverse=False):
+        # Both `start` and `stop` are inclusive positions of the range read
+        # from the sorted set, `stop` is -1 when there's no limit. Ascending
+        # reads start where the trimmed documents were, so they're only safe
+        # when they got to the end of a term that isn't full.
+        capacity = term_capacity(self.max_postings_per_term, term)
+        if capacity is None:
+            return
+        read = start + len(found)
+        if reverse:
+            if (stop < 0 or read <= stop) and read < capacity:
+                return
+        elif read < capacity or 0 <= stop < capacity:
+            return
+        warn_truncated(term, capacity)
+
     def get_score(self, item_id):
         '''
         Given an item id (or name), returns the current score of that term
         '''
-        key = self.conn.hmget(self.keys.for_docs(), item_id)[0]
+        keys = self._keys_of(item_id)
+        if self.intern_ids:
+            item_id = self.conn.hget(keys.for_ids(), item_id)
+            if item_id is None:
+                return 0
+        return self._decode_score(
+            self.conn.hmget(keys.for_docs(), item_id)[0])
+
+    def update_score(self, doc_id, score, score_field='score'):
+        """Change the score of a document without indexing it again
+
+        Only the stored document and its entries in the sorted sets of its
+        terms are rewritten, by the `SCORE_SCRIPT`. The document is read
+        first, to update its `score_field`, and written back only if nobody
+        changed it in the meantime, otherwise it's read again. Returns the
+        new score, or raises `KeyError` if the document isn't indexed.
+        """
+        return self._rescore(doc_id, lambda doc: score, score_field)
+
+    def incr_score(self, doc_id, delta, score_field='score'):
+        """Add `delta` to the score of a document, read `update_score()`"""
+        return self._rescore(
+            doc_id, lambda doc: doc[score_field] + delta, score_field)
+
+    def _rescore(self, doc_id, new_score, score_field):
+        keys = self.keys
+        while True:
+            score, params = self._rescore_params(
+                doc_id, self._body(doc_id, keys), new_score, score_field,
+                keys)
+            terms = self.script(SCORE_SCRIPT)(client=self.conn, **params)
+            if terms is not None:
+                break
+        self._trim(doc_id, self._decode_terms([terms]), keys)
+        return score
+
+    def _rescore_params(self, doc_id, body, new_score, score_field, keys):
+        # The new score of the document stored as `body` and the params of
+        # the `SCORE_SCRIPT` that writes it, unless `body` changed since
+        if body is None:
+            raise KeyError(doc_id)
+        doc = self.codec.loads(body)
+        score = doc[score_field] = new_score(doc)
+        return score, dict(
+            keys=self._doc_keys(doc_id, keys)[:4],
+            args=[doc_id, self._keys_of(doc_id, keys).for_term(''), body,
+                  self.codec.dumps(doc), score])
+
+    def _body(self, doc_id, keys):
+        keys = self._keys_of(doc_id, keys)
+        if self.intern_ids:
+            doc_id = self.conn.hget(keys.for_ids(), doc_id)
+            if doc_id is None:
+                return None
+        return self.conn.hget(keys.for_docs(), doc_id)
+
+    def _trim(self, doc_id, terms, keys):
+        # Documents that got a higher score might have gone back to terms
+        # that are full, so they're trimmed again.
+        if self.max_postings_per_term is not None:
+            self._execute(self._trim_commands(doc_id, terms, keys))
+
+    def _trim_commands(self, doc_id, terms, keys):
+        shard = self._shard_of(doc_id)
+        return [('zremrangebyrank', args, {}) for args in self._trims(
+            ((shard, term) for term in terms), keys)]
+
+    def _decode_score(self, key):
         if key is None:
             return 0
-        return float(json.loads(key)["score"])
+        return float(self.codec.loads(key)["score"])
+
+
+class CachedBackend(object):
+    """Keeps the results of the most recent queries of another backend
+
+    Autocomplete traffic usually repeats the same few prefixes over and over
+    again, so it pays to keep their results around in the process instead
+    of asking the backend every time:
+
+        >>> backend = CachedBackend(RedisBackend(conn), size=5000, ttl=30)
+        >>> s = Suggestive(backend=backend)
+
+    At most `size` results are kept, the least recently used ones are
+    dropped first. Results older than `ttl` seconds are never returned, pass
+    `None` to keep them until they're dropped. The `hits` and `misses`
+    counters tell how well the cache is sized.
+
+    Indexing or removing documents through this class drops the results of
+    all the terms the documents had before and have now, including the ones
+    of phrases with any of these terms. Changes made by other processes are
+    only seen after the `ttl`. Fuzzy and infix queries might read any term,
+    so they're never kept.
+    """
+    def __init__(self, backend, size=1024, ttl=60):
+        self.backend = backend
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._by_term = defaultdict(set)
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def __len__(self):
+        return len(self._results)
+
+    def documents(self):
+        return self.backend.documents()
+
+    def index(self, data_source, field, score='score', progress=None,
+              start=0, **kwargs):
+        def index_chunk(chunk):
+            terms = self._terms_of([doc['id'] for doc in chunk])
+            self.backend.index(chunk, field, score=score, **kwargs)
+            for doc in chunk:
+                terms.update(expand_fields(doc, field, self._max_prefix_len))
+            self.invalidate(terms)
+        size = getattr(self.backend, 'chunk_size', 1000)
+        return index_in_chunks(index_chunk, data_source, size, progress, start)
+
+    def remove(self, doc_id):
+        terms = self._terms_of([doc_id])
+        self.backend.remove(doc_id)
+        self.invalidate(terms)
+
+    def rebuild(self, *args, **kwargs):
+        count = self.backend.rebuild(*args, **kwargs)
+        self.clear()
+        return count
+
+    def update_score(self, doc_id, score, **kwargs):
+        score = self.backend.update_score(doc_id, score, **kwargs)
+        self.invalidate(self._terms_of([doc_id]))
+        return score
+
+    def incr_score(self, doc_id, delta, **kwargs):
+        score = self.backend.incr_score(doc_id, delta, **kwargs)
+        self.invalidate(self._terms_of([doc_id]))
+        return score
+
+    def query(self, term, reverse=False, words=False, limit=-1, offset=0,
+              fields=None, fuzzy=False, infix=False):
+        term = term.lower()
+        if fuzzy or infix:
+            return self.backend.query(
+                term, reverse=reverse, words=words, limit=limit,
+                offset=offset, fields=fields, fuzzy=fuzzy, infix=infix)
+        key = (term, reverse, words, limit, offset, tuple(fields or ()))
+        with self._lock:
+            result = self._lookup(key)
+            generation = self._generation
+        if result is not None:
+            return list(result)
+
+        result = self.backend.query(
+            term, reverse=reverse, words=words, limit=limit, offset=offset,
+            fields=fields)
+
+        with self._lock:
+            self._keep(key, result, generation)
+        return list(result)
+
+    def query_many(self, terms, reverse=False, words=False, limit=-1,
+                   offset=0, fields=None, fuzzy=False, infix=False):
+        """Answer the queries that missed the cache in a single batch"""
+        if fuzzy or infix:
+            return self.backend.query_many(
+                terms, reverse=reverse, words=words, limit=limit,
+                offset=offset, fields=fields, fuzzy=fuzzy, infix=infix)
+        keys = [(term.lower(), reverse, words, limit, offset,
+                 tuple(fields or ())) for term in terms]
+        with self._lock:
+            found = dict((key, self._lookup(key)) for key in set(keys))
+            generation = self._generation
+        missed = [key for key in found if found[key] is None]
+
+        if missed:
+            results = self.backend.query_many(
+                [key[0] for key in missed],
+                reverse=reverse, words=words, limit=limit, offset=offset,
+                fields=fields)
+            with self._lock:
+                for key, result in zip(missed, results):
+                    self._keep(key, result, generation)
+                    found[key] = result
+        return [list(found[key]) for key in keys]
+
+    def _lookup(self, key):
+        # The result kept for `key`, if it's still fresh. Must be called
+        # with the lock held.
+        entry = self._results.pop(key, None)
+        if entry is not None and (entry[0] is None or entry[0] > time.time()):
+            # Putting it back at the end, as the most recently used one
+            self._results[key] = entry
+            self.hits += 1
+            return entry[1]
+        if entry is not None:
+            self._forget(key)
+        self.misses += 1
+        return None
+
+    def _keep(self, key, result, generation):
+        # Must be called with the lock held. Results read while something
+        # got invalidated might be stale, so they're not kept.
+        if generation != self._generation:
+            return
+        expires = None if self.ttl is None else time.time() + self.ttl
+        self._results[key] = expires, result
+        for term in self._terms_read(key[0]):
+            self._by_term[term].add(key)
+        while len(self._results) > self.size:
+            old, _ = self._results.popitem(last=False)
+            self._forget(old)
+
+    def _terms_of(self, doc_ids):
+        # Backends with `lex_terms` keep whole words, the terms read by the
+        # queries are their prefixes
+        terms = self.backend.terms(doc_ids)
+        if getattr(self.backend, 'lex_terms', False):
+            terms = set(iexpand(' '.join(terms)))
+        return terms
+
+    @property
+    def _max_prefix_len(self):
+        # Results are dropped by the terms the backend actually reads
+        return getattr(self.backend, 'max_prefix_len', None)
+
+    def _terms_read(self, term):
+        # Phrases read the terms of all their words
+        return (phrase_terms(term, self._max_prefix_len) or
+                [term[:self._max_prefix_len]])
+
+    def _forget(self, key):
+        for term in self._terms_read(key[0]):
+            keys = self._by_term.get(term)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_term[term]
+
+    def invalidate(self, terms):
+        """Drop all the results kept for `terms`"""
+        with self._lock:
+            self._generation += 1
+            for term in terms:
+                for key in self._by_term.pop(term, ()):
+                    if self._results.pop(key, None) is not None:
+                        self._forget(key)
+
+    def clear(self):
+        """Drop all the results, the counters are kept"""
+        with self._lock:
+            self._generation += 1
+            self._results.clear()
+            self._by_term.clear()
+
+
+# The typecode of the unsigned 32 bits integers of the `CompiledBackend`
+UINT32 = array('I').itemsize == 4 and 'I' or 'L'
+
+
+def uint32_view(buf, start, count):
+    """Read `count` integers saved with `array.tobytes()` from `buf`
+
+    On python 3 they're read in place, so a memory mapped file isn't copied
+    to the memory of the process. On python 2 they're copied to an array.
+    """
+    data = memoryview(buf)[start:start + count * 4]
+    try:
+        return data.cast(UINT32)
+    except AttributeError:
+        return array(UINT32, data.tobytes())
+
+
+def pack_sections(magic, header, sections):
+    """Pack a json `header` and the `sections` in a single buffer
+
+    The `sections` are `(name, data)` pairs, where `data` is a `bytearray` or
+    an `array`. The buffer starts with the `magic` number and the size of
+    the header, then comes the header and the sections, each one aligned to
+    8 bytes. The header gets the `byteorder` of the machine and the position
+    and size of each section, read them back with `read_header()`.
+    """
+    parts = []
+    for name, data in sections:
+        if isinstance(data, bytearray):
+            parts.append((name, bytes(data)))
+        elif hasattr(data, 'tobytes'):
+            parts.append((name, data.tobytes()))
+        else:
+            parts.append((name, data.tostring()))
+
+    # The offsets of the sections change the size of the header, which
+    # moves the sections, until there's enough room for the header
+    start = 8
+    while True:
+        offsets = {}
+        position = start
+        for name, part in parts:
+            offsets[name] = [position, len(part)]
+            position = _align(position + len(part))
+        encoded = json.dumps(dict(
+            header, byteorder=sys.byteorder, sections=offsets),
+            sort_keys=True).encode('utf-8')
+        if 8 + len(encoded) <= start:
+            break
+        start = _align(8 + len(encoded))
+    buf = bytearray(struct.pack('<4sI', magic, len(encoded)))
+    buf.extend(encoded)
+    for name, part in parts:
+        buf.extend(b'\0' * (offsets[name][0] - len(buf)))
+        buf.extend(part)
+    return bytes(buf)
+
+
+def _align(position):
+    return (position + 7) // 8 * 8
+
+
+def read_header(buf, magic, version, kind):
+    """Read the header of a buffer written by `pack_sections()`
+
+    Raises `ValueError` if the buffer doesn't start with `magic`, or if it
+    was written with another `version` or byte order. The `kind` of buffer
+    names it in the errors.
+    """
+    found, size = struct.unpack_from('<4sI', buf, 0)
+    if found != magic:
+        raise ValueError('Not a {}'.format(kind))
+    header = json.loads(bytes(buf[8:8 + size]).decode('utf-8'))
+    if header['version'] != version:
+        raise ValueError('Unknown {} version {}'.format(
+            kind, header['version']))
+    if header['byteorder'] != sys.byteorder:
+        raise ValueError(
+            'The {} was written with another byte order'.format(kind))
+    return header
+
+
+def read_terms(data, offsets):
+    """Decode the utf-8 terms saved one after the other in `data`"""
+    return [bytes(data[offsets[i]:offsets[i + 1]]).decode('utf-8')
+            for i in six.moves.range(len(offsets) - 1)]
+
+
+class CompiledTerms(object):
+    """Sorted sequence of the terms of a `CompiledBackend`
+
+    The terms are saved as utf-8, one after the other, and only decoded
+    when read, which is what `bisect` does to find them.
+    """
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return bytes(self.data[start:end]).decode('utf-8')
+
+    def find(self, term):
+        index = bisect_left(self, term)
+        return index if index < len(self) and self[index] == term else None
+
+
+class CompiledBackend(object):
+    """Read only backend that keeps the whole index in a single buffer
+
+    It's compiled once from the documents of any other backend, and answers
+    queries just like the `DummyBackend` does, using a small fraction of its
+    memory:
+
+        >>> backend = CompiledBackend.from_backend(dummy, field='name')
+        >>> backend.save('names.idx')
+
+    The terms are sorted, so they're found with a binary search, and each
+    one points to its postings: the numbers of its documents, as 32 bits
+    integers, numbered by ascending score. The documents are encoded with
+    the `codec` one after the other, and only decoded when a query returns
+    them.
+
+    Saved indexes are memory mapped by `load()`, so all the processes that
+    load the same file share the same memory, and starting up takes no time:
+
+        >>> s = Suggestive(backend=CompiledBackend.load('names.idx'))
+
+    The `max_prefix_len` and `field_postings` params work just like in the
+    `DummyBackend`. Indexes are saved in the byte order of the machine that
+    compiled them.
+    """
+
+    MAGIC = b'SGCB'
+    VERSION = 1
+
+    # The parts of the buffer, in the order they're saved
+    SECTIONS = ['terms', 'term_offsets', 'postings_offsets', 'postings',
+                'documents', 'document_offsets']
+
+    def __init__(self, buf, codec=None):
+        self.codec = codec or JsonCodec()
+        self.buffer = buf
+
+        header = read_header(
+            buf, self.MAGIC, self.VERSION, 'compiled suggestive index')
+        self.max_prefix_len = header['max_prefix_len']
+        self.field_postings = header['field_postings']
+
+        sections = dict((name, memoryview(buf)[start:start + length])
+                        for name, (start, length)
+                        in header['sections'].items())
+        ints = dict((name, uint32_view(buf, start, length // 4))
+                    for name, (start, length) in header['sections'].items()
+                    if name.endswith('offsets') or name == 'postings')
+        self._terms = CompiledTerms(sections['terms'], ints['term_offsets'])
+        self._postings_offsets = ints['postings_offsets']
+        self._postings = ints['postings']
+        self._documents = sections['documents']
+        self._document_offsets = ints['document_offsets']
+
+    @classmethod
+    def compile(cls, data, field, score='score', max_prefix_len=None,
+                field_postings=False, codec=None):
+        """Compile an index of the documents of `data`
+
+        The params `field` and `score` work just like in the `index()`
+        method of the other backends. Documents with the same id are indexed
+        only once, the last one wins.
+        """
+        codec = codec or JsonCodec()
+        docs = list(OrderedDict((doc['id'], doc) for doc in data).values())
+        docs.sort(key=lambda doc: doc[score])
+
+        terms = defaultdict(list)
+        for number, doc in enumerate(docs):
+            found = expand_fields(doc, field, max_prefix_len)
+            if field_postings:
+                found += expand_scoped(doc, field, max_prefix_len)
+            for term in found:
+                terms[term].append(number)
+
+        sections = OrderedDict((name, array(UINT32)) for name in
+                               cls.SECTIONS if name.endswith('offsets'))
+        sections['terms'] = bytearray()
+        sections['postings'] = array(UINT32)
+        sections['documents'] = bytearray()
+        for name in ['term_offsets', 'postings_offsets', 'document_offsets']:
+            sections[name].append(0)
+        for term in sorted(terms):
+            sections['terms'].extend(term.encode('utf-8'))
+            sections['term_offsets'].append(len(sections['terms']))
+            sections['postings'].extend(terms[term])
+            sections['postings_offsets'].append(len(sections['postings']))
+        for doc in docs:
+            encoded = codec.dumps(doc)
+            if isinstance(encoded, six.text_type):
+                encoded = encoded.encode('utf-8')
+            sections['documents'].extend(encoded)
+            sections['document_offsets'].append(len(sections['documents']))
+        header = {
+            'version': cls.VERSION,
+            'max_prefix_len': max_prefix_len,
+            'field_postings': field_postings,
+        }
+        buf = pack_sections(cls.MAGIC, header, [
+            (name, sections[name]) for name in cls.SECTIONS])
+        return cls(buf, codec)
+
+    @classmethod
+    def from_backend(cls, backend, field, score='score', **kwargs):
+        """Compile an index of all the documents of `backend`
+
+        The documents must still have the `field` and `score` keys, so
+        mind the `store` param used to index them.
+        """
+        return cls.compile(
+            backend.documents().values(), field, score, **kwargs)
+
+    @classmethod
+    def load(cls, path, codec=None):
+        """Memory map an index saved by `save()`"""
+        with open(path, 'rb') as source:
+            buf = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buf, codec)
+
+    def save(self, path):
+        with open(path, 'wb') as target:
+            target.write(self.buffer)
+
+    def __len__(self):
+        return len(self._document_offsets) - 1
+
+    def _document(self, number):
+        start = self._document_offsets[number]
+        end = self._document_offsets[number + 1]
+        return self.codec.loads(bytes(self._documents[start:end]))
+
+    def documents(self):
+        """Return all indexed documents"""
+        docs = (self._document(n) for n in six.moves.range(len(self)))
+        return dict((doc['id'], doc) for doc in docs)
+
+    def _numbers(self, term):
+        index = self._terms.find(term)
+        if index is None:
+            return ()
+        start = self._postings_offsets[index]
+        return self._postings[start:self._postings_offsets[index + 1]]
+
+    def _lookup(self, term, fields):
+        # The numbers of the documents of a single word, in all the fields
+        # or in `fields`, sorted
+        if not fields:
+            return self._numbers(term)
+        if len(fields) == 1:
+            return self._numbers(scoped_term(fields, term))
+        found = set()
+        for f in fields:
+            found.update(self._numbers(scoped_term([f], term)))
+        return sorted(found)
+
+    def query(self, term, reverse=False, words=False, limit=-1, offset=0,
+              fields=None, fuzzy=False, infix=False):
+        check_fields(self, fields)
+        check_fuzzy(self, fuzzy)
+        check_infix(self, infix, fields)
+        term = term.lower()
+        terms = phrase_terms(term, self.max_prefix_len)
+        if terms:
+            found = sorted((self._lookup(t, fields) for t in terms), key=len)
+            common = set(found[0])
+            for numbers in found[1:]:
+                common.intersection_update(numbers)
+            numbers = sorted(common)
+            term = term.split()[-1]
+        else:
+            numbers = self._lookup(term[:self.max_prefix_len], fields)
+        size = len(numbers)
+        stop = limit >= 0 and (offset + limit) or None
+        if not words:
+            end = size if stop is None else min(stop, size)
+            return [self._document(numbers[size - p - 1 if reverse else p])
+                    for p in six.moves.range(offset, end)]
+
+        result = []
+        seen = set()
+        for position in six.moves.range(size):
+            doc = self._document(
+                numbers[size - position - 1 if reverse else position])
+            for word in find_words_in_doc(doc, term):
+                if word not in seen:
+                    seen.add(word)
+                    result.append(word)
+            if stop is not None and len(result) >= stop:
+                break
+        return result[offset:stop]
+
+    def query_many(self, terms, reverse=False, words=False, limit=-1,
+                   offset=0, fields=None, fuzzy=False, infix=False):
+        """Answer a query for each one of `terms`, in a list"""
+        return [self.query(term, reverse, words, limit, offset, fields, fuzzy,
+                           infix) for term in terms]
 
 
 class Suggestive(object):
@@ -258,7 +3139,7 @@ class Suggestive(object):
 
     The memory backend uses native python data types and all the data will be
     destroyed when the your instance of the `Suggestive` class gets freed by
-    python.
+    python, unless you save it. Read the `DummyBackend.save()` docs.
 
     ### Unit tests of features that use suggestive
 
@@ -276,17 +3157,56 @@ class Suggestive(object):
     The documents are jsonified and saved inside of a hash table. This might
     consume a lot of memory, be careful and keep your documents as small as
     possible!
+
+    ### Compiled backend
+
+    A read only copy of the index of any other backend, saved to a file that
+    all the processes of a server can memory map and share. Read the
+    `CompiledBackend` docs.
     """
 
     def __init__(self, backend):
         self.backend = backend
 
-    def index(self, data_source, field, score='score'):
-        self.backend.index(data_source, field, score=score)
+    def index(self, data_source, field, score='score', store=None,
+              progress=None, start=0):
+        self.backend.index(data_source, field, score=score, store=store,
+                           progress=progress, start=start)
 
     def remove(self, doc_id):
         self.backend.remove(doc_id)
 
-    def suggest(self, term, words=False, limit=-1, offset=0):
+    def rebuild(self, data_source, field, score='score', store=None,
+                progress=None):
+        return self.backend.rebuild(data_source, field, score=score,
+                                    store=store, progress=progress)
+
+    def suggest(self, term, words=False, limit=-1, offset=0, fields=None,
+                fuzzy=False, infix=False):
+        """Suggest the documents, or the `words`, that start with `term`
+
+        With `fuzzy`, the documents of the terms within a few typos of
+        `term` are suggested too, after the ones of `term` itself. The
+        backend needs `max_edits`, read the `DummyBackend` docs.
+
+        With `infix`, the documents are the ones with `term` anywhere inside
+        of their words. The backend needs the `ngrams` of the fields.
+        """
         return self.backend.query(
-            unidecode(term), words=words, limit=limit, offset=offset)
+            normalize(term), words=words, limit=limit, offset=offset,
+            fields=fields, fuzzy=fuzzy, infix=infix)
+
+    def update_score(self, doc_id, score, score_field='score'):
+        return self.backend.update_score(
+            doc_id, score, score_field=score_field)
+
+    def incr_score(self, doc_id, delta, score_field='score'):
+        return self.backend.incr_score(doc_id, delta, score_field=score_field)
+
+    def suggest_many(self, terms, words=False, limit=-1, offset=0,
+                     fields=None, fuzzy=False, infix=False):
+        """Same as `suggest()` for each one of `terms`, in a single batch"""
+        return self.backend.query_many(
+            [normalize(term) for term in terms],
+            words=words, limit=limit, offset=offset, fields=fields,
+            fuzzy=fuzzy, infix=infix)
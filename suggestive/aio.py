@@ -0,0 +1,314 @@
+# -*- coding: utf-8; -*-
+"""Asyncio versions of the `RedisBackend` and of the `Suggestive` facade
+
+They need python 3.5+ and an asyncio redis connection, like the ones of the
+`redis.asyncio` module:
+
+    >>> import redis.asyncio
+    >>> from suggestive.aio import AsyncRedisBackend, AsyncSuggestive
+    >>> s = AsyncSuggestive(AsyncRedisBackend(conn=redis.asyncio.Redis()))
+    >>> await s.index([{'id': 0, 'name': 'Lincoln'}], field='name', score='id')
+    >>> await s.suggest('li')
+    [{'id': 0, 'name': 'Lincoln'}]
+"""
+from __future__ import unicode_literals
+from collections import OrderedDict, defaultdict
+from functools import wraps
+from itertools import islice
+import time
+
+from . import (
+    KeyManager,
+    RedisBackend,
+    REMOVE_SCRIPT,
+    QUERY_SCRIPT,
+    SCORE_SCRIPT,
+    chunks,
+    normalize,
+    phrase_terms,
+)
+
+
+def refreshing(method):
+    # Reads the active version of versioned indexes before running `method`
+    # when it's due, since the `keys` property can't wait for redis.
+    @wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        if self.versioned and (self._active is None or
+                               self._active[0] <= time.time()):
+            await self.refresh()
+        return await method(self, *args, **kwargs)
+    return wrapper
+
+
+class AsyncRedisBackend(RedisBackend):
+    """The `RedisBackend` for asyncio connections
+
+    It takes the same params and writes the same keys, laid out by the same
+    `KeyManager`, with the same lua scripts. So an `AsyncRedisBackend` and a
+    `RedisBackend` can read and write the same index side by side. All the
+    methods that talk to redis are coroutines. The keys, the commands and
+    the decoding of their results come from the helpers of the
+    `RedisBackend`, only the calls to redis are made here.
+    """
+
+    @property
+    def keys(self):
+        return self._active[1] if self.versioned else self._keys
+
+    @keys.setter
+    def keys(self, keys):
+        self._keys = keys
+
+    async def refresh(self):
+        """Read which version of the index is active right now"""
+        self._use_version(
+            await self.conn.get(self._keys.for_active_version()))
+
+    async def rebuild(self, data_source, field, score='score', store=None,
+                      progress=None):
+        """Read the `RedisBackend.rebuild()` docs"""
+        if not self.versioned:
+            raise RuntimeError("Only versioned backends can be rebuilt")
+        version = await self.conn.incr(self._keys.for_versions_counter())
+        count = await self._builder(version).index(
+            data_source, field, score=score, store=store, progress=progress)
+
+        previous = await self.conn.getset(
+            self._keys.for_active_version(), version)
+        self._use_version(version)
+        await self.cleanup(keep=[version, previous])
+        return count
+
+    async def cleanup(self, keep=None, batch_size=1000):
+        """Read the `RedisBackend.cleanup()` docs"""
+        active = await self.conn.get(self._keys.for_active_version())
+        keep = self._kept_versions([active] if keep is None else keep, active)
+
+        deleted = 0
+        batches = defaultdict(list)
+        pattern = self._keys.for_versions()
+        async for key in self.conn.scan_iter(match=pattern, count=batch_size):
+            batch = self._batch_unlink(batches, key, keep, batch_size)
+            if batch:
+                deleted += await self.conn.execute_command('UNLINK', *batch)
+        for batch in batches.values():
+            if batch:
+                deleted += await self.conn.execute_command('UNLINK', *batch)
+        return deleted
+
+    async def _execute(self, commands):
+        # Read `RedisBackend._execute()`, queueing scripts in a pipeline
+        # is a coroutine here
+        pipe = self.conn.pipeline(transaction=False)
+        for name, args, kwargs in commands:
+            if name == 'script':
+                await self.script(args[0])(client=pipe, **kwargs)
+            else:
+                getattr(pipe, name)(*args, **kwargs)
+        return await pipe.execute()
+
+    @refreshing
+    async def documents(self):
+        result = {}
+        for keys in self._all_keys():
+            docs = await self.conn.hgetall(keys.for_docs())
+            ids = self.intern_ids and await self.conn.hgetall(keys.for_ids())
+            result.update(self._decode_documents(docs, ids))
+        return result
+
+    @refreshing
+    async def index(self, data_source, field, score='score', store=None,
+                    progress=None, start=0):
+        """Index documents in chunks of `chunk_size` documents
+
+        Read the `RedisBackend.index()` docs for more info.
+        """
+        count = start
+        for chunk in chunks(islice(data_source, start, None), self.chunk_size):
+            await self._execute(self._write_commands(
+                *self._chunk_commands(chunk, field, score, store)))
+            count += len(chunk)
+            if progress is not None:
+                progress(count)
+        return count - start
+
+    @refreshing
+    async def terms(self, doc_ids):
+        """Return all the terms the documents in `doc_ids` were added to"""
+        return self._decode_terms(
+            await self._execute(self._terms_commands(doc_ids)))
+
+    @refreshing
+    async def remove(self, doc_id):
+        """Remove a document and all its terms with the `REMOVE_SCRIPT`"""
+        await self.script(REMOVE_SCRIPT)(
+            client=self.conn, **self._remove_params(doc_id))
+
+    @refreshing
+    async def query(self, term, reverse=False, words=False, limit=-1,
+                    offset=0, fields=None, fuzzy=False, infix=False):
+        keys = self.keys
+        term = term.lower()
+        stop = self._query_stop(words, limit, offset, fields, fuzzy, infix)
+        if fuzzy and not phrase_terms(term, self.max_prefix_len):
+            return await self._fuzzy_query(
+                term[:self.max_prefix_len], reverse, words, offset, stop,
+                fields, keys)
+        stores, key, scoped = self._query_plan(term, fields, keys, infix)
+        if stores or self.shards:
+            return (await self.query_many(
+                [term], reverse, words, limit, offset, fields,
+                infix=infix))[0]
+        if self.scripted_queries:
+            return self._scripted_answer(
+                await self.script(QUERY_SCRIPT)(
+                    client=self.conn, **self._query_script_params(
+                        key, term, reverse, words, offset, stop, keys)),
+                scoped, reverse, words, offset, stop)
+
+        doc_ids = await (
+            self.conn.zrevrange if not reverse else self.conn.zrange)(
+                key, offset, stop)
+        self._check_truncation(scoped, offset, stop, doc_ids, reverse)
+        return (await self._read_many([doc_ids], [term], words, keys))[0]
+
+    @refreshing
+    async def query_many(self, terms, reverse=False, words=False, limit=-1,
+                         offset=0, fields=None, fuzzy=False, infix=False):
+        """Answer a query for each one of `terms`, in a list
+
+        Read the `RedisBackend.query_many()` docs for more info.
+        """
+        stop = self._query_stop(words, limit, offset, fields, fuzzy, infix)
+        if fuzzy:
+            return [await self.query(term, reverse, words, limit, offset,
+                                     fields, fuzzy) for term in terms]
+        keys = self.keys
+        terms = [term.lower() for term in terms]
+        commands, reads = self._range_commands(
+            terms, reverse, words, offset, stop, fields, infix, keys)
+        found = self._ranges_found(
+            reads, await self._execute(commands), reverse, words, offset,
+            stop)
+        if self.scripted_queries:
+            return [self._scripted_result(words, r) for r in found]
+        return await self._read_many(
+            found, [term for _, term, _ in reads], words, keys)
+
+    async def _fuzzy_query(self, term, reverse, words, start, stop, fields,
+                           keys):
+        sources = self._fuzzy_sources(term, await self._execute(
+            self._fuzzy_commands(term, keys)), fields, keys)
+        found, terms = self._merge_fuzzy(sources, await self._execute(
+            self._top_commands([s[-1] for s in sources], reverse, stop)),
+            reverse, start, stop)
+        return self._flatten(
+            await self._read_many(found, terms, words, keys), words)
+
+    async def _read_many(self, found, terms, words, keys):
+        unique = list(OrderedDict.fromkeys(i for ids in found for i in ids))
+        values = unique and await self._hmget(
+            words and KeyManager.for_words or KeyManager.for_docs,
+            unique, keys) or []
+        if not words:
+            return self._decode_many(found, unique, values)
+        missing = [i for i, v in zip(unique, values) if v is None]
+        docs = missing and await self._hmget(
+            KeyManager.for_docs, missing, keys)
+        return self._match_many(
+            found, terms, unique, values, dict(zip(missing, docs or [])))
+
+    async def _hmget(self, hash_of, ids, keys):
+        if not self.shards:
+            return await self.conn.hmget(hash_of(keys), ids)
+        by_shard, commands = self._hmget_commands(hash_of, ids, keys)
+        return self._unshard(by_shard, await self._execute(commands), ids)
+
+    @refreshing
+    async def get_score(self, item_id):
+        '''
+        Given an item id (or name), returns the current score of that term
+        '''
+        keys = self._keys_of(item_id)
+        if self.intern_ids:
+            item_id = await self.conn.hget(keys.for_ids(), item_id)
+            if item_id is None:
+                return 0
+        found = await self.conn.hmget(keys.for_docs(), item_id)
+        return self._decode_score(found[0])
+
+    @refreshing
+    async def update_score(self, doc_id, score, score_field='score'):
+        """Read the `RedisBackend.update_score()` docs"""
+        return await self._rescore(doc_id, lambda doc: score, score_field)
+
+    @refreshing
+    async def incr_score(self, doc_id, delta, score_field='score'):
+        """Read the `RedisBackend.incr_score()` docs"""
+        return await self._rescore(
+            doc_id, lambda doc: doc[score_field] + delta, score_field)
+
+    async def _rescore(self, doc_id, new_score, score_field):
+        keys = self.keys
+        while True:
+            score, params = self._rescore_params(
+                doc_id, await self._body(doc_id, keys), new_score,
+                score_field, keys)
+            terms = await self.script(SCORE_SCRIPT)(
+                client=self.conn, **params)
+            if terms is not None:
+                break
+        if self.max_postings_per_term is not None:
+            await self._execute(self._trim_commands(
+                doc_id, self._decode_terms([terms]), keys))
+        return score
+
+    async def _body(self, doc_id, keys):
+        keys = self._keys_of(doc_id, keys)
+        if self.intern_ids:
+            doc_id = await self.conn.hget(keys.for_ids(), doc_id)
+            if doc_id is None:
+                return None
+        return await self.conn.hget(keys.for_docs(), doc_id)
+
+
+class AsyncSuggestive(object):
+    """The `Suggestive` facade for asyncio backends"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def rebuild(self, data_source, field, score='score', store=None,
+                      progress=None):
+        return await self.backend.rebuild(
+            data_source, field, score=score, store=store, progress=progress)
+
+    async def index(self, data_source, field, score='score', store=None,
+                    progress=None, start=0):
+        await self.backend.index(data_source, field, score=score, store=store,
+                                 progress=progress, start=start)
+
+    async def remove(self, doc_id):
+        await self.backend.remove(doc_id)
+
+    async def suggest(self, term, words=False, limit=-1, offset=0,
+                      fields=None, fuzzy=False, infix=False):
+        return await self.backend.query(
+            normalize(term), words=words, limit=limit, offset=offset,
+            fields=fields, fuzzy=fuzzy, infix=infix)
+
+    async def update_score(self, doc_id, score, score_field='score'):
+        return await self.backend.update_score(
+            doc_id, score, score_field=score_field)
+
+    async def incr_score(self, doc_id, delta, score_field='score'):
+        return await self.backend.incr_score(
+            doc_id, delta, score_field=score_field)
+
+    async def suggest_many(self, terms, words=False, limit=-1, offset=0,
+                           fields=None, fuzzy=False, infix=False):
+        return await self.backend.query_many(
+            [normalize(term) for term in terms],
+            words=words, limit=limit, offset=offset, fields=fields,
+            fuzzy=fuzzy, infix=infix)
@@ -0,0 +1,205 @@
+# -*- coding: utf-8; -*-
+from __future__ import unicode_literals
+from sure import scenario
+
+import asyncio
+import fakeredis
+import suggestive
+
+from suggestive.aio import AsyncRedisBackend, AsyncSuggestive
+
+
+def connect(context):
+    """Prepare a blocking and an asyncio redis connection before each test
+
+    Both connections talk to the same in-process redis, which starts empty
+    in every test, and runs the lua scripts with `lupa`."""
+    context.loop = asyncio.new_event_loop()
+    context.server = fakeredis.FakeServer()
+    context.conn = fakeredis.FakeStrictRedis(
+        server=context.server, decode_responses=True)
+    context.aconn = fakeredis.FakeAsyncRedis(
+        server=context.server, decode_responses=True)
+    context.run = context.loop.run_until_complete
+    return context
+
+
+@scenario(connect)
+def test_async_redis_backend(context):
+    # Given that I have an async backend
+    backend = AsyncRedisBackend(conn=context.aconn)
+    data = [
+        {"id": 0, "name": "Lincoln", "score": 10},
+        {"id": 1, "name": "Livia", "score": 30},
+        {"id": 2, "name": "Linus", "score": 20},
+    ]
+
+    # When I index some documents
+    context.run(backend.index(data, field='name')).should.equal(3)
+
+    # Then I see that I can query them, sorted by score
+    context.run(backend.query('li', limit=1)).should.equal([
+        {"id": 1, "name": "Livia", "score": 30},
+        {"id": 2, "name": "Linus", "score": 20},
+    ])
+    context.run(backend.query('li', words=True, reverse=True)).should.equal(
+        ['Lincoln', 'Linus', 'Livia'])
+    context.run(backend.get_score(1)).should.equal(30.0)
+    context.run(backend.terms([2])).should.equal(
+        set(suggestive.expand('linus')))
+
+    # And I see that I can change the scores
+    context.run(backend.incr_score(0, 25)).should.equal(35)
+    context.run(backend.get_score(0)).should.equal(35.0)
+    [d['id'] for d in context.run(backend.query('lin'))].should.equal([0, 2])
+
+    # And when I remove a document, Then I see it's gone
+    context.run(backend.remove(1))
+    context.run(backend.query('liv')).should.equal([])
+    sorted(context.run(backend.documents())).should.equal(['0', '2'])
+
+
+@scenario(connect)
+def test_async_and_blocking_backends_side_by_side(context):
+    # Given that I have a blocking and an async suggestive sharing the same
+    # redis, one of them answering queries with the lua script
+    blocking = suggestive.Suggestive(
+        backend=suggestive.RedisBackend(conn=context.conn, intern_ids=True))
+    async_ = AsyncSuggestive(AsyncRedisBackend(
+        conn=context.aconn, intern_ids=True, scripted_queries=True))
+
+    # When each of them indexes a document
+    blocking.index([{"id": "a", "name": "Fábio", "score": 1}], field='name')
+    context.run(async_.index(
+        [{"id": "b", "name": "Fafá", "score": 2}], field='name'))
+
+    # Then I see that both of them find both documents
+    expected = [
+        {"id": "b", "name": "Fafá", "score": 2},
+        {"id": "a", "name": "Fábio", "score": 1},
+    ]
+    blocking.suggest('Fa').should.equal(expected)
+    context.run(async_.suggest('Fa')).should.equal(expected)
+
+    # And I see that both of them answer phrases the same way
+    context.run(async_.suggest('fa fab')).should.equal(
+        blocking.suggest('fa fab'))
+    context.run(async_.suggest('fa fab')).should.equal(expected[1:])
+
+    # And I see that both of them answer many queries at once
+    context.run(async_.suggest_many(['fa', 'fa fab'])).should.equal(
+        blocking.suggest_many(['fa', 'fa fab']))
+
+    # And when the async one removes a document, Then I see that the
+    # blocking one doesn't find it anymore
+    context.run(async_.remove("a"))
+    blocking.suggest('Fa').should.equal(expected[:1])
+
+
+@scenario(connect)
+def test_async_redis_backend_rebuilding_versions(context):
+    # Given that I have a versioned async backend and a blocking one
+    backend = AsyncRedisBackend(conn=context.aconn, versioned=True)
+    blocking = suggestive.RedisBackend(conn=context.conn, versioned=True)
+
+    # When I rebuild the index twice
+    data = [{"id": 0, "name": "Lincoln", "score": 1}]
+    context.run(backend.rebuild(data, field='name')).should.equal(1)
+    context.run(backend.rebuild(data[:0], field='name')).should.equal(0)
+
+    # Then I see that both of them read the active version
+    context.run(backend.query('li')).should.equal([])
+    blocking.query('li').should.equal([])
+
+    # And I see that the old versions are gone after a cleanup
+    context.run(backend.cleanup()).should.be.greater_than(0)
+    context.conn.keys('suggestive:v[0-9]*').should.be.empty
+
+
+@scenario(connect)
+def test_async_redis_backend_sharding(context):
+    # Given that I have an index split in shards by the async backend
+    data = [
+        {"id": 0, "name": "Lincoln", "score": 1},
+        {"id": 1, "name": "Livia", "score": 3},
+        {"id": 2, "name": "Linus", "score": 2},
+    ]
+    backend = AsyncRedisBackend(conn=context.aconn, shards=3)
+    context.run(backend.index(data, field='name'))
+
+    # When I query it, Then I see the documents of all the shards, sorted
+    # by score, just like the blocking backend sees them
+    blocking = suggestive.RedisBackend(conn=context.conn, shards=3)
+    found = context.run(backend.query('li', limit=1, offset=1))
+    [d['id'] for d in found].should.equal([2, 0])
+    blocking.query('li', limit=1, offset=1).should.equal(found)
+
+
+@scenario(connect)
+def test_async_redis_backend_lex_terms(context):
+    # Given that I have an async backend that keeps whole words only, split
+    # in shards, and a blocking one that keeps all the prefixes
+    data = [
+        {"id": 0, "name": "Lincoln", "score": 1},
+        {"id": 1, "name": "Livia", "score": 3},
+        {"id": 2, "name": "Linus", "score": 2},
+    ]
+    backend = AsyncRedisBackend(conn=context.aconn, lex_terms=True, shards=2)
+    prefixes = suggestive.RedisBackend(conn=context.conn, namespace='p')
+    context.run(backend.index(data, field='name'))
+    prefixes.index(data, field='name')
+    context.run(backend.query('li', limit=1))
+
+    # When I remove a document and index another one between two queries
+    context.run(backend.remove(1))
+    context.run(backend.index(
+        [{"id": 3, "name": "Lia", "score": 4}], field='name'))
+    prefixes.remove(1)
+    prefixes.index([{"id": 3, "name": "Lia", "score": 4}], field='name')
+
+    # Then I see the changes right away, in any order
+    for params in [{'limit': 1}, {'reverse': True, 'limit': 1}, {}]:
+        context.run(backend.query('li', **params)).should.equal(
+            prefixes.query('li', **params))
+        context.run(backend.query_many(['l'], **params)).should.equal(
+            prefixes.query_many(['l'], **params))
+
+
+@scenario(connect)
+def test_async_redis_backend_removing_after_phrase_queries(context):
+    # Given that I have a plain and a sharded async backend
+    data = [
+        {"id": 1, "name": "John Smith", "score": 10},
+        {"id": 2, "name": "John Smoke", "score": 20},
+    ]
+    for backend in [AsyncRedisBackend(conn=context.aconn),
+                    AsyncRedisBackend(
+                        conn=context.aconn, namespace='sharded', shards=2)]:
+        context.run(backend.index(data, field='name'))
+
+        # And I stored the intersection of a phrase with a query
+        context.run(backend.query('john sm')).should.have.length_of(2)
+
+        # When I remove one of its documents, Then I see that it doesn't
+        # come back from the stored intersection
+        context.run(backend.remove(2))
+        context.run(backend.query('john sm')).should.equal([data[0]])
+
+
+@scenario(connect)
+def test_async_redis_backend_fuzzy_queries(context):
+    # Given that I have an index that tolerates typos
+    data = [
+        {"id": 0, "name": "Lincoln", "score": 1},
+        {"id": 1, "name": "Livia", "score": 3},
+        {"id": 2, "name": "Lincon", "score": 2},
+    ]
+    backend = AsyncRedisBackend(conn=context.aconn, max_edits=1)
+    context.run(backend.index(data, field='name'))
+
+    # When I query it with a typo, Then I see the same documents the
+    # blocking backend sees
+    blocking = suggestive.RedisBackend(conn=context.conn, max_edits=1)
+    found = context.run(backend.query('lincl', fuzzy=True))
+    [d['id'] for d in found].should.equal([2, 0])
+    blocking.query('lincl', fuzzy=True).should.equal(found)
@@ -142,3 +142,560 @@ def test_suggestive(context):
         {"id": 0, "name": "Fafá de Belém", "score": 23},
         {"id": 1, "name": "Fábio Júnior", "score": 12.5},
     ])
+
+
+@scenario(connect)
+def test_redis_backend_replacing_documents(context):
+    # Given that I have an instance of our redis backend with some indexed data
+    data = [{"id": 0, "name": "Lincoln", "score": 1},
+            {"id": 1, "name": "Livia", "score": 2}]
+    backend = suggestive.RedisBackend(conn=context.conn)
+    backend.index(data, field='name')
+
+    # When I index the first document again with a different name and score
+    backend.index([{"id": 0, "name": "Liam", "score": 3}], field='name')
+
+    # Then I see that the terms it doesn't have anymore are gone
+    context.conn.exists('suggestive:d:lin').should.be.false
+    context.conn.exists('suggestive:d:lincoln').should.be.false
+
+    # And that the terms it kept got the new score
+    context.conn.zrange(
+        'suggestive:d:li', 0, -1, withscores=True).should.equal([
+            ('1', 2.0), ('0', 3.0)])
+    context.conn.zrange('suggestive:d:liam', 0, -1).should.equal(['0'])
+
+    # And that the body of the document was replaced
+    backend.query('liam').should.equal([{"id": 0, "name": "Liam", "score": 3}])
+
+
+@scenario(connect)
+def test_redis_backend_scripted_queries(context):
+    # Given that I have two redis backends, one of them answering queries
+    # with a lua script, sharing the same indexed data
+    data = [
+        {"id": 0, 'field1': 'Pascal programming language', 'field2': 'Python'},
+        {"id": 1, 'field1': 'Italian Paníni', 'field2': 'Pizza Italiana'},
+        {"id": 2, 'field1': 'Pacific Ocean', 'field2': 'Posseidon, The king'},
+        {"id": 3, 'field1': 'Kiwi', 'field2': 'Passion-Fruit'},
+        {"id": 4, 'field1': 'I love', 'field2': 'Paníni'},
+    ]
+    backend = suggestive.RedisBackend(conn=context.conn)
+    scripted = suggestive.RedisBackend(
+        conn=context.conn, scripted_queries=True)
+    backend.index(data, field=['field1', 'field2'], score='id')
+
+    # When I query both of them, Then I see that they return the same
+    # documents
+    scripted.query('pa').should.equal(backend.query('pa'))
+    scripted.query('pa', reverse=True, limit=1, offset=1).should.equal(
+        backend.query('pa', reverse=True, limit=1, offset=1))
+    scripted.query('nothing').should.equal([])
+
+    # And I see that the words found in the documents are the same too
+    scripted.query('Pa', words=True).should.equal([
+        'Paníni', 'Passion-Fruit', 'Pacific', 'Pascal'
+    ])
+    scripted.query('pa', words=True).should.equal(
+        backend.query('pa', words=True))
+
+    # And when the words of the documents weren't stored, like in indexes
+    # built by older versions, Then I see that both backends still find
+    # them in the documents
+    context.conn.delete(backend.keys.for_words())
+    scripted.query('pa', words=True).should.equal([
+        'Paníni', 'Passion-Fruit', 'Pacific', 'Pascal'
+    ])
+    backend.query('pa', words=True).should.equal([
+        'Paníni', 'Passion-Fruit', 'Pacific', 'Pascal'
+    ])
+
+
+@scenario(connect)
+def test_redis_backend_phrase_queries(context):
+    # Given that I have a dummy and a redis backend with the same people
+    data = [
+        {"id": 0, "name": "John Smith", "score": 10},
+        {"id": 1, "name": "John Doe", "score": 30},
+        {"id": 2, "name": "Jane Smithers", "score": 20},
+        {"id": 3, "name": "Smitty John", "score": 5},
+    ]
+    dummy = suggestive.DummyBackend()
+    dummy.index(data, field='name')
+    backend = suggestive.RedisBackend(conn=context.conn)
+    backend.index(data, field='name')
+    scripted = suggestive.RedisBackend(
+        conn=context.conn, scripted_queries=True)
+
+    # When I type a phrase word by word, Then I see that all the backends
+    # agree on the documents and on the words found
+    for phrase in ['john s', 'john sm', 'john smi', 'smit jo']:
+        for params in [{}, {'words': True}, {'offset': 1}]:
+            expected = dummy.query(phrase, reverse=True, **params)
+            backend.query(phrase, **params).should.equal(expected)
+            scripted.query(phrase, **params).should.equal(expected)
+
+    # And I see that the intersections are kept in keys that expire
+    ttl = context.conn.ttl('suggestive:p:john smi')
+    (0 < ttl <= backend.phrase_ttl).should.be.true
+    backend.query('john xavier').should.equal([])
+
+    # And when a document is indexed again without the phrase, and another
+    # one gets a higher score, Then I see that the stored intersection still
+    # answers with the documents and the order it had, until it expires
+    backend.index([{"id": 0, "name": "John Xavier", "score": 10}],
+                  field='name')
+    backend.update_score(3, 50)
+    [d['id'] for d in backend.query('john smi')].should.equal([0, 3])
+    context.conn.delete('suggestive:p:john smi')
+    [d['id'] for d in backend.query('john smi')].should.equal([3])
+
+
+@scenario(connect)
+def test_redis_backend_removing_after_phrase_queries(context):
+    # Given that I have plain, scripted and sharded redis backends
+    data = [
+        {"id": 1, "name": "John Smith", "score": 10},
+        {"id": 2, "name": "John Smoke", "score": 20},
+    ]
+    backends = [
+        suggestive.RedisBackend(conn=context.conn),
+        suggestive.RedisBackend(
+            conn=context.conn, namespace='scripted', scripted_queries=True),
+        suggestive.RedisBackend(
+            conn=context.conn, namespace='sharded', shards=2),
+    ]
+    for backend in backends:
+        backend.index(data, field='name')
+
+        # And I stored the intersection of a phrase with a query
+        backend.query('john sm').should.have.length_of(2)
+
+        # When I remove one of its documents
+        backend.remove(2)
+
+        # Then I see that it doesn't come back from the stored intersection
+        backend.query('john sm').should.equal([data[0]])
+        backend.query('john sm', words=True).should.equal(['Smith'])
+
+
+@scenario(connect)
+def test_redis_backend_query_many(context):
+    # Given that I have a redis backend and a scripted one sharing some data
+    data = [
+        {"id": 0, "name": "John Smith", "score": 10},
+        {"id": 1, "name": "John Doe", "score": 30},
+        {"id": 2, "name": "Jane Smithers", "score": 20},
+    ]
+    backend = suggestive.RedisBackend(conn=context.conn)
+    backend.index(data, field='name')
+    scripted = suggestive.RedisBackend(
+        conn=context.conn, scripted_queries=True)
+    terms = ['j', 'smi', 'john s', 'nothing', 'j']
+
+    # When I query many terms at once, Then I see that I get the same
+    # results of querying them one by one
+    for params in [{}, {'words': True}, {'limit': 1, 'reverse': True}]:
+        expected = [backend.query(term, **params) for term in terms]
+        backend.query_many(terms, **params).should.equal(expected)
+        scripted.query_many(terms, **params).should.equal(expected)
+
+
+@scenario(connect)
+def test_redis_backend_updating_scores(context):
+    # Given that I have a redis backend that keeps two documents per term and
+    # interns their ids
+    backend = suggestive.RedisBackend(
+        conn=context.conn, max_postings_per_term=2, intern_ids=True)
+    backend.index([
+        {"id": "a", "name": "Lincoln", "score": 10},
+        {"id": "b", "name": "Livia", "score": 30},
+        {"id": "c", "name": "Linus", "score": 20},
+    ], field='name')
+
+    # When I raise the score of the document left out of the shortest terms
+    backend.incr_score("a", 30).should.equal(40)
+
+    # Then I see that it took its place back, in all its terms
+    [d['id'] for d in backend.query('l')].should.equal(['a', 'b'])
+    [d['id'] for d in backend.query('lin')].should.equal(['a', 'c'])
+    backend.get_score("a").should.equal(40)
+
+    # And when I lower it again, Then I see it goes back down
+    backend.update_score("a", 1).should.equal(1)
+    backend.query('lin')[1].should.equal(
+        {"id": "a", "name": "Lincoln", "score": 1})
+
+
+@scenario(connect)
+def test_redis_backend_parallel_indexing(context):
+    # Given that I have a redis backend that indexes in two processes
+    backend = suggestive.RedisBackend(
+        conn=context.conn, chunk_size=10, workers=2,
+        max_postings_per_term=20)
+
+    # When I index a generator of documents
+    data = ({"id": i, "name": "Doc {}".format(i), "score": i}
+            for i in range(100))
+    backend.index(data, field='name').should.equal(100)
+
+    # Then I see that all of them were indexed, and the terms trimmed
+    len(backend.documents()).should.equal(100)
+    context.conn.zcard('suggestive:d:doc').should.equal(20)
+    backend.query('doc', limit=2)[0].should.equal(
+        {"id": 99, "name": "Doc 99", "score": 99})
+
+
+@scenario(connect)
+def test_redis_backend_rebuilding_versions(context):
+    # Given that I have two processes reading the same versioned index, in
+    # its own namespace
+    backend = suggestive.RedisBackend(
+        conn=context.conn, namespace='people', versioned=True)
+    reader = suggestive.RedisBackend(
+        conn=context.conn, namespace='people', versioned=True,
+        version_ttl=60)
+
+    # When nothing was built yet, Then I see no results
+    reader.query('li').should.equal([])
+
+    # And when I rebuild the index, Then I see its documents
+    backend.rebuild([
+        {"id": 0, "name": "Lincoln", "score": 1},
+        {"id": 1, "name": "Livia", "score": 2},
+    ], field='name').should.equal(2)
+    [d['id'] for d in backend.query('li')].should.equal([1, 0])
+    context.conn.get('people:version').should.equal('1')
+
+    # And when I rebuild it without one of the documents, Then I see that it
+    # is gone, without anything left behind in the active version
+    backend.rebuild([{"id": 0, "name": "Lincoln", "score": 1}], field='name')
+    [d['id'] for d in backend.query('li')].should.equal([0])
+    context.conn.keys('people:v2:d:liv').should.be.empty
+
+    # And I see that the other process keeps reading the version it knows
+    # until it reads the active version again
+    [d['id'] for d in reader.query('li')].should.equal([])
+    reader.refresh()
+    [d['id'] for d in reader.query('li')].should.equal([0])
+
+    # And I see that the previous version is only deleted by the next
+    # rebuild, or by a cleanup
+    context.conn.keys('people:v1:*').should_not.be.empty
+    backend.rebuild([{"id": 2, "name": "Linus", "score": 1}], field='name')
+    context.conn.keys('people:v1:*').should.be.empty
+    context.conn.keys('people:v2:*').should_not.be.empty
+    backend.cleanup().should.be.greater_than(0)
+    sorted(set(k.split(':')[1] for k in context.conn.keys('people:v[0-9]*'))
+           ).should.equal(['v3'])
+
+    # And when another process cleans up while a version is being rebuilt,
+    # Then I see that the new version is kept
+    def rebuilding():
+        yield {"id": 3, "name": "Lisa", "score": 1}
+        backend.cleanup().should.equal(0)
+        yield {"id": 4, "name": "Lionel", "score": 2}
+    builder = suggestive.RedisBackend(
+        conn=context.conn, namespace='people', versioned=True, chunk_size=1)
+    builder.rebuild(rebuilding(), field='name').should.equal(2)
+    [d['id'] for d in builder.query('li')].should.equal([4, 3])
+
+    # And I see that nothing was written out of the namespace
+    context.conn.keys('suggestive:*').should.be.empty
+
+
+@scenario(connect)
+def test_redis_backend_field_postings(context):
+    # Given that I have people indexed by both their names and cities, with
+    # the terms of each field kept on their own
+    data = [
+        {"id": 0, "name": "Lincoln", "city": "Rio", "score": 1},
+        {"id": 1, "name": "Rita", "city": "Lima", "score": 2},
+        {"id": 2, "name": "Livia Rios", "city": "Natal", "score": 3},
+    ]
+    backend = suggestive.RedisBackend(conn=context.conn, field_postings=True)
+    backend.index(data, field=['name', 'city'])
+
+    # When I limit the query to some of the fields, Then I see only the
+    # documents with the term in them, and the words that start with it
+    [d['id'] for d in backend.query(
+        'li', fields=['name'])].should.equal([2, 0])
+    [d['id'] for d in backend.query(
+        'ri', fields=['name', 'city'])].should.equal([2, 1, 0])
+    [d['id'] for d in backend.query(
+        'livia ri', fields=['name'])].should.equal([2])
+    backend.query_many(['li', 'ri'], fields=['city'], words=True).should.equal(
+        [['Lima'], ['Rio']])
+
+    # And when a document is indexed and another one gets a new score after
+    # querying many fields, Then I see both changes in the next query
+    backend.index([{"id": 3, "name": "Rico", "city": "Natal", "score": 4}],
+                  field=['name', 'city'])
+    backend.update_score(0, 5)
+    [d['id'] for d in backend.query(
+        'ri', fields=['name', 'city'])].should.equal([0, 3, 2, 1])
+
+    # And when a document is removed, Then I see that its field terms are
+    # gone too
+    backend.remove(0)
+    [d['id'] for d in backend.query(
+        'li', fields=['name'])].should.equal([2])
+    context.conn.exists('suggestive:d:name:lin').should.be.false
+
+    # And when the documents read from the union of many fields are removed,
+    # Then I see that they don't come back from the stored union
+    [d['id'] for d in backend.query(
+        'li', fields=['name', 'city'])].should.equal([2, 1])
+    backend.remove(1)
+    backend.remove(2)
+    backend.query('li', fields=['name', 'city']).should.equal([])
+    backend.query('li', fields=['name', 'city'], words=True).should.equal([])
+    sharded = suggestive.RedisBackend(
+        conn=context.conn, namespace='sharded', field_postings=True,
+        shards=2)
+    sharded.index(data, field=['name', 'city'])
+    sharded.query('li', fields=['name', 'city']).should.have.length_of(3)
+    sharded.remove(2)
+    [d['id'] for d in sharded.query(
+        'li', fields=['name', 'city'])].should.equal([1, 0])
+
+
+@scenario(connect)
+def test_redis_backend_sharding(context):
+    # Given that I have the same people indexed in a single index and in an
+    # index split in shards
+    data = [{"id": i, "name": name, "score": score} for i, (name, score) in
+            enumerate([("Lincoln Clarete", 5), ("Livia C", 3), ("Linus", 8),
+                       ("Liz Lemon", 1), ("Rita Lee", 4), ("Lia", 2)])]
+    single = suggestive.RedisBackend(conn=context.conn, namespace='single')
+    sharded = suggestive.RedisBackend(
+        conn=context.conn, namespace='sharded', shards=4)
+    single.index(data, field='name')
+    sharded.index(data, field='name').should.equal(6)
+
+    # When I query both, Then I see the same results
+    for kwargs in [{}, {'limit': 2}, {'offset': 2, 'limit': 2},
+                   {'reverse': True}, {'words': True}]:
+        sharded.query('li', **kwargs).should.equal(
+            single.query('li', **kwargs))
+    sharded.query('li c').should.equal(single.query('li c'))
+    sharded.query_many(['l', 'r', 'x']).should.equal(
+        single.query_many(['l', 'r', 'x']))
+    sharded.documents().should.equal(single.documents())
+
+    # And I see that the documents were spread over the shards, each one
+    # with its own hash tag
+    set(suggestive.hash_tag(k) for k in context.conn.keys('sharded:*')
+        ).should.have.length_of(4)
+
+    # And when I change and remove documents, Then I see it in both
+    for backend in single, sharded:
+        backend.update_score(3, 10)
+        backend.remove(2)
+    sharded.query('li').should.equal(single.query('li'))
+    sharded.get_score(3).should.equal(10)
+
+
+@scenario(connect)
+def test_redis_backend_lex_terms(context):
+    # Given that I have the same people indexed by their prefixes and by
+    # their whole words only
+    data = [{"id": i, "name": name, "city": city, "score": score}
+            for i, (name, city, score) in enumerate([
+                ("Lincoln Clarete", "Rio", 5), ("Livia C", "Lima", 3),
+                ("Linus", "Lisbon", 8), ("Rita Lee", "Rio", 4)])]
+    prefixes = suggestive.RedisBackend(
+        conn=context.conn, namespace='prefixes', field_postings=True)
+    words = suggestive.RedisBackend(
+        conn=context.conn, namespace='words', field_postings=True,
+        lex_terms=True)
+    prefixes.index(data, field=['name', 'city'])
+    words.index(data, field=['name', 'city'])
+
+    # When I query both, Then I see the same results
+    for term in ['l', 'li', 'lin', 'lincoln', 'lincolns', 'x', 'li c']:
+        words.query(term).should.equal(prefixes.query(term))
+    words.query('li', limit=1, offset=1).should.equal(
+        prefixes.query('li', limit=1, offset=1))
+    words.query('li', words=True).should.equal(
+        prefixes.query('li', words=True))
+    words.query('ri', fields=['name', 'city']).should.equal(
+        prefixes.query('ri', fields=['name', 'city']))
+
+    # And I see that it took less keys, only a few of them per word
+    len(context.conn.keys('words:*')).should.be.lower_than(
+        len(context.conn.keys('prefixes:*')))
+    context.conn.smembers('words:dt:2').should.equal(
+        {'linus', 'lisbon', 'name:linus', 'city:lisbon'})
+
+    # And when I remove a document, and index another one, between two
+    # queries, Then I see the changes right away in both
+    sharded = suggestive.RedisBackend(
+        conn=context.conn, namespace='sharded', field_postings=True,
+        lex_terms=True, shards=2)
+    sharded.index(data, field=['name', 'city'])
+    for backend in words, sharded:
+        backend.query('li', limit=1)
+        backend.query('li', reverse=True, fields=['name', 'city'])
+    for backend in prefixes, words, sharded:
+        backend.remove(2)
+        backend.index([{"id": 4, "name": "Lia", "city": "Rio", "score": 9}],
+                      field=['name', 'city'])
+    for params in [{}, {'limit': 1}, {'reverse': True, 'limit': 1},
+                   {'limit': 1, 'offset': 1}, {'fields': ['name', 'city']},
+                   {'reverse': True, 'fields': ['name', 'city']},
+                   {'words': True, 'limit': 0}]:
+        expected = prefixes.query('li', **params)
+        words.query('li', **params).should.equal(expected)
+        sharded.query('li', **params).should.equal(expected)
+    [d['id'] for d in words.query('l', limit=1)].should.equal([4, 0])
+
+    # And I see that single words only keep their top documents around, for
+    # a second
+    context.conn.zcard('words:xt:desc:1:l').should.equal(2)
+    context.conn.ttl('words:xt:desc:1:l').should.equal(1)
+
+
+@scenario(connect)
+def test_redis_backend_fuzzy_queries(context):
+    # Given that I have people indexed by a backend that tolerates typos,
+    # split in shards
+    data = [{"id": i, "name": name, "city": city, "score": score}
+            for i, (name, city, score) in enumerate([
+                ("Lincoln Clarete", "Rio", 5), ("Livia C", "Lima", 3),
+                ("Linus", "Lisbon", 8), ("Lincon", "Rome", 1)])]
+    backend = suggestive.RedisBackend(
+        conn=context.conn, max_edits=2, shards=2, field_postings=True)
+    dummy = suggestive.DummyBackend(max_edits=2, field_postings=True)
+    for b in backend, dummy:
+        b.index(data, field=['name', 'city'])
+
+    # When I query with typos, Then I see the documents of the closest
+    # terms first, then the ones with the highest scores
+    [d['id'] for d in backend.query('lincl', fuzzy=True)].should.equal(
+        [0, 3])
+    [d['id'] for d in backend.query('linocln', fuzzy=True)].should.equal(
+        [0, 3])
+    backend.query('linocln', words=True, fuzzy=True).should.equal(
+        ['Lincoln', 'Lincon'])
+    [d['id'] for d in backend.query(
+        'lincl', fuzzy=True, limit=0, offset=1)].should.equal([3])
+
+    # And I see the same documents the dummy backend finds
+    for term in ['lincl', 'linocln', 'lisbn', 'li', 'xyz']:
+        sorted(d['id'] for d in backend.query(term, fuzzy=True)).should.equal(
+            sorted(d['id'] for d in dummy.query(term, fuzzy=True)))
+    backend.query('lisbn', fields=['name'], fuzzy=True).should.equal([])
+
+    # And I see that backends without `max_edits` can't answer them
+    suggestive.RedisBackend(conn=context.conn).query.when.called_with(
+        'lincl', fuzzy=True).should.throw(RuntimeError)
+
+
+@scenario(connect)
+def test_redis_backend_infix_queries(context):
+    # Given that I have people indexed with the n-grams of their names and
+    # cities, split in shards
+    data = [{"id": i, "name": name, "city": city, "score": score}
+            for i, (name, city, score) in enumerate([
+                ("Lincoln Clarete", "Rio", 5), ("Livia C", "Lima", 3),
+                ("Rock-n-roll", "Colnbrook", 1)])]
+    ngrams = {'name': 3, 'city': 2}
+    backend = suggestive.RedisBackend(
+        conn=context.conn, ngrams=ngrams, shards=2)
+    dummy = suggestive.DummyBackend(ngrams=ngrams)
+    for b in backend, dummy:
+        b.index(data, field='name')
+
+    # When I query for pieces of their words, Then I see the documents that
+    # have them anywhere, sorted by score
+    [d['id'] for d in backend.query('coln', infix=True)].should.equal([0, 2])
+    [d['id'] for d in backend.query(
+        'coln', infix=True, fields=['city'])].should.equal([2])
+
+    # And I see the same documents the dummy backend finds
+    for term in ['coln', 'co', 'roll', 'l', 'ol', 'colnx', 'lin cl']:
+        backend.query(term, infix=True, reverse=True).should.equal(
+            dummy.query(term, infix=True))
+
+    # And I see that the n-grams are kept apart from the prefixes
+    backend.query('coln').should.equal([])
+    context.conn.zrange('suggestive:{1}:d:name~col', 0, -1).should.equal(
+        ['0'])
+
+    # And when a document is indexed after an infix query, Then I see that
+    # the stored answer is read until it expires, and that the queries for a
+    # single n-gram see it right away
+    backend.index([{"id": 3, "name": "Nicolny", "city": "Natal", "score": 9}],
+                  field='name')
+    [d['id'] for d in backend.query('coln', infix=True)].should.equal([0, 2])
+    [d['id'] for d in backend.query(
+        'col', infix=True, fields=['name'])].should.equal([3, 0])
+    context.conn.delete(*context.conn.keys('suggestive:*:p:*'))
+    [d['id'] for d in backend.query(
+        'coln', infix=True)].should.equal([3, 0, 2])
+
+
+@scenario(connect)
+def test_redis_backend_max_postings_per_term(context):
+    # Given that I have a redis backend that keeps two documents per term
+    backend = suggestive.RedisBackend(
+        conn=context.conn, chunk_size=2, max_postings_per_term=2)
+
+    # When I index documents that share prefixes, in more than one chunk
+    backend.index([
+        {"id": 0, "name": "Lincoln", "score": 10},
+        {"id": 1, "name": "Livia", "score": 30},
+        {"id": 2, "name": "Linus", "score": 20},
+    ], field='name')
+
+    # Then I see that the terms kept only the documents with top scores
+    context.conn.zrange('suggestive:d:li', 0, -1).should.equal(['2', '1'])
+    context.conn.zrange('suggestive:d:lin', 0, -1).should.equal(['0', '2'])
+
+
+@scenario(connect)
+def test_redis_backend_interning_ids(context):
+    # Given that I have a redis backend that interns document ids
+    backend = suggestive.RedisBackend(conn=context.conn, intern_ids=True)
+    scripted = suggestive.RedisBackend(
+        conn=context.conn, intern_ids=True, scripted_queries=True)
+
+    # When I index documents with long ids
+    data = [
+        {"id": "9b2e6a4c-lincoln", "name": "Lincoln", "score": 1},
+        {"id": "0f1d3c7e-livia", "name": "Livia", "score": 2},
+    ]
+    backend.index(data, field='name')
+
+    # Then I see that the terms only hold small integers
+    context.conn.zrange('suggestive:d:li', 0, -1).should.equal(['1', '2'])
+    context.conn.hgetall('suggestive:ids').should.equal({
+        '9b2e6a4c-lincoln': '1',
+        '0f1d3c7e-livia': '2',
+    })
+
+    # And I see that queries still return the documents with their ids
+    backend.query('li').should.equal(list(reversed(data)))
+    scripted.query('li').should.equal(list(reversed(data)))
+    backend.documents().should.equal({
+        "9b2e6a4c-lincoln": data[0],
+        "0f1d3c7e-livia": data[1],
+    })
+    backend.get_score("0f1d3c7e-livia").should.equal(2.0)
+
+    # And when I index a document again, it keeps its interned id
+    backend.index([{"id": "9b2e6a4c-lincoln", "name": "Liam", "score": 3}],
+                  field='name')
+    context.conn.zrange('suggestive:d:li', 0, -1).should.equal(['2', '1'])
+    context.conn.exists('suggestive:d:lincoln').should.be.false
+
+    # And when I remove a document, its interned id is gone too
+    backend.remove("0f1d3c7e-livia")
+    context.conn.zrange('suggestive:d:li', 0, -1).should.equal(['1'])
+    context.conn.hexists('suggestive:ids', "0f1d3c7e-livia").should.be.false
+    context.conn.hexists('suggestive:d', '2').should.be.false
+    backend.get_score("0f1d3c7e-livia").should.equal(0)
+
+    # And removing documents that were never indexed is harmless
+    backend.remove("nope")
@@ -4,6 +4,32 @@ from mock import Mock, call, patch
 
 import suggestive
 import json
+import os
+import tempfile
+import warnings
+
+
+def mock_redis():
+    """Mock a redis connection with a different mock for each lua script"""
+    conn = Mock()
+    conn.scripts = {
+        suggestive.REMOVE_SCRIPT: Mock(),
+        suggestive.REPLACE_SCRIPT: Mock(),
+        suggestive.QUERY_SCRIPT: Mock(),
+    }
+    conn.register_script.side_effect = conn.scripts.__getitem__
+    return conn
+
+
+def replaced(conn):
+    """List the (doc_id, body, score, terms) sent to the `REPLACE_SCRIPT`"""
+    return [(kw['args'][0], kw['args'][2], kw['args'][4], kw['args'][5:])
+            for _, _, kw in conn.scripts[suggestive.REPLACE_SCRIPT].mock_calls]
+
+
+def postings(backend):
+    """Snapshot the term -> doc ids map of a `DummyBackend` as plain lists"""
+    return {term: list(docs) for term, docs in backend._terms.items()}
 
 
 def test_suggestive():
@@ -50,6 +76,44 @@ def test_expand():
     ])
 
 
+def test_iexpand():
+    # Given that I have a generator of terms
+    terms = suggestive.iexpand("Lincoln Li")
+
+    # Then I see that it yields each prefix once, in order
+    next(terms).should.equal('l')
+    list(terms).should.equal(
+        ['li', 'lin', 'linc', 'linco', 'lincol', 'lincoln'])
+
+    # And I see that words shorter than `min_chars` are kept whole
+    list(suggestive.iexpand("Li Lincoln", min_chars=3)).should.equal(
+        ['li', 'lin', 'linc', 'linco', 'lincol', 'lincoln'])
+
+
+def test_expand_max_prefix_len():
+    suggestive.expand("Lincoln Clarete", max_prefix_len=3).should.equal([
+        'l', 'li', 'lin', 'c', 'cl', 'cla',
+    ])
+    suggestive.expand_fields(
+        {'a': 'Lincoln', 'b': 'Lídia'}, ['a', 'b'], 2).should.equal(
+            ['l', 'li'])
+
+
+def test_normalize():
+    # Given that I have words with accents, in more than one script
+    suggestive.normalize('  Fábio   JÚNIOR ').should.equal('fabio junior')
+
+    # Then I see that transliterated words are lower cased too
+    suggestive.normalize('北京').should.equal('bei jing')
+
+    # And I see that words are transliterated only once
+    with patch('suggestive.unidecode') as unidecode:
+        unidecode.side_effect = lambda word: word
+        suggestive.normalize('Ñandú Ñandú')
+        suggestive.normalize('Ñandú')
+    list(unidecode.call_args_list).should.equal([call('Ñandú')])
+
+
 def test_dummy_backend_indexing():
     # Given that I have an instance of our dummy backend
     data = [{"id": 0, "name": "Lincoln"}, {"id": 1, "name": "Clarete"}]
@@ -68,7 +132,7 @@ def test_dummy_backend_indexing():
     })
 
     # And that the cache contains all indexed fields
-    dict(backend._terms).should.equal({
+    postings(backend).should.equal({
         'c': [1],
         'cl': [1],
         'cla': [1],
@@ -86,6 +150,21 @@ def test_dummy_backend_indexing():
     })
 
 
+def test_dummy_backend_indexing_generators_in_chunks():
+    # Given that I have a dummy backend that indexes 3 documents per chunk
+    backend = suggestive.DummyBackend(chunk_size=3)
+    data = ({"id": i, "name": "Doc {}".format(i)} for i in range(7))
+
+    # When I index a generator, skipping the first document
+    checkpoints = []
+    backend.index(data, field='name', score='id', start=1,
+                  progress=checkpoints.append).should.equal(6)
+
+    # Then I see the progress after each chunk
+    checkpoints.should.equal([4, 7])
+    sorted(backend.documents()).should.equal([1, 2, 3, 4, 5, 6])
+
+
 def test_dummy_backend_cleaning_before_indexing():
     # Given that I have an instance of our dummy backend with some indexed data
     data = [{"id": 0, "name": "Lincoln"}, {"id": 1, "name": "Clarete"}]
@@ -123,7 +202,7 @@ def test_dummy_backend_indexing_multiple_fields():
     backend.index(data, field=['first_name', 'last_name'], score='id')
 
     # And that the cache contains all indexed fields
-    dict(backend._terms).should.equal({
+    postings(backend).should.equal({
         'c': [0],
         'cl': [0],
         'cla': [0],
@@ -170,7 +249,7 @@ def test_dummy_backend_remove_items():
     )
 
     # I also see that the terms for this document were removed
-    dict(backend._terms).should.equal({
+    postings(backend).should.equal({
         'c': [2],
         'l': [2],
         'li': [2],
@@ -188,6 +267,33 @@ def test_dummy_backend_remove_items():
         'gu': [1],
     })
 
+    # And the term cache of the removed document is gone too
+    backend._cache.should_not.contain(0)
+
+
+def test_dummy_backend_caching_terms_of_documents():
+    # Given that I have an instance of our dummy backend with some indexed data
+    data = [{"id": 0, "name": "Lincoln"}, {"id": 1, "name": "Livia"}]
+    backend = suggestive.DummyBackend()
+    backend.index(data, field='name', score='id')
+
+    # Then I see that each document knows to which terms it was added
+    backend._cache.should.equal({
+        0: set(suggestive.expand('lincoln')),
+        1: set(suggestive.expand('livia')),
+    })
+
+    # When I re-index one of the documents with a different value
+    backend.index([{"id": 0, "name": "Lidia"}], field='name', score='id')
+
+    # Then I see that only the terms of the new value are cached
+    backend._cache[0].should.equal(set(suggestive.expand('lidia')))
+
+    # And that the shared terms still point to both documents, sorted by
+    # their score
+    postings(backend)['li'].should.equal([0, 1])
+    postings(backend).should_not.contain('lincoln')
+
 
 def test_dummy_backend_querying():
     # Given that I have an instance of our dummy backend
@@ -272,13 +378,419 @@ def test_dummy_backend_query_sorting():
     ])
 
 
+def test_dummy_backend_incremental_indexing_keeps_score_order():
+    # Given that I have an instance of our dummy backend with some indexed data
+    backend = suggestive.DummyBackend()
+    backend.index([
+        {"id": 0, "name": "Lincoln", "score": 10},
+        {"id": 1, "name": "Livia", "score": 30},
+    ], field='name')
+
+    # When I index, one at a time, documents that should land in the middle
+    # and at the beginning of the postings
+    backend.index([{"id": 2, "name": "Linus", "score": 20}], field='name')
+    backend.index([{"id": 3, "name": "Lidia", "score": 5}], field='name')
+
+    # Then I see that the documents are still sorted by their score
+    postings(backend)['li'].should.equal([3, 0, 2, 1])
+
+    # And I see that limit, offset and reverse are applied to that order
+    backend.query('li', reverse=True, limit=2).should.equal([
+        {"id": 1, "name": "Livia", "score": 30},
+        {"id": 2, "name": "Linus", "score": 20},
+    ])
+    backend.query('li', reverse=True, limit=2, offset=3).should.equal([
+        {"id": 3, "name": "Lidia", "score": 5},
+    ])
+
+    # And when I change the score of a document, it moves to its new place
+    backend.index([{"id": 3, "name": "Lidia", "score": 50}], field='name')
+    postings(backend)['li'].should.equal([0, 2, 1, 3])
+
+
+def test_dummy_backend_max_postings_per_term():
+    # Given that I have a dummy backend that keeps one document per letter of
+    # each term
+    backend = suggestive.DummyBackend(max_postings_per_term=len)
+
+    # When I index documents sharing the same prefixes
+    backend.index([
+        {"id": 0, "name": "Lincoln", "score": 10},
+        {"id": 1, "name": "Livia", "score": 30},
+        {"id": 2, "name": "Linus", "score": 20},
+    ], field='name')
+
+    # Then I see that only the documents with the highest scores were kept
+    postings(backend)['l'].should.equal([1])
+    postings(backend)['li'].should.equal([2, 1])
+    postings(backend)['lin'].should.equal([0, 2])
+
+    # And when I query within the kept documents, no warnings are issued
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        backend.query('li', reverse=True, limit=2).should.equal([
+            {"id": 1, "name": "Livia", "score": 30},
+            {"id": 2, "name": "Linus", "score": 20},
+        ])
+        backend.query('lin', limit=5).should.have.length_of(2)
+    caught.should.be.empty
+
+    # And when I query past them, I get a warning
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        backend.query('li', limit=3).should.have.length_of(2)
+        backend.query('l', words=True).should.equal(['Livia'])
+    caught.should.have.length_of(2)
+    caught[0].category.should.equal(suggestive.TruncatedQueryWarning)
+
+    # And when I remove a document, the ones left out don't come back
+    backend.remove(1)
+    postings(backend).should_not.contain('l')
+    postings(backend)['li'].should.equal([2])
+
+
+def test_dummy_backend_max_postings_per_term_ascending():
+    # Given that I have a dummy backend that keeps 3 documents per term
+    backend = suggestive.DummyBackend(max_postings_per_term=3)
+
+    # And I indexed 5 documents sharing the same prefix
+    backend.index([{"id": i, "name": "Li", "score": i} for i in range(1, 6)],
+                  field='name')
+
+    # When I read the term from its lowest score, the default order
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        found = backend.query('li', limit=1)
+        backend.query('li', words=True, limit=1)
+
+    # Then I get the lowest document kept, along with a warning for each
+    # query, since the ones before it were left out
+    found.should.equal([{"id": 3, "name": "Li", "score": 3}])
+    caught.should.have.length_of(2)
+    caught[0].category.should.equal(suggestive.TruncatedQueryWarning)
+
+
+def test_dummy_backend_max_prefix_len():
+    # Given that I have a dummy backend that keeps prefixes of up to 3 chars
+    backend = suggestive.DummyBackend(max_prefix_len=3)
+
+    # When I index some documents
+    backend.index([
+        {"id": 0, "name": "Lincoln"},
+        {"id": 1, "name": "Linus"},
+    ], field='name', score='id')
+
+    # Then I see that longer prefixes were not stored
+    sorted(postings(backend)).should.equal(['l', 'li', 'lin'])
+
+    # And I see that longer queries read the longest prefix available
+    backend.query('lincoln').should.have.length_of(2)
+    backend.query('lincoln', words=True).should.equal(['Lincoln'])
+
+
+def test_dummy_backend_phrase_queries():
+    # Given that I have some people indexed by their full names
+    data = [
+        {"id": 0, "name": "John Smith", "score": 10},
+        {"id": 1, "name": "John Doe", "score": 30},
+        {"id": 2, "name": "Jane Smithers", "score": 20},
+        {"id": 3, "name": "Smitty John", "score": 5},
+    ]
+    backend = suggestive.DummyBackend()
+    backend.index(data, field='name')
+
+    # When I type a phrase, Then I see that only the documents with all
+    # the words show up, sorted by score
+    backend.query('john smi').should.equal([
+        {"id": 3, "name": "Smitty John", "score": 5},
+        {"id": 0, "name": "John Smith", "score": 10},
+    ])
+    backend.query('John  Smi', reverse=True, limit=1).should.equal([
+        {"id": 0, "name": "John Smith", "score": 10},
+    ])
+    backend.query('john smi', words=True).should.equal(['Smitty', 'Smith'])
+    backend.query('john xavier').should.equal([])
+
+    # And I see that the intersection is kept for the next queries
+    backend._phrases.should.contain(('john', 'smi'))
+
+    # And when I index another document, Then I see it in the next queries
+    backend.index([{"id": 4, "name": "John Smit", "score": 1}], field='name')
+    backend._phrases.should.be.empty
+    [d['id'] for d in backend.query('smi john')].should.equal([4, 3, 0])
+
+
+def test_dummy_backend_field_postings():
+    # Given that I have people indexed by both their names and cities, with
+    # the terms of each field kept on their own
+    data = [
+        {"id": 0, "name": "Lincoln", "city": "Rio", "score": 1},
+        {"id": 1, "name": "Rita", "city": "Lima", "score": 2},
+        {"id": 2, "name": "Livia Rios", "city": "Natal", "score": 3},
+    ]
+    backend = suggestive.DummyBackend(field_postings=True)
+    backend.index(data, field=['name', 'city'])
+
+    # When I limit the query to a field, Then I see only the documents with
+    # the term in that field
+    [d['id'] for d in backend.query('li')].should.equal([0, 1, 2])
+    [d['id'] for d in backend.query('li', fields=['name'])].should.equal(
+        [0, 2])
+    [d['id'] for d in backend.query('ri', fields=['city'])].should.equal([0])
+    backend.query('li', fields=['city'], words=True).should.equal(['Lima'])
+
+    # And I see that querying many fields gets the documents of any of them
+    [d['id'] for d in backend.query(
+        'ri', fields=['name', 'city'])].should.equal([0, 1, 2])
+    [d['id'] for d in backend.query(
+        'livia ri', fields=['name'])].should.equal([2])
+    backend.query('lincoln ri', fields=['name']).should.equal([])
+
+    # And when a document is removed, Then I see that its field terms are
+    # gone too
+    backend.remove(2)
+    [d['id'] for d in backend.query('li', fields=['name'])].should.equal([0])
+    backend._terms.should_not.contain('name:liv')
+
+
+def test_dummy_backend_querying_fields_without_field_postings():
+    # Given that I have a backend that doesn't keep the terms of each field
+    backend = suggestive.DummyBackend()
+    backend.index([{"id": 0, "name": "Lincoln"}], field='name', score='id')
+
+    # When I limit a query to a field, Then I see it fails
+    backend.query.when.called_with('li', fields=['name']).should.throw(
+        RuntimeError)
+
+
+def test_dummy_backend_snapshots():
+    # Given that I have a dummy backend that logs its changes
+    directory = tempfile.mkdtemp()
+    log = os.path.join(directory, 'names.log')
+    backend = suggestive.DummyBackend(max_postings_per_term=2, log=log)
+    data = [{"id": i, "name": name, "score": score}
+            for i, (name, score) in enumerate([
+                ("Lincoln Clarete", 5), ("Livia C", 3), ("Linus", 8),
+                ("Rita Lee", 4)])]
+    backend.index(data, field='name')
+    backend.remove(3)
+
+    # When I save a snapshot and keep changing the backend
+    path = os.path.join(directory, 'names.snapshot')
+    backend.save(path)
+    backend.update_score(1, 10)
+    backend.index([{"id": 4, "name": "Lisa", "score": 1}], field='name')
+
+    # Then I see that the snapshot and its log get all the changes back
+    loaded = suggestive.DummyBackend.load(path, log=log)
+    loaded.max_postings_per_term.should.equal(2)
+    loaded.documents().should.equal(backend.documents())
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        for term in ['l', 'li', 'lin', 'li c', 'ri']:
+            loaded.query(term, words=True).should.equal(
+                backend.query(term, words=True))
+            loaded.query(term, reverse=True).should.equal(
+                backend.query(term, reverse=True))
+    len(caught).should.equal(8)
+    loaded.terms([0, 4]).should.equal(backend.terms([0, 4]))
+
+    # And I see that a change that was only partly written is dropped
+    with open(log, 'ab') as target:
+        target.write(b'\x10\x00\x00\x00["remove"')
+    recovered = suggestive.DummyBackend.load(path, log=log)
+    recovered.documents().should.equal(backend.documents())
+
+    # And that other files can't be loaded
+    suggestive.DummyBackend.load.when.called_with(log).should.throw(
+        ValueError)
+
+
+def test_dummy_backend_fuzzy_queries():
+    # Given that I have people indexed by a backend that tolerates typos
+    data = [{"id": i, "name": name, "score": score}
+            for i, (name, score) in enumerate([
+                ("Lincoln Clarete", 5), ("Livia C", 3), ("Linus", 8),
+                ("Lincon", 1)])]
+    backend = suggestive.DummyBackend(max_edits=2)
+    s = suggestive.Suggestive(backend=backend)
+    s.index(data, field='name')
+
+    # When I query with typos, Then I see the documents of the closest
+    # terms first, each group sorted by score
+    [d['id'] for d in s.suggest('linocln', fuzzy=True)].should.equal([0, 3])
+    [d['id'] for d in s.suggest('lincl', fuzzy=True)].should.equal([3, 0])
+    s.suggest('lincl', fuzzy=True, words=True).should.equal(
+        ['Lincon', 'Lincoln'])
+    [d['id'] for d in s.suggest('li', fuzzy=True)].should.equal(
+        [d['id'] for d in s.suggest('li')])
+    s.suggest('lincl').should.equal([])
+
+    # And when the documents of a term are gone, Then I see that it's not
+    # a candidate anymore
+    s.remove(0)
+    [d['id'] for d in s.suggest('linocln', fuzzy=True)].should.equal([3])
+    backend._fuzzy.terms.shouldnt.contain('lincoln')
+
+    # And I see that snapshots keep the terms too
+    path = os.path.join(tempfile.mkdtemp(), 'names.snapshot')
+    backend.save(path)
+    loaded = suggestive.DummyBackend.load(path)
+    loaded.query('linocln', fuzzy=True).should.equal(
+        backend.query('linocln', fuzzy=True))
+
+    # And that backends without `max_edits` can't answer them
+    suggestive.DummyBackend().query.when.called_with(
+        'lincl', fuzzy=True).should.throw(RuntimeError)
+
+
+def test_dummy_backend_infix_queries():
+    # Given that I have people indexed with the n-grams of their names and
+    # cities
+    data = [{"id": i, "name": name, "city": city, "score": score}
+            for i, (name, city, score) in enumerate([
+                ("Lincoln Clarete", "Rio", 5), ("Livia C", "Lima", 3),
+                ("Rock-n-roll", "Colnbrook", 1)])]
+    backend = suggestive.DummyBackend(ngrams={'name': 3, 'city': 2})
+    s = suggestive.Suggestive(backend=backend)
+    s.index(data, field='name')
+
+    # When I query for pieces of their words, Then I see the documents that
+    # have them anywhere, in any of the fields
+    [d['id'] for d in s.suggest('coln', infix=True)].should.equal([2, 0])
+    [d['id'] for d in s.suggest('coln', infix=True, fields=['name'])].should \
+        .equal([0])
+    [d['id'] for d in s.suggest('ROLL', infix=True)].should.equal([2])
+    [d['id'] for d in s.suggest('im', infix=True)].should.equal([1])
+    s.suggest('coln').should.equal([])
+
+    # And I see that they can't find words, nor read fields without n-grams
+    backend.query.when.called_with('co', infix=True, words=True).should.throw(
+        RuntimeError)
+    suggestive.DummyBackend().query.when.called_with(
+        'co', infix=True).should.throw(RuntimeError)
+
+
+def test_index_cost():
+    # Given that I have a few documents
+    data = [{"id": 0, "name": "Lincoln"}, {"id": 1, "name": "Linus"}]
+
+    # When I count what indexing their n-grams costs
+    cost = suggestive.index_cost(data, 'name', {'name': 2})
+
+    # Then I see the terms and postings of the prefixes and of the n-grams
+    cost.should.equal({
+        'prefixes': {'terms': 9, 'postings': 12},
+        'ngrams': {'name': {'terms': 15, 'postings': 20}},
+    })
+
+
+def test_compiled_backend():
+    # Given that I have some people indexed in a dummy backend
+    data = [{"id": i, "name": name, "city": city, "score": score}
+            for i, (name, city, score) in enumerate([
+                ("Lincoln Clarete", "Rio", 5), ("Livia C", "Lima", 3),
+                ("Linus", "Lisbon", 8), ("Rita Lee", "Rio", 4),
+                ("Líz", "Rome", 3)])]
+    dummy = suggestive.DummyBackend(field_postings=True)
+    dummy.index(data, field=['name', 'city'])
+
+    # When I compile it, Then I see that it answers the same queries with
+    # the same results
+    backend = suggestive.CompiledBackend.from_backend(
+        dummy, field=['name', 'city'], field_postings=True)
+    len(backend).should.equal(5)
+    for term in ['l', 'li', 'liz', 'ri', 'x', 'li c', 'c li', 'rio l']:
+        for kwargs in [{}, {'reverse': True}, {'limit': 2, 'offset': 1},
+                       {'words': True}, {'words': True, 'limit': 1},
+                       {'fields': ['city']}, {'fields': ['name', 'city']}]:
+            backend.query(term, **kwargs).should.equal(
+                dummy.query(term, **kwargs))
+    backend.documents().should.equal(dummy.documents())
+
+    # And when I save it and load it back, Then I see the same results
+    path = os.path.join(tempfile.mkdtemp(), 'names.idx')
+    backend.save(path)
+    loaded = suggestive.CompiledBackend.load(path)
+    loaded.query_many(['li', 'ri']).should.equal(
+        dummy.query_many(['li', 'ri']))
+    loaded.field_postings.should.be.true
+
+    # And I see that other files can't be loaded
+    suggestive.CompiledBackend.when.called_with(
+        b'not an index').should.throw(ValueError)
+
+
+def test_phrase_terms():
+    suggestive.phrase_terms('john smi').should.equal(['john', 'smi'])
+    suggestive.phrase_terms('smith john smith', 2).should.equal(['jo', 'sm'])
+    suggestive.phrase_terms('john').should.equal([])
+    suggestive.phrase_terms('').should.equal([])
+
+
+def test_dummy_backend_updating_scores():
+    # Given that I have some documents indexed
+    data = [
+        {"id": 0, "name": "Lincoln", "score": 10},
+        {"id": 1, "name": "Livia", "score": 20},
+        {"id": 2, "name": "Linus", "score": 30},
+    ]
+    s = suggestive.Suggestive(backend=suggestive.DummyBackend())
+    s.index(data, field='name')
+
+    # When I update the score of one of them
+    s.update_score(2, 5).should.equal(5)
+
+    # Then I see that it moved to its new position in all its terms
+    [d['id'] for d in s.suggest('li')].should.equal([2, 0, 1])
+    s.suggest('lin').should.equal([
+        {"id": 2, "name": "Linus", "score": 5},
+        {"id": 0, "name": "Lincoln", "score": 10},
+    ])
+
+    # And I see that the scores can be incremented too
+    s.incr_score(2, 10).should.equal(15)
+    [d['id'] for d in s.suggest('li')].should.equal([0, 2, 1])
+
+    # And I see that the documents I indexed were not changed
+    data[2]['score'].should.equal(30)
+
+    # And I see that documents not indexed can't get a score
+    s.update_score.when.called_with(9, 1).should.throw(KeyError)
+
+
+def test_postings():
+    # Given that I have some postings
+    postings = suggestive.Postings()
+
+    # When I add ids out of order, including a tie
+    postings.add((3, 0), 'c')
+    postings.add((1, 1), 'a')
+    postings.add((2, 2), 'b')
+    postings.add((1, 3), 'a2')
+
+    # Then I see they're sorted by their keys, ties in the order they came
+    list(postings).should.equal(['a', 'a2', 'b', 'c'])
+
+    # And I see that I can read slices from both ends
+    list(postings.iterate(start=1, stop=3)).should.equal(['a2', 'b'])
+    list(postings.iterate(reverse=True, stop=2)).should.equal(['c', 'b'])
+    list(postings.iterate(start=3, stop=10)).should.equal(['c'])
+
+    # And when I remove keys, even unknown ones, the order is kept
+    postings.remove((2, 2))
+    postings.remove((9, 9))
+    list(postings).should.equal(['a', 'a2', 'c'])
+    len(postings).should.equal(3)
+
+
 def test_redis_backend_indexing():
     # Given that I have an instance of our redis backend
-    conn = Mock()
+    conn = mock_redis()
     pipe = conn.pipeline.return_value
+    replace = conn.scripts[suggestive.REPLACE_SCRIPT]
     data = [{"id": 0, "name": "Lincoln"}, {"id": 1, "name": "Clarete"}]
     backend = suggestive.RedisBackend(conn=conn)
-    backend.remove = Mock()     # We don't care about removing stuff here
 
     # When I try to index stuff
     indexed = backend.index(data, field='name', score='id')
@@ -286,37 +798,24 @@ def test_redis_backend_indexing():
     # Then I see that the number of indexed items is right
     indexed.should.equal(2)
 
-    # And I see that the document set was fed
-    list(conn.hset.call_args_list).should.equal([
-        call('suggestive:d', 0, '{"id": 0, "name": "Lincoln"}'),
-        call('suggestive:d', 1, '{"id": 1, "name": "Clarete"}')
-    ])
-
-    # And I see that we have a special stash to save to which terms each
-    # document was added (it will make deletions way easier)
-    list(pipe.sadd.call_args_list).should.equal([
-        call('suggestive:dt:0', *suggestive.expand('lincoln')),
-        call('suggestive:dt:1', *suggestive.expand('clarete')),
-    ])
-
-    # And the term set was also fed
-    list(pipe.zadd.call_args_list).should.equal([
-        call('suggestive:d:l', 0, 0),
-        call('suggestive:d:li', 0, 0),
-        call('suggestive:d:lin', 0, 0),
-        call('suggestive:d:linc', 0, 0),
-        call('suggestive:d:linco', 0, 0),
-        call('suggestive:d:lincol', 0, 0),
-        call('suggestive:d:lincoln', 0, 0),
-        call('suggestive:d:c', 1, 1),
-        call('suggestive:d:cl', 1, 1),
-        call('suggestive:d:cla', 1, 1),
-        call('suggestive:d:clar', 1, 1),
-        call('suggestive:d:clare', 1, 1),
-        call('suggestive:d:claret', 1, 1),
-        call('suggestive:d:clarete', 1, 1)
+    # And I see that each document was replaced in the pipeline with its
+    # keys, body, words, score and terms
+    list(replace.call_args_list).should.equal([
+        call(keys=['suggestive:d', 'suggestive:dt:0', 'suggestive:w'],
+             args=[0, 'suggestive:d:', '{"id": 0, "name": "Lincoln"}',
+                   '[["lincoln", "Lincoln"]]', 0] +
+             suggestive.expand('lincoln'),
+             client=pipe),
+        call(keys=['suggestive:d', 'suggestive:dt:1', 'suggestive:w'],
+             args=[1, 'suggestive:d:', '{"id": 1, "name": "Clarete"}',
+                   '[["clarete", "Clarete"]]', 1] +
+             suggestive.expand('clarete'),
+             client=pipe),
     ])
 
+    # And I see that the script was registered only once
+    conn.register_script.assert_called_once_with(suggestive.REPLACE_SCRIPT)
+
     # And that all the documents are indexed
     conn.hgetall.return_value = {
         '0': '{"id": 0, "name": "Lincoln"}',
@@ -328,122 +827,360 @@ def test_redis_backend_indexing():
     })
     conn.hgetall.assert_called_once_with('suggestive:d')
 
-    # And I also see that the pipeline was executed!
+    # And I also see that the whole chunk took a single round trip
     pipe.execute.assert_called_once_with()
 
 
 def test_redis_backend_remove_items():
-    # Given that I have some indexed data
-    conn = Mock()
-    pipe = conn.pipeline.return_value
-    data = [
-        {"id": 0, "first_name": "Lincoln", "last_name": "Clarete"},
-        {"id": 1, "first_name": "Mingwei", "last_name": "Gu"},
-        {"id": 2, "first_name": "Livia", "last_name": "C"},
-    ]
+    # Given that I have an instance of our redis backend
+    conn = mock_redis()
     backend = suggestive.RedisBackend(conn=conn)
 
-    with patch.object(backend, 'remove'):
-        backend.index(data, field=['first_name', 'last_name'], score='id')
-
-    # Mocking the term X doc cache set
-    conn.smembers.return_value = (
-        suggestive.expand('lincoln') + suggestive.expand('clarete'))
-
     # When I try to remove stuff
     backend.remove(0)
 
-    # Then I see that the terms for this document were removed
-    list(pipe.zrem.call_args_list).should.equal([
-        call('suggestive:d:l', 0),
-        call('suggestive:d:li', 0),
-        call('suggestive:d:lin', 0),
-        call('suggestive:d:linc', 0),
-        call('suggestive:d:linco', 0),
-        call('suggestive:d:lincol', 0),
-        call('suggestive:d:lincoln', 0),
-        call('suggestive:d:c', 0),
-        call('suggestive:d:cl', 0),
-        call('suggestive:d:cla', 0),
-        call('suggestive:d:clar', 0),
-        call('suggestive:d:clare', 0),
-        call('suggestive:d:claret', 0),
-        call('suggestive:d:clarete', 0),
-    ])
+    # Then I see that the document and its terms were removed by a single
+    # script call
+    conn.scripts[suggestive.REMOVE_SCRIPT].assert_called_once_with(
+        keys=['suggestive:d', 'suggestive:dt:0', 'suggestive:w'],
+        args=[0, 'suggestive:d:'],
+        client=conn)
 
-    pipe.execute.call_count.should.equal(2)
+    # And I see that nothing else was sent to redis
+    conn.smembers.called.should.be.false
+    conn.pipeline.called.should.be.false
 
-    # And the cache key should also be removed
-    conn.delete.assert_called_once_with('suggestive:dt:0')
 
-    # And I also see that we successfuly removed the document too
-    conn.hdel.assert_called_once_with('suggestive:d', 0)
+def test_redis_backend_interning_ids():
+    # Given that I have a redis backend that interns document ids
+    conn = mock_redis()
+    pipe = conn.pipeline.return_value
+    backend = suggestive.RedisBackend(conn=conn, intern_ids=True)
+
+    # When I index and remove a document
+    backend.index([{"id": "a-b-c", "name": "Li"}], field='name', score='id')
+    backend.remove("a-b-c")
+
+    # Then I see that the scripts received the ids hash and its counter
+    conn.scripts[suggestive.REPLACE_SCRIPT].assert_called_once_with(
+        keys=['suggestive:d', 'suggestive:dt:a-b-c', 'suggestive:w',
+              'suggestive:ids', 'suggestive:ids:next'],
+        args=['a-b-c', 'suggestive:d:', '{"id": "a-b-c", "name": "Li"}',
+              '[["a-b-c", "a-b-c"], ["li", "Li"]]', 'a-b-c', 'l', 'li'],
+        client=pipe)
+    conn.scripts[suggestive.REMOVE_SCRIPT].assert_called_once_with(
+        keys=['suggestive:d', 'suggestive:dt:a-b-c', 'suggestive:w',
+              'suggestive:ids'],
+        args=['a-b-c', 'suggestive:d:'],
+        client=conn)
+
+    # And I see that the score is read with the interned id
+    conn.hget.return_value = '7'
+    conn.hmget.return_value = ['{"id": "a-b-c", "score": 3}']
+    backend.get_score("a-b-c").should.equal(3.0)
+    conn.hget.assert_called_once_with('suggestive:ids', 'a-b-c')
+    conn.hmget.assert_called_once_with('suggestive:d', '7')
+
+
+def test_redis_backend_indexing_in_chunks():
+    # Given that I have an instance of our redis backend that writes two
+    # documents per chunk
+    conn = mock_redis()
+    pipe = conn.pipeline.return_value
+    backend = suggestive.RedisBackend(conn=conn, chunk_size=2)
 
+    # When I index a generator with five documents, one of them repeated
+    # inside of the same chunk
+    data = ({"id": i, "name": "Doc {}".format(i)} for i in [0, 1, 2, 2, 3])
+    indexed = backend.index(data, field='name', score='id')
 
-def test_redis_backend_cleaning_before_indexing():
-    # Given that I have an instance of our redis backend with some indexed data
-    conn = Mock()
-    data = [{"id": 0, "name": "Lincoln"}, {"id": 1, "name": "Clarete"}]
+    # Then I see that all of them were counted
+    indexed.should.equal(5)
+
+    # And that each of the three chunks took one round trip
+    pipe.execute.call_count.should.equal(3)
+
+    # And that the repeated document was written only once
+    [doc_id for doc_id, _, _, _ in replaced(conn)].should.equal([0, 1, 2, 3])
+
+
+def test_redis_backend_resuming_indexing():
+    # Given that I have a redis backend writing two documents per chunk and
+    # a connection that fails on the second chunk
+    conn = mock_redis()
+    pipe = conn.pipeline.return_value
+    pipe.execute.side_effect = [[], IOError('Connection reset'), [], []]
+    backend = suggestive.RedisBackend(conn=conn, chunk_size=2)
+    data = [{"id": i, "name": "Doc {}".format(i)} for i in range(5)]
+
+    # When I index a generator, recording the progress
+    checkpoints = []
+    backend.index.when.called_with(
+        iter(data), field='name', score='id',
+        progress=checkpoints.append).should.throw(IOError)
+
+    # Then I see that only the chunks that made it were reported
+    checkpoints.should.equal([2])
+
+    # And when I resume from the last checkpoint
+    backend.index(
+        iter(data), field='name', score='id',
+        progress=checkpoints.append, start=checkpoints[-1]).should.equal(3)
+
+    # Then I see that indexing picked up where it stopped
+    checkpoints.should.equal([2, 4, 5])
+    [doc_id for doc_id, _, _, _ in replaced(conn)].should.equal(
+        [0, 1, 2, 3, 2, 3, 4])
+
+
+def test_redis_backend_parallel_indexing():
+    # Given that I have a serial and a parallel redis backend
+    serial_conn, parallel_conn = mock_redis(), mock_redis()
+    serial = suggestive.RedisBackend(conn=serial_conn, chunk_size=2)
+    parallel = suggestive.RedisBackend(
+        conn=parallel_conn, chunk_size=2, workers=2,
+        codec=suggestive.CompressedCodec())
+    data = [{"id": i, "name": "Dóc {}".format(i)} for i in range(7)]
+
+    # When I index the same documents with both of them
+    serial.index(iter(data), field='name', score='id')
+    checkpoints = []
+    parallel.index(iter(data), field='name', score='id', start=1,
+                   progress=checkpoints.append).should.equal(6)
+
+    # Then I see that the same documents were written, in the same order
+    [(doc_id, parallel.codec.loads(body), score, terms)
+     for doc_id, body, score, terms in replaced(parallel_conn)].should.equal(
+        [(doc_id, json.loads(body), score, terms)
+         for doc_id, body, score, terms in replaced(serial_conn)][1:])
+
+    # And I see that each chunk was written in its own round trip
+    checkpoints.should.equal([3, 5, 7])
+    parallel_conn.pipeline.return_value.execute.call_count.should.equal(3)
+
+
+def test_redis_backend_max_postings_per_term():
+    # Given that I have a redis backend that keeps one document per letter of
+    # each term
+    conn = mock_redis()
+    pipe = conn.pipeline.return_value
+    backend = suggestive.RedisBackend(conn=conn, max_postings_per_term=len)
+
+    # When I index documents
+    data = [{"id": 0, "name": "Li"}, {"id": 1, "name": "Lu"}]
+    backend.index(data, field='name', score='id')
+
+    # Then I see that each term touched was trimmed once, in the pipeline
+    sorted(pipe.zremrangebyrank.call_args_list).should.equal([
+        call('suggestive:d:l', 0, -2),
+        call('suggestive:d:li', 0, -3),
+        call('suggestive:d:lu', 0, -3),
+    ])
+    pipe.execute.assert_called_once_with()
+
+    # And when a query reaches the end of a full term, I get a warning
+    conn.zrevrange.return_value = ['1']
+    conn.hmget.return_value = ['{"id": 1, "name": "Lu"}']
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        backend.query('lu', limit=5)
+        backend.query('l', limit=5)
+    caught.should.have.length_of(1)
+    caught[0].category.should.equal(suggestive.TruncatedQueryWarning)
+
+    # And when a query starts from the lowest scores of a term that might be
+    # full, I get a warning too, unless it reads all of a term that isn't
+    conn.zrange.return_value = ['1']
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        backend.query('lu', reverse=True, limit=5)
+        backend.query('l', reverse=True, limit=5)
+        conn.zrange.return_value = ['1', '0']
+        conn.hmget.return_value = ['{"id": 1}', '{"id": 0}']
+        backend.query('lu', reverse=True, limit=1)
+    caught.should.have.length_of(2)
+
+
+def test_redis_backend_max_prefix_len():
+    # Given that I have a redis backend that keeps prefixes of up to 2 chars
+    conn = mock_redis()
+    backend = suggestive.RedisBackend(conn=conn, max_prefix_len=2)
+
+    # When I index a document
+    backend.index([{"id": 0, "name": "Lincoln"}], field='name', score='id')
+
+    # Then I see that only the short terms were sent
+    [terms for _, _, _, terms in replaced(conn)].should.equal([['l', 'li']])
+
+    # And I see that longer queries read the longest prefix available
+    conn.zrevrange.return_value = []
+    backend.query('lincoln')
+    conn.zrevrange.assert_called_once_with('suggestive:d:li', 0, -1)
+
+
+def test_redis_backend_phrase_queries():
+    # Given that I have a redis backend
+    conn = mock_redis()
+    pipe = conn.pipeline.return_value
+    phrase = conn.scripts[suggestive.PHRASE_SCRIPT] = Mock()
+    backend = suggestive.RedisBackend(conn=conn, phrase_ttl=30)
+
+    # When I query for a phrase
+    pipe.execute.return_value = [1, ['0']]
+    conn.hmget.return_value = ['{"id": 0, "name": "John Smith"}']
+    backend.query('Smi John', limit=5).should.equal([
+        {"id": 0, "name": "John Smith"},
+    ])
+
+    # Then I see that the intersection of its terms was stored in a
+    # temporary key and read in the same round trip
+    phrase.assert_called_once_with(
+        keys=['suggestive:p:john smi', 'suggestive:d:john',
+              'suggestive:d:smi'],
+        args=[30],
+        client=pipe)
+    pipe.zrevrange.assert_called_once_with('suggestive:p:john smi', 0, 5)
+    pipe.execute.assert_called_once_with()
+    conn.zrevrange.called.should.be.false
+
+    # And when the queries are scripted, Then I see that the words are
+    # found in the intersection too, with the last word of the phrase
+    backend.scripted_queries = True
+    pipe.execute.return_value = [1, [b'Smith']]
+    backend.query('john smi', words=True).should.equal(['Smith'])
+    query = conn.scripts[suggestive.QUERY_SCRIPT]
+    query.assert_called_once_with(
+        keys=['suggestive:p:john smi', 'suggestive:d', 'suggestive:w'],
+        args=[0, -1, '0', 'smi', '1'],
+        client=pipe)
+
+
+def test_redis_backend_field_postings():
+    # Given that I have a redis backend that keeps the terms of each field
+    conn = mock_redis()
+    pipe = conn.pipeline.return_value
+    top = conn.scripts[suggestive.TOP_SCRIPT] = Mock()
+    backend = suggestive.RedisBackend(
+        conn=conn, field_postings=True, phrase_ttl=30)
+
+    # When I index a document, Then I see that it's added to the terms of
+    # each field too
+    backend.index([{"id": 0, "name": "Li", "city": "Rio", "score": 1}],
+                  field=['name', 'city'])
+    replaced(conn)[0][3].should.equal([
+        'l', 'li', 'r', 'ri', 'rio',
+        'name:l', 'name:li', 'city:r', 'city:ri', 'city:rio'])
+
+    # And when I query a single field, Then I see that its term is read
+    conn.zrevrange.return_value = []
+    backend.query('li', fields=['name']).should.equal([])
+    conn.zrevrange.assert_called_once_with('suggestive:d:name:li', 0, -1)
+
+    # And when I query many fields, Then I see that the top documents of
+    # their terms are merged in a temporary key and read in the same round
+    # trip
+    pipe.execute.return_value = [0, []]
+    backend.query('ri', fields=['name', 'city'], limit=2).should.equal([])
+    top.assert_called_once_with(
+        keys=['suggestive:xt:desc:2:city,name:ri', 'suggestive:d:name:ri',
+              'suggestive:d:city:ri'],
+        args=[2, '0'],
+        client=pipe)
+    pipe.zrevrange.assert_called_once_with(
+        'suggestive:xt:desc:2:city,name:ri', 0, 2)
+
+
+def test_redis_backend_query_many():
+    # Given that I have a redis backend
+    conn = mock_redis()
+    pipe = conn.pipeline.return_value
     backend = suggestive.RedisBackend(conn=conn)
-    backend.remove = Mock()
-    backend.index(data, field='name', score='name')
 
-    # When I try to index the same documents but with different values
-    data = [{'id': 0, 'name': 'Mingwei'}]
-    backend.index(data, field='name', score='name')
+    # When I query many terms at once
+    pipe.execute.return_value = [['1', '0'], [], ['0']]
+    conn.hmget.return_value = [
+        '{"id": 1, "name": "Livia"}',
+        '{"id": 0, "name": "Lincoln"}',
+    ]
+    backend.query_many(['Li', 'x', 'lin'], limit=2).should.equal([
+        [{"id": 1, "name": "Livia"}, {"id": 0, "name": "Lincoln"}],
+        [],
+        [{"id": 0, "name": "Lincoln"}],
+    ])
+
+    # Then I see that all the ranges were read in a single round trip
+    list(pipe.zrevrange.call_args_list).should.equal([
+        call('suggestive:d:li', 0, 2),
+        call('suggestive:d:x', 0, 2),
+        call('suggestive:d:lin', 0, 2),
+    ])
+    pipe.execute.assert_called_once_with()
+
+    # And I see that each document was read only once
+    conn.hmget.assert_called_once_with('suggestive:d', ['1', '0'])
+    conn.zrevrange.called.should.be.false
+
+
+def test_redis_backend_updating_scores():
+    # Given that I have a redis backend that keeps two documents per term
+    conn = mock_redis()
+    score = conn.scripts[suggestive.SCORE_SCRIPT] = Mock()
+    pipe = conn.pipeline.return_value
+    backend = suggestive.RedisBackend(conn=conn, max_postings_per_term=2)
 
-    # Then I see that the remove method was called for every single document
-    # that before indexing it
-    list(backend.remove.call_args_list).should.equal([
-        call(0),
-        call(1),
-        call(0),
+    # When I increment the score of a document that gets changed by someone
+    # else after it's read
+    conn.hget.side_effect = [
+        '{"id": 0, "name": "Li", "score": 1}',
+        '{"id": 0, "name": "Li", "score": 2}',
+    ]
+    score.side_effect = [None, ['l', 'li']]
+    backend.incr_score(0, 5).should.equal(7)
+
+    # Then I see that it was read again, and only replaced when it was still
+    # the same
+    list(score.call_args_list).should.equal([
+        call(keys=['suggestive:d', 'suggestive:dt:0', 'suggestive:w'],
+             args=[0, 'suggestive:d:', '{"id": 0, "name": "Li", "score": 1}',
+                   '{"id": 0, "name": "Li", "score": 6}', 6],
+             client=conn),
+        call(keys=['suggestive:d', 'suggestive:dt:0', 'suggestive:w'],
+             args=[0, 'suggestive:d:', '{"id": 0, "name": "Li", "score": 2}',
+                   '{"id": 0, "name": "Li", "score": 7}', 7],
+             client=conn),
+    ])
+
+    # And I see that its terms were trimmed again
+    sorted(pipe.zremrangebyrank.call_args_list).should.equal([
+        call('suggestive:d:l', 0, -3),
+        call('suggestive:d:li', 0, -3),
     ])
 
+    # And when the document isn't indexed, Then I see an error
+    conn.hget.side_effect = [None]
+    backend.update_score.when.called_with(1, 2).should.throw(KeyError)
+
 
 def test_redis_backend_indexing_multiple_fields():
     # Given that I have an instance of our redis backend
-    conn = Mock()
-    pipe = conn.pipeline.return_value
+    conn = mock_redis()
     data = [
         {"id": 0, "first_name": "Lincoln", "last_name": "Clarete"},
         {"id": 1, "first_name": "Mingwei", "last_name": "Gu"},
+        {"id": 2, "first_name": "Livia", "last_name": "Li"},
     ]
     backend = suggestive.RedisBackend(conn=conn)
 
     # When I try to index stuff
-    with patch.object(backend, 'remove'):
-        backend.index(data, field=['first_name', 'last_name'], score='id')
-
-    # And the term set was also fed
-    list(pipe.zadd.call_args_list).should.equal([
-        call('suggestive:d:l', 0, 0),
-        call('suggestive:d:li', 0, 0),
-        call('suggestive:d:lin', 0, 0),
-        call('suggestive:d:linc', 0, 0),
-        call('suggestive:d:linco', 0, 0),
-        call('suggestive:d:lincol', 0, 0),
-        call('suggestive:d:lincoln', 0, 0),
-        call('suggestive:d:c', 0, 0),
-        call('suggestive:d:cl', 0, 0),
-        call('suggestive:d:cla', 0, 0),
-        call('suggestive:d:clar', 0, 0),
-        call('suggestive:d:clare', 0, 0),
-        call('suggestive:d:claret', 0, 0),
-        call('suggestive:d:clarete', 0, 0),
-        call('suggestive:d:m', 1, 1),
-        call('suggestive:d:mi', 1, 1),
-        call('suggestive:d:min', 1, 1),
-        call('suggestive:d:ming', 1, 1),
-        call('suggestive:d:mingw', 1, 1),
-        call('suggestive:d:mingwe', 1, 1),
-        call('suggestive:d:mingwei', 1, 1),
-        call('suggestive:d:g', 1, 1),
-        call('suggestive:d:gu', 1, 1),
-    ])
-
-    # And I also see that the pipeline was executed!
-    pipe.execute.assert_called_once_with()
+    backend.index(data, field=['first_name', 'last_name'], score='id')
+
+    # Then I see that the terms of all the fields were sent, without the
+    # ones that show up in more than one field
+    [terms for _, _, _, terms in replaced(conn)].should.equal([
+        suggestive.expand('lincoln') + suggestive.expand('clarete'),
+        suggestive.expand('mingwei') + suggestive.expand('gu'),
+        suggestive.expand('livia'),
+    ])
 
 
 def test_redis_backend_querying():
@@ -456,8 +1193,7 @@ def test_redis_backend_querying():
 
     # Given that I have an instance of our Redis backend
     backend = suggestive.RedisBackend(conn=conn)
-    with patch.object(backend, 'remove'):
-        backend.index(data, field='name')  # We'll choose `score` by default
+    backend.index(data, field='name')  # We'll choose `score` by default
     conn.zrevrange.return_value = ['1', '5', '0']
     conn.zrange.return_value = ['0', '5', '1']
 
@@ -519,10 +1255,9 @@ def test_redis_backend_query_limit():
         {"id": 3, "name": "Lidia"},
     ]
     conn = Mock()
-    conn.hmget.return_value = []
+    conn.zrevrange.return_value = []
     backend = suggestive.RedisBackend(conn=conn)
-    with patch.object(backend, 'remove'):
-        backend.index(data, field='name', score='id')
+    backend.index(data, field='name', score='id')
 
     # Then I see that limit and offset are working properly with different
     # parameters
@@ -549,6 +1284,42 @@ def test_redis_backend_query_limit():
     conn.reset_mock()
 
 
+def test_redis_backend_scripted_queries():
+    # Given that I have a redis backend that queries using a lua script
+    conn = mock_redis()
+    query = conn.scripts[suggestive.QUERY_SCRIPT]
+    backend = suggestive.RedisBackend(conn=conn, scripted_queries=True)
+
+    # When I query for documents
+    query.return_value = [b'{"id": 5, "name": "Linus"}']
+    backend.query('Li', limit=2, offset=1).should.equal([
+        {"id": 5, "name": "Linus"},
+    ])
+
+    # Then I see that the script got the range and no words term
+    query.assert_called_once_with(
+        keys=['suggestive:d:li', 'suggestive:d', 'suggestive:w'],
+        args=[1, 3, '0', '', '1'],
+        client=conn)
+
+    # And when I query for words, sorting by ascending score
+    query.reset_mock()
+    query.return_value = [b'Linus', 'Líncoln'.encode('utf-8')]
+    backend.query('Li', words=True, reverse=True).should.equal([
+        'Linus', 'Líncoln',
+    ])
+
+    # Then I see that the script received the term to find the words
+    query.assert_called_once_with(
+        keys=['suggestive:d:li', 'suggestive:d', 'suggestive:w'],
+        args=[0, -1, '1', 'li', '1'],
+        client=conn)
+
+    # And that nothing else was sent to redis
+    conn.zrevrange.called.should.be.false
+    conn.hmget.called.should.be.false
+
+
 def test_both_backends_query_return_term_prefixed_words():
     # Given that I have an instance of our dummy backend with some data indexed
     data = [
@@ -559,14 +1330,17 @@ def test_both_backends_query_return_term_prefixed_words():
         {"id": 4, 'field1': 'I love', 'field2': 'Paníni'},
     ]
     conn = Mock()
-    conn.zrevrange.return_value = range(4)
-    conn.hmget.return_value = [json.dumps(item) for item in data]
-
+    conn.zrevrange.return_value = list(range(4))
     dummy_backend = suggestive.DummyBackend()
     dummy_backend.index(data, field=['field1', 'field2'], score='id')
     redis_backend = suggestive.RedisBackend(conn=conn)
-    with patch.object(redis_backend, 'remove'):
-        redis_backend.index(data, field=['field1', 'field2'], score='id')
+    redis_backend.index(data, field=['field1', 'field2'], score='id')
+
+    # And the words of the documents stored in redis
+    words = [redis_backend.encode_words(suggestive.tokenize(item))
+             for item in data]
+    conn.hmget.side_effect = lambda key, ids: (
+        words if key == 'suggestive:w' else [None] * len(ids))
 
     # When I query for the `Pa` prefix, asking for the words found in the
     # documents
@@ -581,27 +1355,355 @@ def test_both_backends_query_return_term_prefixed_words():
             'Pascal', 'Paníni', 'Pacific', 'Passion-Fruit'
         ])
 
+    # And I see that documents indexed before their words were stored have
+    # their words found in the documents themselves
+    bodies = [json.dumps(item) for item in data]
+    conn.hmget.side_effect = lambda key, ids: (
+        bodies if key == 'suggestive:d' else [None] * len(ids))
+    redis_backend.query('pa', words=True).should.equal([
+        'Pascal', 'Paníni', 'Pacific', 'Passion-Fruit'
+    ])
+
+
+def test_tokenize():
+    # Given that I have a document with repeated words and non string values
+    doc = {'id': 0, 'name': 'Rock-n-roll rock', 'bio': 'Rock, rock-n-roll!'}
+
+    # Then I see that each word shows up once, in the order they're found
+    suggestive.tokenize(doc).should.equal(
+        ['Rock-n-roll', 'rock', 'Rock', 'rock-n-roll'])
+
+    # And I see that the words can be looked up by their lower cased prefixes
+    by_prefix = suggestive.words_by_prefix(['Rock-n-roll', 'rock'])
+    by_prefix['r'].should.equal(['Rock-n-roll', 'rock'])
+    by_prefix['rock-'].should.equal(['Rock-n-roll'])
+
+    # And I see that `find_words_in_doc()` returns each word once too
+    suggestive.find_words_in_doc(doc, 'rock-').should.equal(
+        ['Rock-n-roll', 'rock-n-roll'])
+
 
 def test_redis_backend_indexing_empty_fields():
     # Given that I have an instance of our redis backend and some docs with
     # empty fields
-    conn = Mock()
-    pipe = conn.pipeline.return_value
+    conn = mock_redis()
     data = [{"id": 0, "name": ""}, {"id": 1, "name": "Clarete"}]
     backend = suggestive.RedisBackend(conn=conn)
-    backend.remove = Mock()     # We don't care about removing stuff here
 
     # When I try to index stuff
     backend.index(data, field='name', score='id')
 
-    # Then I see that the `sadd` command is not called when no terms are found
-    # inside of a field of a document
-    list(pipe.sadd.call_args_list).should.equal([
-        call('suggestive:dt:1',
-             'c', 'cl', 'cla', 'clar', 'clare', 'claret', 'clarete')
+    # Then I see that documents without terms are still stored, the script
+    # just won't add them to any term
+    [(doc_id, terms) for doc_id, _, _, terms in replaced(conn)].should.equal([
+        (0, []),
+        (1, ['c', 'cl', 'cla', 'clar', 'clare', 'claret', 'clarete']),
+    ])
+
+
+def test_dummy_backend_storing_only_some_fields():
+    # Given that I have an instance of our dummy backend
+    backend = suggestive.DummyBackend()
+
+    # When I index documents asking to store only their names
+    data = [{"id": 0, "name": "Lincoln", "bio": "Hacker", "score": 2}]
+    backend.index(data, field=['name', 'bio'], store=['name'])
+
+    # Then I see that only the name, the id and the score were stored
+    backend.documents().should.equal({
+        0: {"id": 0, "name": "Lincoln", "score": 2},
+    })
+
+    # And I see that the fields not stored were still indexed
+    backend.query('hac').should.equal([
+        {"id": 0, "name": "Lincoln", "score": 2},
     ])
 
 
+def test_codecs():
+    # Given that I have a document with non ascii text
+    doc = {'id': 0, 'name': 'Fábio Júnior', 'score': 12.5}
+
+    # When I encode and decode it with all the codecs
+    codecs = [
+        suggestive.JsonCodec(),
+        suggestive.MsgpackCodec(),
+        suggestive.CompressedCodec(),
+        suggestive.CompressedCodec(suggestive.MsgpackCodec(), level=9),
+    ]
+
+    # Then I see that I get the same document back
+    for codec in codecs:
+        codec.loads(codec.dumps(doc)).should.equal(doc)
+
+    # And I see that only json can be read by the lua scripts
+    [c.decodable_in_lua for c in codecs].should.equal(
+        [True, False, False, False])
+
+
+def test_redis_backend_with_codec_and_projection():
+    # Given that I have a redis backend storing documents with msgpack
+    conn = mock_redis()
+    codec = suggestive.MsgpackCodec()
+    backend = suggestive.RedisBackend(
+        conn=conn, codec=codec, scripted_queries=True)
+
+    # When I index a document storing only its name
+    data = [{"id": 0, "name": "Lincoln", "bio": "Hacker", "score": 2}]
+    backend.index(data, field='name', store=['name'])
+
+    # Then I see that the body sent to redis was the projected document
+    # encoded by the codec
+    stored = [(codec.loads(body), score)
+              for _, body, score, _ in replaced(conn)]
+    stored.should.equal([({"id": 0, "name": "Lincoln", "score": 2}, 2)])
+
+    # And when I query words, Then I see that the script finds them in the
+    # words hash, without walking bodies it can't decode
+    query = conn.scripts[suggestive.QUERY_SCRIPT]
+    query.return_value = [b'Lincoln', b'Li']
+    backend.query('li', words=True).should.equal(['Lincoln', 'Li'])
+    query.call_args[1]['args'][3:].should.equal(['li', '0'])
+
+    # And I see that the scores are decoded with the codec too
+    conn.hmget.return_value = [codec.dumps({"id": 0, "score": 2})]
+    backend.get_score(0).should.equal(2.0)
+
+
+def test_cached_backend():
+    # Given that I have a dummy backend wrapped by the cache
+    backend = suggestive.DummyBackend()
+    backend.query = Mock(wraps=backend.query)
+    cached = suggestive.CachedBackend(backend, size=2)
+    cached.index([
+        {"id": 0, "name": "Lincoln"},
+        {"id": 1, "name": "Livia"},
+    ], field='name', score='id')
+
+    # When I query the same thing twice
+    cached.query('Li').should.equal([
+        {"id": 0, "name": "Lincoln"}, {"id": 1, "name": "Livia"}])
+    cached.query('li').should.equal([
+        {"id": 0, "name": "Lincoln"}, {"id": 1, "name": "Livia"}])
+
+    # Then I see that the backend was asked only once
+    backend.query.call_count.should.equal(1)
+    (cached.hits, cached.misses).should.equal((1, 1))
+
+    # And I see that other parameters are cached separately
+    cached.query('li', limit=1).should.equal([{"id": 0, "name": "Lincoln"}])
+    backend.query.call_count.should.equal(2)
+
+    # And when more results than the size of the cache are kept, the least
+    # recently used one is dropped
+    cached.query('li')
+    cached.query('liv')
+    len(cached).should.equal(2)
+    cached.query('li', limit=1)
+    backend.query.call_count.should.equal(4)
+
+    # And I see that other methods are still available
+    cached.documents().should.have.length_of(2)
+
+
+def test_cached_backend_invalidation():
+    # Given that I have a cache with some results
+    cached = suggestive.CachedBackend(suggestive.DummyBackend())
+    cached.index([
+        {"id": 0, "name": "Lincoln"},
+        {"id": 1, "name": "Clarete"},
+    ], field='name', score='id')
+    cached.query('lin')
+    cached.query('c')
+
+    # When I index a document again, with a different name
+    cached.index([{"id": 0, "name": "Mingwei"}], field='name', score='id')
+
+    # Then I see that the results of its old and new terms were dropped
+    cached.query('lin').should.equal([])
+    cached.query('m').should.equal([{"id": 0, "name": "Mingwei"}])
+    cached.misses.should.equal(4)
+
+    # And I see that terms of other documents were kept
+    cached.query('c')
+    cached.hits.should.equal(1)
+
+    # And when I remove a document, its terms are dropped too
+    cached.remove(1)
+    cached.query('c').should.equal([])
+    cached.hits.should.equal(1)
+
+
+def test_cached_backend_invalidating_phrases():
+    # Given that I have a cache with the results of a phrase
+    cached = suggestive.CachedBackend(suggestive.DummyBackend())
+    cached.index([{"id": 0, "name": "John Smith"}], field='name', score='id')
+    cached.query('john s').should.have.length_of(1)
+
+    # When I index a document with only one of its words
+    cached.index([{"id": 1, "name": "Sam"}], field='name', score='id')
+
+    # Then I see that the phrase was dropped anyway
+    cached.query('john s').should.have.length_of(1)
+    cached.misses.should.equal(2)
+    len(cached).should.equal(1)
+
+
+def test_suggest_many():
+    # Given that I have a cached dummy backend with some data
+    backend = suggestive.DummyBackend()
+    cached = suggestive.CachedBackend(backend)
+    s = suggestive.Suggestive(backend=cached)
+    s.index([
+        {"id": 0, "name": "Lincoln"},
+        {"id": 1, "name": "Clarete"},
+    ], field='name', score='id')
+    cached.query('lin')
+
+    # When I ask for many suggestions at once
+    backend.query_many = Mock(wraps=backend.query_many)
+    s.suggest_many(['Lín', 'c', 'C', 'x']).should.equal([
+        [{"id": 0, "name": "Lincoln"}],
+        [{"id": 1, "name": "Clarete"}],
+        [{"id": 1, "name": "Clarete"}],
+        [],
+    ])
+
+    # Then I see that only the terms that missed the cache reached the
+    # backend, each one once, in a single batch
+    backend.query_many.call_count.should.equal(1)
+    sorted(backend.query_many.call_args[0][0]).should.equal(['c', 'x'])
+    cached.hits.should.equal(1)
+
+
+def test_redis_backend_terms():
+    # Given that I have a redis backend with two documents cached
+    conn = Mock()
+    pipe = conn.pipeline.return_value
+    pipe.execute.return_value = [{b'l', b'li'}, {'l', 'lu'}]
+    backend = suggestive.RedisBackend(conn=conn)
+
+    # When I ask for the terms of both, Then I see all of them, as text
+    backend.terms([0, 1]).should.equal({'l', 'li', 'lu'})
+
+    # And I see that the caches were read in one round trip
+    list(pipe.smembers.call_args_list).should.equal([
+        call('suggestive:dt:0'), call('suggestive:dt:1')])
+    pipe.execute.assert_called_once_with()
+
+
+def test_redis_backend_versioned_keys():
+    # Given that I have a versioned backend in its own namespace, and the
+    # version 3 of its index is active
+    conn = Mock()
+    conn.get.return_value = b'3'
+    backend = suggestive.RedisBackend(
+        conn=conn, namespace='people', versioned=True)
+
+    # When I read its keys, Then I see that they belong to the active
+    # version, which was read only once
+    backend.keys.for_term('li').should.equal('people:v3:d:li')
+    backend.keys.for_docs().should.equal('people:v3:d')
+    conn.get.assert_called_once_with('people:version')
+
+    # And I see that only the keys of versions match the cleanup pattern
+    keys = suggestive.KeyManager('people')
+    keys.for_versions().should.equal('people:v[0-9]*')
+    keys.version_of('people:v12:d:li').should.equal('12')
+
+
+def test_redis_backend_version_switched_during_query():
+    # Given that I have a versioned backend that reads the active version
+    # every time, and the active version changes after each read
+    conn = Mock()
+    conn.get.side_effect = [b'1', b'2', b'3', b'4']
+    conn.zrevrange.return_value = [b'1']
+    conn.hmget.return_value = [b'{"id": 1, "name": "Lisa"}']
+    backend = suggestive.RedisBackend(
+        conn=conn, namespace='people', versioned=True, version_ttl=0)
+
+    # When I query it
+    backend.query('li').should.equal([{'id': 1, 'name': 'Lisa'}])
+
+    # Then I see that the version was read once, and both the postings and
+    # the documents came from it
+    conn.get.assert_called_once_with('people:version')
+    conn.zrevrange.assert_called_once_with('people:v1:d:li', 0, -1)
+    conn.hmget.assert_called_once_with('people:v1:d', [b'1'])
+
+
+def test_redis_backend_sharded_keys():
+    # Given that I have an index split in 4 shards
+    conn = mock_redis()
+    backend = suggestive.RedisBackend(conn=conn, shards=4)
+
+    # When I index a document, Then I see that all its keys are in its
+    # shard, under the same hash tag
+    shard = suggestive.shard_of('abc', 4)
+    backend.index([{"id": "abc", "name": "Li", "score": 1}], field='name')
+    kwargs = conn.scripts[suggestive.REPLACE_SCRIPT].call_args[1]
+    kwargs['keys'].should.equal([
+        'suggestive:{%d}:d' % shard,
+        'suggestive:{%d}:dt:abc' % shard,
+        'suggestive:{%d}:w' % shard,
+    ])
+    kwargs['args'][1].should.equal('suggestive:{%d}:d:' % shard)
+
+    # And I see that sharded indexes can't run scripted queries
+    suggestive.RedisBackend.when.called_with(
+        conn=conn, shards=4, scripted_queries=True).should.throw(RuntimeError)
+
+
+def test_cached_backend_with_max_prefix_len():
+    # Given that I have a cache in front of a backend with short prefixes
+    cached = suggestive.CachedBackend(
+        suggestive.DummyBackend(max_prefix_len=3))
+    cached.index([{"id": 0, "name": "Lincoln"}], field='name', score='id')
+    cached.query('lincoln').should.have.length_of(1)
+
+    # When I index a document that shares only the stored prefix
+    cached.index([{"id": 1, "name": "Linus"}], field='name', score='id')
+
+    # Then I see that the results of the longer query were dropped too
+    cached.query('lincoln').should.have.length_of(2)
+    cached.hits.should.equal(0)
+
+
+def test_cached_backend_with_lex_terms():
+    # Given that I have a cache in front of a backend that keeps only the
+    # whole words of the documents
+    backend = Mock(lex_terms=True, max_prefix_len=None)
+    backend.query.return_value = [{"id": 0, "name": "Lincoln"}]
+    backend.terms.return_value = {'lincoln'}
+    cached = suggestive.CachedBackend(backend)
+    cached.query('li')
+
+    # When I remove the document, Then I see that the results of the
+    # prefixes of its words were dropped
+    cached.remove(0)
+    len(cached).should.equal(0)
+
+
+def test_cached_backend_ttl():
+    # Given that I have a cache that keeps results for 10 seconds
+    backend = suggestive.DummyBackend()
+    backend.query = Mock(wraps=backend.query)
+    cached = suggestive.CachedBackend(backend, ttl=10)
+
+    with patch('suggestive.time.time') as now:
+        # When I query before and after the results expire
+        now.return_value = 100
+        cached.query('li')
+        now.return_value = 109
+        cached.query('li')
+        now.return_value = 111
+        cached.query('li')
+
+    # Then I see that the backend was asked again after they expired
+    backend.query.call_count.should.equal(2)
+    (cached.hits, cached.misses).should.equal((1, 2))
+
+
 def test_suggestive_remove():
     # Given that we have an instance of suggestive with a fake backend
     backend = Mock()